@@ -28,6 +28,10 @@ setup(
         'setuptools',
         'Flask',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'ujson': ['ujson'],
+    },
     entry_points="""
     [console_scripts]
     flask-ctl = presence_analyzer.script:run
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Whole-company weekday aggregates: pure Python against NumPy backend.
+
+Computes weekday statistics of every user of sample_data.csv scaled up
+100 times, over the whole history and over one quarter of it.
+
+Usage: python -m presence_analyzer.benchmarks.aggregates [CSV] [SCALE]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from presence_analyzer import utils, vectorized
+from presence_analyzer.benchmarks.memory import SAMPLE_DATA_CSV
+from presence_analyzer.benchmarks.snapshot import write_scaled_csv
+
+
+def grouped_stats(data, first_day, last_day):
+    """
+    Computes aggregates with group_by_weekday and mean, as views did.
+    """
+    result = {}
+    for user_id, user in data.iteritems():
+        entries = dict(
+            (date, entry) for date, entry in user.iteritems()
+            if first_day <= date.toordinal() <= last_day
+        )
+        result[user_id] = [
+            utils.mean(intervals)
+            for intervals in utils.group_by_weekday(entries)
+        ]
+    return result
+
+
+def python_stats(data, first_day, last_day):
+    """
+    Computes aggregates with pure Python backend.
+    """
+    return dict(
+        (user_id, utils.weekday_stats(user, first_day, last_day))
+        for user_id, user in data.iteritems()
+    )
+
+
+def measure(name, aggregate, data, first_day, last_day, repeat=3):
+    """
+    Prints the best time of computing aggregates.
+    """
+    best = None
+    for _ in xrange(repeat):
+        started = time.time()
+        aggregate(data, first_day, last_day)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print '{:<26} {:>10.4f} s'.format(name, best)
+
+
+def main(path=SAMPLE_DATA_CSV, scale=100):
+    """
+    Runs the benchmark.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(directory, 'data.csv')
+        write_scaled_csv(path, csv_path, int(scale))
+        data = utils.load_data(csv_path)
+    finally:
+        shutil.rmtree(directory)
+
+    first_day = min(user.days[0] for user in data.itervalues())
+    last_day = max(user.days[-1] for user in data.itervalues())
+    quarter = (last_day - 91, last_day)
+    print 'users: {}, entries: {}'.format(
+        len(data), sum(len(user) for user in data.itervalues()),
+    )
+    for label, (first, last) in (
+            ('all', (first_day, last_day)), ('quarter', quarter),
+    ):
+        measure(
+            'group_by_weekday ' + label, grouped_stats, data, first, last, 1,
+        )
+        measure('python ' + label, python_stats, data, first, last)
+        if vectorized.available():
+            measure(
+                'numpy ' + label, vectorized.weekday_stats, data, first, last,
+            )
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Latency of cached data access under concurrency at cache expiry.
+
+50 threads read cached presence data in a loop while the cached value
+expires. Compares the global lock + cache decorators formerly wrapping
+get_data with utils.cache.
+
+Usage: python -m presence_analyzer.benchmarks.concurrency [CSV] [THREADS]
+"""
+import sys
+import threading
+import time
+from functools import wraps
+
+from presence_analyzer import utils
+from presence_analyzer.benchmarks.memory import SAMPLE_DATA_CSV
+
+
+def legacy_cache(expiration_time):
+    """
+    Global lock and cache decorators get_data used before utils.cache.
+    """
+    lock = threading.Lock()
+    cached = {}
+
+    def inner(method):
+        @wraps(method)
+        def wrapped():
+            with lock:
+                time_now = time.time()
+                if cached.get('time', time_now) > time_now:
+                    return cached['value']
+                cached['value'] = method()
+                cached['time'] = time_now + expiration_time
+                return cached['value']
+        wrapped.expire = lambda: cached.update(time=0)
+        return wrapped
+    return inner
+
+
+def percentile(values, fraction):
+    """
+    Returns given percentile of sorted values.
+    """
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(name, function, expire, threads, calls=10):
+    """
+    Calls function from many threads while it expires, prints latencies.
+    """
+    function()
+    start = threading.Event()
+    latencies = []
+
+    def worker():
+        """
+        Waits for start and records latency of every call.
+        """
+        start.wait()
+        for _ in xrange(calls):
+            called = time.time()
+            function()
+            latencies.append(time.time() - called)
+
+    workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+    for thread in workers:
+        thread.start()
+    expire()
+    start.set()
+    for thread in workers:
+        thread.join()
+
+    latencies.sort()
+    print '{:<12} p50 {:>8.3f} ms  p99 {:>8.3f} ms  max {:>8.3f} ms'.format(
+        name,
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000,
+        latencies[-1] * 1000,
+    )
+
+
+def main(path=SAMPLE_DATA_CSV, threads=50):
+    """
+    Runs the benchmark.
+    """
+    def load():
+        """
+        Parses whole CSV file.
+        """
+        return utils.load_data(path)
+
+    legacy = legacy_cache(600)(load)
+    measure('lock + cache', legacy, legacy.expire, int(threads))
+
+    cached = utils.cache(600, 'benchmark')(load)
+    measure(
+        'utils.cache', cached,
+        lambda: utils.TIME.update(benchmark=0), int(threads),
+    )
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
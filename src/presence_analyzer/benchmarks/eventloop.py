@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of the event loop server and Paste thread pool.
+
+Serves generated data from EventLoopServer and from Paste with thread
+pool configured as in deploy.ini (50 workers) and requests date ranges
+of every user from many client processes at once for a few seconds.
+Prints requests per second and percentiles of latency.
+
+Usage: python -m presence_analyzer.benchmarks.eventloop [USERS] [YEARS]
+           [CLIENTS] [DURATION]
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+from paste import httpserver
+
+from presence_analyzer import eventloop, main as presence_main
+from presence_analyzer.benchmarks.concurrency import percentile
+from presence_analyzer.benchmarks.generator import generate
+from presence_analyzer.benchmarks.prefork import client, request_paths
+
+ROW = '{:<10} {:>10.0f} {:>7.1f} ms {:>7.1f} ms {:>7.1f} ms'
+
+
+def paste_server(app):
+    """
+    Returns Paste server with thread pool as in deploy.ini.
+    """
+    server = httpserver.serve(
+        app, '127.0.0.1', 0, start_loop=False, use_threadpool=True,
+        threadpool_workers=50,
+        threadpool_options={'spawn_if_under': 5, 'max_requests': 200},
+    )
+    return server, server.server_address[1]
+
+
+def eventloop_server(app):
+    """
+    Returns event loop server.
+    """
+    server = eventloop.EventLoopServer(app, '127.0.0.1', 0)
+    signal.signal(signal.SIGTERM, server.stop)
+    return server, server.address[1]
+
+
+def measure(make_server, app, paths, clients, duration):
+    """
+    Runs server made by given function in a child process, returns
+    requests per second and sorted latencies.
+
+    Server is made in the child, threads of Paste pool don't survive fork.
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if not pid:
+        try:
+            os.close(read_end)
+            server, port = make_server(app)
+            os.write(write_end, str(port))
+            os.close(write_end)
+            server.serve_forever()
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    os.close(write_end)
+    port = int(os.read(read_end, 16))
+    os.close(read_end)
+    try:
+        client((port, paths, 0, 0.5))
+        pool = multiprocessing.Pool(clients)
+        started = time.time()
+        results = pool.map(client, [
+            (port, paths, i * len(paths) // clients, duration)
+            for i in xrange(clients)
+        ])
+        elapsed = time.time() - started
+        pool.close()
+        pool.join()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    latencies = sorted(sum(results, []))
+    return len(latencies) / elapsed, latencies
+
+
+def main(users=100, years=3, clients=20, duration=5):
+    """
+    Runs the benchmark.
+    """
+    directory = tempfile.mkdtemp()
+    app = presence_main.app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    try:
+        csv_path, xml_path = generate(directory, users, years, dirty=0)
+        app.config.update({
+            'DATA_CSV': csv_path,
+            'USERS_DB_FILE': xml_path,
+        })
+        paths = request_paths(int(users), float(years))
+        print '{} clients, {} paths'.format(clients, len(paths))
+        print '{:<10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'server', 'req/s', 'p50', 'p99', 'p99.9',
+        )
+        for name, make_server in (
+                ('paste', paste_server),
+                ('eventloop', eventloop_server),
+        ):
+            throughput, latencies = measure(
+                make_server, app, paths, int(clients), float(duration),
+            )
+            print ROW.format(
+                name,
+                throughput,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                percentile(latencies, 0.999) * 1000,
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
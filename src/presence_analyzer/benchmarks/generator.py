@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic presence data in the formats of sample_data.csv and users.xml.
+
+Data depends only on given parameters and seed, so benchmarks of two
+revisions run on the same rows. Given ratio of rows is dirty: headers,
+malformed and quoted rows or Windows line endings.
+
+Usage: python -m presence_analyzer.benchmarks.generator DIRECTORY
+           [USERS] [YEARS] [DIRTY]
+"""
+import datetime
+import os
+import random
+import sys
+
+from presence_analyzer.benchmarks.users import generate_users_xml
+
+FIRST_DAY = datetime.date(2011, 1, 3).toordinal()
+
+
+def presence_time(seconds):
+    """
+    Formats amount of seconds since midnight as HH:MM:SS.
+    """
+    return '{:02}:{:02}:{:02}'.format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60,
+    )
+
+
+def dirty_row(rnd, user_id, date, start, end):
+    """
+    Returns line the parser has to skip or take its slow path for.
+    """
+    kind = rnd.randrange(5)
+    if kind == 0:
+        return 'user_id,date,start,end\n'
+    if kind == 1:
+        return '{},{}-13-45,{},{}\n'.format(
+            user_id, date.year, presence_time(start), presence_time(end),
+        )
+    if kind == 2:
+        return '{},{},{}\n'.format(user_id, date, presence_time(start))
+    if kind == 3:
+        return '"{}","{}","{}","{}"\n'.format(
+            user_id, date, presence_time(start), presence_time(end),
+        )
+    return '{},{},{},{}\r\n'.format(
+        user_id, date, presence_time(start), presence_time(end),
+    )
+
+
+def generate_csv(path, users, years, dirty=0.0, seed=0):
+    """
+    Writes presence CSV file of given amount of users and years.
+
+    Users are present on most weekdays and rarely on weekends, they
+    arrive around 8:30 and stay for around 8 hours. Returns amount of
+    written lines.
+    """
+    rnd = random.Random(seed)
+    lines = 0
+    with open(path, 'w') as csvfile:
+        for user_id in xrange(users):
+            for day in xrange(FIRST_DAY, FIRST_DAY + int(years * 365)):
+                weekend = day % 7 in (6, 0)
+                if rnd.random() > (0.02 if weekend else 0.9):
+                    continue
+                start = int(min(max(rnd.gauss(8.5, 0.75), 5), 12) * 3600)
+                length = int(min(max(rnd.gauss(8, 1.5), 1), 11) * 3600)
+                end = min(start + length, 24 * 3600 - 1)
+                date = datetime.date.fromordinal(day)
+                if rnd.random() < dirty:
+                    csvfile.write(dirty_row(rnd, user_id, date, start, end))
+                else:
+                    csvfile.write('{},{},{},{}\n'.format(
+                        user_id, date, presence_time(start),
+                        presence_time(end),
+                    ))
+                lines += 1
+    return lines
+
+
+def generate(directory, users=100, years=3, dirty=0.01, seed=0):
+    """
+    Writes data.csv and users.xml to given directory, returns their paths.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    csv_path = os.path.join(directory, 'data.csv')
+    xml_path = os.path.join(directory, 'users.xml')
+    generate_csv(csv_path, int(users), float(years), float(dirty), seed)
+    generate_users_xml(xml_path, int(users))
+    return csv_path, xml_path
+
+
+def main(directory, users=100, years=3, dirty=0.01):
+    """
+    Generates the data.
+    """
+    for path in generate(directory, users, years, dirty):
+        print path
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Memory footprint of parsed presence data.
+
+Compares the nested dict structure formerly built by get_data with
+PresenceStore, both filled with sample_data.csv scaled up 100 times
+(every copy of the data gets its own range of user ids).
+
+Usage: python -m presence_analyzer.benchmarks.memory [CSV] [SCALE]
+"""
+import csv
+import datetime
+import os
+import sys
+import time
+from array import array
+
+from presence_analyzer.store import PresenceStore
+
+SAMPLE_DATA_CSV = os.path.join(
+    os.path.dirname(__file__),
+    '..', '..', '..', 'runtime', 'data', 'sample_data.csv',
+)
+
+
+def read_sample(path):
+    """
+    Reads (user_id, y, m, d, start, end) tuples from CSV file.
+    """
+    result = []
+    with open(path) as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) != 4:
+                continue
+            year, month, day = [int(i) for i in row[1].split('-')]
+            start = [int(i) for i in row[2].split(':')]
+            end = [int(i) for i in row[3].split(':')]
+            result.append((int(row[0]), year, month, day, start, end))
+    return result
+
+
+def scaled(sample, scale):
+    """
+    Repeats sample rows 'scale' times with distinct user ids.
+    """
+    offset = max(row[0] for row in sample) + 1
+    for copy in xrange(scale):
+        for user_id, year, month, day, start, end in sample:
+            yield user_id + copy * offset, year, month, day, start, end
+
+
+def build_nested(rows):
+    """
+    Builds the nested dict structure formerly returned by get_data.
+    """
+    data = {}
+    for user_id, year, month, day, start, end in rows:
+        data.setdefault(user_id, {})[datetime.date(year, month, day)] = {
+            'start': datetime.time(*start),
+            'end': datetime.time(*end),
+        }
+    return data
+
+
+def build_store(rows):
+    """
+    Builds PresenceStore from the same rows.
+    """
+    return PresenceStore.from_rows(
+        (
+            user_id,
+            datetime.date(year, month, day).toordinal(),
+            start[0] * 3600 + start[1] * 60 + start[2],
+            end[0] * 3600 + end[1] * 60 + end[2],
+        )
+        for user_id, year, month, day, start, end in rows
+    )
+
+
+def deep_sizeof(obj):
+    """
+    Calculates size in bytes of object and everything it references.
+    """
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending:
+        current = pending.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            pending.extend(current.iterkeys())
+            pending.extend(current.itervalues())
+        elif isinstance(current, (list, tuple)):
+            pending.extend(current)
+        elif isinstance(current, array):
+            continue
+        elif hasattr(current, '__dict__'):
+            pending.append(vars(current))
+    return size
+
+
+def measure(name, build, rows):
+    """
+    Builds structure and prints its size and build time.
+    """
+    started = time.time()
+    data = build(rows)
+    elapsed = time.time() - started
+    size = deep_sizeof(data)
+    print '{:<14} {:>10.1f} MiB {:>8.1f} B/row {:>8.2f} s'.format(
+        name, size / 1024.0 ** 2, float(size) / len(rows), elapsed,
+    )
+    return size
+
+
+def main(path=SAMPLE_DATA_CSV, scale=100):
+    """
+    Runs the benchmark.
+    """
+    rows = list(scaled(read_sample(path), int(scale)))
+    print 'rows: {}'.format(len(rows))
+    nested = measure('nested dict', build_nested, rows)
+    store = measure('PresenceStore', build_store, rows)
+    print 'ratio: {:.1f}x'.format(float(nested) / store)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
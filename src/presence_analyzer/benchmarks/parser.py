@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of presence CSV parsing.
+
+Compares the strict csv + strptime parsing formerly used by get_data with
+utils.read_rows on a synthetic file.
+
+Usage: python -m presence_analyzer.benchmarks.parser [ROWS]
+"""
+import csv
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+from presence_analyzer import utils
+
+
+def generate_csv(path, rows, users=1000):
+    """
+    Writes synthetic presence CSV file with given amount of rows.
+    """
+    rand = random.Random(rows)
+    first_day = datetime.date(2000, 1, 1).toordinal()
+    with open(path, 'w') as csvfile:
+        for i in xrange(rows):
+            day = datetime.date.fromordinal(first_day + i // users)
+            start = rand.randint(6 * 3600, 11 * 3600)
+            end = start + rand.randint(3600, 10 * 3600)
+            csvfile.write('{},{},{:02}:{:02}:{:02},{:02}:{:02}:{:02}\n'.format(
+                i % users, day,
+                start // 3600, start // 60 % 60, start % 60,
+                end // 3600, end // 60 % 60, end % 60,
+            ))
+
+
+def strict_rows(csvfile):
+    """
+    Parses CSV file the way get_data did before read_rows.
+    """
+    for row in csv.reader(csvfile, delimiter=','):
+        if len(row) != 4:
+            continue
+        try:
+            yield utils.parse_row(row)
+        except (ValueError, TypeError):
+            pass
+
+
+def measure(name, parse, path):
+    """
+    Parses whole file and prints parsing speed.
+    """
+    started = time.time()
+    with open(path) as csvfile:
+        count = sum(1 for _ in parse(csvfile))
+    elapsed = time.time() - started
+    print '{:<10} {:>10} rows {:>8.2f} s {:>12.0f} rows/s'.format(
+        name, count, elapsed, count / elapsed,
+    )
+    return count / elapsed
+
+
+def main(rows=5000000):
+    """
+    Runs the benchmark.
+    """
+    handle, path = tempfile.mkstemp(suffix='.csv')
+    os.close(handle)
+    try:
+        generate_csv(path, int(rows))
+        strict = measure('strict', strict_rows, path)
+        fast = measure('read_rows', utils.read_rows, path)
+        print 'speedup: {:.1f}x'.format(fast / strict)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
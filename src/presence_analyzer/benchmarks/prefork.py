@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of the pre-forking server by amount of worker processes.
+
+Serves generated data from PreforkServer with 1, 2, 4... workers up to
+the amount of CPUs and requests date ranges of every user from as many
+client processes for a few seconds. Date ranges differ, so responses are
+computed instead of reused from encoded bodies.
+
+Usage: python -m presence_analyzer.benchmarks.prefork [USERS] [YEARS]
+           [WORKERS] [CLIENTS] [DURATION]
+"""
+import datetime
+import httplib
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+from presence_analyzer import main as presence_main, prefork
+from presence_analyzer.benchmarks.concurrency import percentile
+from presence_analyzer.benchmarks.generator import FIRST_DAY, generate
+
+
+def request_paths(users, years):
+    """
+    Returns paths of date ranged views of every user and month.
+    """
+    paths = []
+    for month in xrange(int(years * 12)):
+        first = datetime.date.fromordinal(FIRST_DAY + month * 30)
+        for user_id in xrange(users):
+            paths.append(
+                '/api/v1/presence_start_end/{}?from={}'.format(user_id, first),
+            )
+    return paths
+
+
+def client(args):
+    """
+    Requests paths until duration passes, returns latencies.
+    """
+    port, paths, offset, duration = args
+    latencies = []
+    finish = time.time() + duration
+    i = offset
+    while time.time() < finish:
+        started = time.time()
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        connection.request('GET', paths[i % len(paths)])
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        assert response.status == 200, response.status
+        latencies.append(time.time() - started)
+        i += len(paths) // 7 + 1
+    return latencies
+
+
+def measure(app, workers, paths, clients, duration):
+    """
+    Runs server with given amount of workers, returns requests per second
+    and sorted latencies.
+    """
+    server = prefork.PreforkServer(app, '127.0.0.1', 0, workers=workers)
+    port = server.address[1]
+    pid = os.fork()
+    if not pid:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    server.server.server_close()
+    try:
+        client((port, paths, 0, 0.5))
+        pool = multiprocessing.Pool(clients)
+        started = time.time()
+        results = pool.map(client, [
+            (port, paths, i * len(paths) // clients, duration)
+            for i in xrange(clients)
+        ])
+        elapsed = time.time() - started
+        pool.close()
+        pool.join()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    latencies = sorted(sum(results, []))
+    return len(latencies) / elapsed, latencies
+
+
+def main(users=100, years=3, workers=None, clients=None, duration=5):
+    """
+    Runs the benchmark.
+    """
+    cpus = multiprocessing.cpu_count()
+    workers = int(workers or cpus)
+    clients = int(clients or max(workers * 2, 4))
+    directory = tempfile.mkdtemp()
+    app = presence_main.app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    try:
+        csv_path, xml_path = generate(directory, users, years, dirty=0)
+        app.config.update({
+            'DATA_CSV': csv_path,
+            'USERS_DB_FILE': xml_path,
+        })
+        paths = request_paths(int(users), float(years))
+        counts = sorted(set(
+            [2 ** i for i in xrange(workers.bit_length()) if 2 ** i <= workers]
+            + [workers]
+        ))
+        print '{} CPUs, {} clients, {} paths'.format(cpus, clients, len(paths))
+        print '{:>8} {:>10} {:>8} {:>10} {:>10}'.format(
+            'workers', 'req/s', 'speedup', 'p50', 'p99',
+        )
+        single = None
+        for count in counts:
+            throughput, latencies = measure(
+                app, count, paths, clients, float(duration),
+            )
+            single = single or throughput
+            print '{:>8} {:>10.0f} {:>7.2f}x {:>7.1f} ms {:>7.1f} ms'.format(
+                count,
+                throughput,
+                throughput / single,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000,
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
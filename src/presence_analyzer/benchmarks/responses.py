@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Requests per second of API endpoints through app.test_client().
+
+Serves every endpoint for a second from sample_data.csv scaled up 100
+times with the standard library and ujson encoders, once computing and
+encoding every response and once reusing encoded bodies of jsonify.
+
+Usage: python -m presence_analyzer.benchmarks.responses [CSV] [SCALE]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from presence_analyzer import main as presence_main, utils
+from presence_analyzer.benchmarks.memory import SAMPLE_DATA_CSV
+from presence_analyzer.benchmarks.snapshot import write_scaled_csv
+
+USERS_XML = os.path.join(os.path.dirname(SAMPLE_DATA_CSV), 'test_users.xml')
+
+ENDPOINTS = (
+    '/api/v1/mean_time_weekday/10',
+    '/api/v1/presence_weekday/10',
+    '/api/v1/presence_start_end/10',
+    '/api/v1/presence_start_end/10?from=2013-01-01&to=2013-06-30',
+    '/api/v1/presence_percentiles/10',
+    '/api/v1/weekday_stats?user_id=all',
+    '/api/v1/company/mean_time_weekday',
+    '/api/v1/company/arrivals',
+    '/api/v1/company/present_per_day',
+)
+
+
+def measure(client, path, encoded, duration=1.0):
+    """
+    Returns requests per second of given path.
+    """
+    client.get(path)
+    requests = 0
+    started = time.time()
+    while time.time() - started < duration:
+        if not encoded:
+            utils.ENCODED.clear()
+        response = client.get(path)
+        assert response.status_code == 200
+        requests += 1
+    return requests / (time.time() - started)
+
+
+def main(path=SAMPLE_DATA_CSV, scale=100):
+    """
+    Runs the benchmark.
+    """
+    encoders = ['json'] + (['ujson'] if utils.ujson is not None else [])
+    directory = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(directory, 'data.csv')
+        write_scaled_csv(path, csv_path, int(scale))
+        app = presence_main.app
+        app.config.update({
+            'DATA_CSV': csv_path,
+            'DATA_SNAPSHOT': False,
+            'USERS_DB_FILE': USERS_XML,
+        })
+        client = app.test_client()
+        print '{:<62} {:>8} {:>10} {:>10}'.format(
+            'req/s', 'encoder', 'computed', 'encoded',
+        )
+        for endpoint in ENDPOINTS:
+            for encoder in encoders:
+                app.config['JSON_ENCODER'] = encoder
+                print '{:<62} {:>8} {:>10.0f} {:>10.0f}'.format(
+                    endpoint,
+                    encoder,
+                    measure(client, endpoint, False),
+                    measure(client, endpoint, True),
+                )
+    finally:
+        app.config.pop('JSON_ENCODER', None)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Cold start time to the first served request with and without snapshot.
+
+Serves the first request of a fresh process (nothing loaded yet) from
+sample_data.csv scaled up 100 times, once parsing the CSV file and once
+reading a snapshot of it.
+
+Usage: python -m presence_analyzer.benchmarks.snapshot [CSV] [SCALE]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from presence_analyzer import main as presence_main, utils
+from presence_analyzer.benchmarks.memory import SAMPLE_DATA_CSV
+
+
+def write_scaled_csv(source, path, scale):
+    """
+    Writes CSV file repeating source rows with distinct user ids.
+    """
+    with open(source) as csvfile:
+        rows = [line.rstrip('\r\n').split(',', 1) for line in csvfile]
+    offset = max(int(user_id) for user_id, _ in rows) + 1
+    with open(path, 'w') as csvfile:
+        for copy in xrange(scale):
+            for user_id, rest in rows:
+                csvfile.write('{},{}\n'.format(
+                    int(user_id) + copy * offset, rest,
+                ))
+
+
+def first_request(client):
+    """
+    Serves first request of a fresh process, returns its duration.
+    """
+    utils.CACHE = {}
+    utils.TIME = {}
+    utils.LOADED = {}
+    started = time.time()
+    response = client.get('/api/v1/presence_weekday/10')
+    assert response.status_code == 200
+    return time.time() - started
+
+
+def main(path=SAMPLE_DATA_CSV, scale=100):
+    """
+    Runs the benchmark.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(directory, 'data.csv')
+        write_scaled_csv(path, csv_path, int(scale))
+        app = presence_main.app
+        app.config.update({'DATA_CSV': csv_path, 'DATA_SNAPSHOT': False})
+        client = app.test_client()
+        print 'CSV parse: {:>10.3f} s'.format(first_request(client))
+
+        utils.write_snapshot(utils.load_data(csv_path))
+        app.config.update({'DATA_SNAPSHOT': True})
+        print 'snapshot:  {:>10.3f} s'.format(first_request(client))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
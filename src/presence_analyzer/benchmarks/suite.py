@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of data loading and all API endpoints.
+
+Generates data with benchmarks.generator and measures:
+
+- get_data of a fresh process (cold), of cached data (warm) and after
+  cache expiry with unchanged file (refresh),
+- get_users_names of a fresh process and of cached users,
+- every /api/v1 view through app.test_client(), computing the response
+  and reusing encoded response,
+- requests from many threads at once.
+
+Results are seconds per call, written to JSON so two runs can be compared.
+
+Usage: python -m presence_analyzer.benchmarks.suite run RESULTS
+           [USERS] [YEARS] [DIRTY]
+       python -m presence_analyzer.benchmarks.suite compare OLD NEW
+"""
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from presence_analyzer import main as presence_main, utils, vectorized
+from presence_analyzer.benchmarks.concurrency import percentile
+from presence_analyzer.benchmarks.generator import generate
+
+# Query arguments of views which need them.
+VIEW_ARGS = {'weekday_stats_view': '?user_id=all'}
+
+
+def best_time(function, repeat=5, number=1):
+    """
+    Returns the best time of a single call out of given repeats.
+    """
+    best = None
+    for _ in xrange(repeat):
+        started = time.time()
+        for _ in xrange(number):
+            function()
+        elapsed = (time.time() - started) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def reset():
+    """
+    Forgets everything loaded and cached, as in a fresh process.
+    """
+    utils.CACHE.clear()
+    utils.TIME.clear()
+    utils.LOADED.clear()
+    utils.USERS.clear()
+    utils.ENCODED.clear()
+
+
+def api_paths(app, user_id):
+    """
+    Returns path of every /api/v1 view of given user.
+    """
+    paths = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if not rule.rule.startswith('/api/v1/'):
+            continue
+        path = rule.rule.replace('<int:user_id>', str(user_id))
+        paths.append(path + VIEW_ARGS.get(rule.endpoint, ''))
+    return paths
+
+
+def get(client, path):
+    """
+    Requests path and checks the response.
+    """
+    response = client.get(path)
+    assert response.status_code == 200, (path, response.status_code)
+
+
+def concurrent_requests(app, paths, threads, requests):
+    """
+    Requests paths from many threads, returns latencies.
+    """
+    start = threading.Event()
+    latencies = []
+
+    def worker(offset):
+        """
+        Waits for start and records latency of every request.
+        """
+        client = app.test_client()
+        start.wait()
+        for i in xrange(requests):
+            called = time.time()
+            get(client, paths[(offset + i) % len(paths)])
+            latencies.append(time.time() - called)
+
+    workers = [
+        threading.Thread(target=worker, args=(i,)) for i in xrange(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    start.set()
+    for thread in workers:
+        thread.join()
+    return sorted(latencies)
+
+
+def run(users=100, years=3, dirty=0.01, threads=20):
+    """
+    Runs all benchmarks, returns results.
+    """
+    app = presence_main.app
+    config = dict(app.config)
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        csv_path, xml_path = generate(directory, users, years, dirty)
+        app.config.update({
+            'DATA_CSV': csv_path,
+            'DATA_SNAPSHOT': False,
+            'USERS_DB_FILE': xml_path,
+        })
+
+        def cold(function):
+            """
+            Calls function in a state of fresh process.
+            """
+            reset()
+            function()
+
+        def refresh():
+            """
+            Calls get_data after its cache expired.
+            """
+            utils.TIME.clear()
+            utils.get_data()
+
+        results['get_data cold'] = best_time(
+            lambda: cold(utils.get_data), 3,
+        )
+        results['get_data warm'] = best_time(utils.get_data, 3, 10000)
+        results['get_data refresh'] = best_time(refresh, 3, 100)
+        results['get_users_names cold'] = best_time(
+            lambda: cold(utils.get_users_names), 3,
+        )
+        results['get_users_names warm'] = best_time(
+            utils.get_users_names, 3, 1000,
+        )
+
+        client = app.test_client()
+        paths = api_paths(app, 0)
+        for path in paths:
+            get(client, path)
+
+            def computed(path=path):
+                """
+                Requests path without encoded responses.
+                """
+                utils.ENCODED.clear()
+                get(client, path)
+
+            results['computed ' + path] = best_time(computed, 3, 10)
+            results['encoded ' + path] = best_time(
+                lambda path=path: get(client, path), 3, 100,
+            )
+
+        started = time.time()
+        latencies = concurrent_requests(app, paths, threads, 50)
+        results['concurrent request'] = (
+            (time.time() - started) / len(latencies)
+        )
+        results['concurrent p50'] = percentile(latencies, 0.5)
+        results['concurrent p99'] = percentile(latencies, 0.99)
+    finally:
+        reset()
+        app.config.clear()
+        app.config.update(config)
+        shutil.rmtree(directory)
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': vectorized.available(),
+        'ujson': utils.ujson is not None,
+        'parameters': {
+            'users': int(users),
+            'years': float(years),
+            'dirty': float(dirty),
+            'threads': int(threads),
+        },
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """
+    Returns lines comparing results of two runs.
+    """
+    lines = []
+    if old['parameters'] != new['parameters']:
+        lines.append('Warning: runs have different parameters')
+    for name in sorted(set(old['results']) | set(new['results'])):
+        before = old['results'].get(name)
+        after = new['results'].get(name)
+        if before is None or after is None:
+            lines.append('{:<58} {:>12} {:>12}'.format(
+                name, format_time(before), format_time(after),
+            ))
+            continue
+        lines.append('{:<58} {:>12} {:>12} {:>+7.1f}%'.format(
+            name,
+            format_time(before),
+            format_time(after),
+            (after - before) / before * 100 if before else 0,
+        ))
+    return lines
+
+
+def format_time(seconds):
+    """
+    Formats seconds in ms, or '-' when missing.
+    """
+    if seconds is None:
+        return '-'
+    return '{:.3f} ms'.format(seconds * 1000)
+
+
+def write_results(path, users=100, years=3, dirty=0.01):
+    """
+    Runs benchmarks and writes results to JSON file.
+    """
+    results = run(users, years, dirty)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    return results
+
+
+def read_results(path):
+    """
+    Reads results written by write_results.
+    """
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def main(action='run', *args):
+    """
+    Runs the benchmarks or compares results.
+    """
+    if action == 'compare':
+        old, new = args
+        for line in compare(read_results(old), read_results(new)):
+            print line
+        return
+    path = args[0] if args else 'bench.json'
+    results = write_results(path, *args[1:])
+    for name, seconds in sorted(results['results'].iteritems()):
+        print '{:<58} {:>12}'.format(name, format_time(seconds))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Peak memory and time of parsing users XML file.
+
+Compares etree.parse formerly used by get_users_names with the streaming
+utils.parse_users on a generated file. Every parser runs in its own
+forked process, so peak RSS of one doesn't affect the other.
+
+Usage: python -m presence_analyzer.benchmarks.users [USERS]
+"""
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from presence_analyzer import utils
+from presence_analyzer.utils import etree
+
+
+def generate_users_xml(path, users):
+    """
+    Writes users XML file in the format of users.xml.
+    """
+    with open(path, 'w') as xml_file:
+        xml_file.write(
+            '<intranet>\n    <server>\n'
+            '        <host>intranet.stxnext.pl</host>\n'
+            '        <port>443</port>\n'
+            '        <protocol>https</protocol>\n'
+            '    </server>\n    <users>\n'
+        )
+        for user_id in xrange(users):
+            xml_file.write(
+                '        <user id="{0}">\n'
+                '            <avatar>/api/images/users/{0}</avatar>\n'
+                '            <name>User {0}.</name>\n'
+                '        </user>\n'.format(user_id)
+            )
+        xml_file.write('    </users>\n</intranet>\n')
+
+
+def tree_users_names(path):
+    """
+    Parses users the way get_users_names did before parse_users.
+    """
+    users_data = {}
+    tree = etree.parse(path)
+    for user in tree.find('users'):
+        name = user.find('name').text
+        user_id = int(os.path.split(user.find('avatar').text)[1])
+        users_data.setdefault(user_id, {'name': name.encode("utf-8")})
+    return users_data
+
+
+def measure(name, parse, path):
+    """
+    Parses file in a child process and prints its peak RSS and time.
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        started = time.time()
+        count = len(parse(path))
+        elapsed = time.time() - started
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_end, '{} {} {}'.format(count, elapsed, peak))
+        os._exit(0)  # pylint: disable=protected-access
+
+    os.close(write_end)
+    count, elapsed, peak = os.read(read_end, 1024).split()
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    print '{:<18} {:>8} users {:>8.2f} s {:>8.1f} MiB peak RSS'.format(
+        name, count, float(elapsed), int(peak) / 1024.0,
+    )
+
+
+def main(users=500000):
+    """
+    Runs the benchmark.
+    """
+    handle, path = tempfile.mkstemp(suffix='.xml')
+    os.close(handle)
+    try:
+        generate_users_xml(path, int(users))
+        measure('etree.parse', tree_users_names, path)
+        measure('parse_users', utils.parse_users, path)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
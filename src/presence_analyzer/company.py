@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Company-wide aggregates of presence data.
+"""
+from itertools import izip
+
+from presence_analyzer import metrics
+from presence_analyzer.store import WeekdayStats
+
+# Width of bins of arrival time distribution in seconds.
+ARRIVAL_BIN = 15 * 60
+
+
+class GroupStats(object):
+    """
+    Aggregates of presence of a group of users.
+
+    Besides WeekdayStats of all entries it holds distribution of arrival
+    times (amount of entries starting in every ARRIVAL_BIN seconds since
+    midnight) and the number of users present on every day ordinal.
+    """
+    def __init__(self):
+        self.users = 0
+        self.weekdays = WeekdayStats()
+        self.arrivals = [0] * (24 * 3600 // ARRIVAL_BIN)
+        self.present = {}
+
+    def add(self, user):
+        """
+        Adds entries of UserPresence.
+        """
+        self.users += 1
+        self.weekdays.update(user.stats)
+        arrivals, present = self.arrivals, self.present
+        for day, start in izip(user.days, user.starts):
+            arrivals[start // ARRIVAL_BIN] += 1
+            present[day] = present.get(day, 0) + 1
+
+    def update(self, other):
+        """
+        Adds aggregates of other GroupStats and returns self.
+        """
+        self.users += other.users
+        self.weekdays.update(other.weekdays)
+        arrivals, present = self.arrivals, self.present
+        for i, count in enumerate(other.arrivals):
+            arrivals[i] += count
+        for day, count in other.present.iteritems():
+            present[day] = present.get(day, 0) + count
+        return self
+
+
+@metrics.AGGREGATION_DURATION.time(function='company_stats')
+def company_stats(data, group_of=None):
+    """
+    Aggregates presence of users in one pass over PresenceStore.
+
+    Returns dict of group to GroupStats, group of every user is given by
+    group_of function called with user_id. Without it all users are in
+    group None.
+    """
+    result = {}
+    for user_id, user in data.iteritems():
+        group = group_of(user_id) if group_of is not None else None
+        try:
+            stats = result[group]
+        except KeyError:
+            stats = result[group] = GroupStats()
+        stats.add(user)
+    return result
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite storage of presence data.
+
+Entries are kept in presence table with primary key (user_id, day), so
+queries of a single user and a date range use the index. SQLiteStore
+has the interface of PresenceStore: weekday aggregates are answered by
+grouped queries and columns of a user are read only when needed.
+"""
+import os
+import sqlite3
+import threading
+from array import array
+from collections import Mapping
+from itertools import islice
+
+from presence_analyzer import company
+from presence_analyzer.sketches import BIN_WIDTH, BINS, Histogram
+from presence_analyzer.store import (
+    MAX_DAY,
+    DataSource,
+    DerivedValues,
+    LazyUserPresence,
+    WeekdaySketches,
+    WeekdayStats,
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS presence (
+    user_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID
+'''
+
+# Weekday of day ordinal in SQL, see store.day_weekday.
+WEEKDAY = '(day + 6) % 7'
+
+WEEKDAY_STATS = '''
+SELECT {weekday}, COUNT(*), SUM(end - start), SUM(start), SUM(end)
+FROM presence
+WHERE user_id = ? AND day BETWEEN ? AND ?
+GROUP BY 1
+'''.format(weekday=WEEKDAY)
+
+ALL_WEEKDAY_STATS = '''
+SELECT user_id, {weekday}, COUNT(*), SUM(end - start), SUM(start), SUM(end)
+FROM presence
+WHERE day BETWEEN ? AND ?
+GROUP BY 1, 2
+'''.format(weekday=WEEKDAY)
+
+SKETCHES = '''
+SELECT {weekday}, start / {width}, end / {width}, COUNT(*)
+FROM presence
+WHERE user_id = ? AND day BETWEEN ? AND ?
+GROUP BY 1, 2, 3
+'''.format(weekday=WEEKDAY, width=BIN_WIDTH)
+
+# Numbers of groups of users of company stats, filled for every query.
+GROUPS = '''
+CREATE TEMP TABLE IF NOT EXISTS groups (
+    user_id INTEGER PRIMARY KEY,
+    number INTEGER NOT NULL
+)
+'''
+
+GROUP_WEEKDAY_STATS = '''
+SELECT number, {weekday}, COUNT(*), SUM(end - start), SUM(start), SUM(end)
+FROM presence JOIN groups USING (user_id)
+GROUP BY 1, 2
+'''.format(weekday=WEEKDAY)
+
+GROUP_ARRIVALS = '''
+SELECT number, start / {width}, COUNT(*)
+FROM presence JOIN groups USING (user_id)
+GROUP BY 1, 2
+'''.format(width=company.ARRIVAL_BIN)
+
+GROUP_PRESENT = '''
+SELECT number, day, COUNT(*)
+FROM presence JOIN groups USING (user_id)
+GROUP BY 1, 2
+'''
+
+# Amount of rows inserted by a single statement while importing.
+BATCH_SIZE = 10000
+
+
+def database_path(csv_path):
+    """
+    Returns default path of database imported from given CSV file.
+    """
+    return csv_path + '.sqlite'
+
+
+def connect(path):
+    """
+    Opens database and creates its schema.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute(SCHEMA)
+    return connection
+
+
+def import_rows(path, rows, batch_size=BATCH_SIZE):
+    """
+    Inserts (user_id, day, start, end) rows into database in batches.
+
+    Entries of days already present are replaced. All rows are inserted
+    in one transaction, readers see either none or all of them, and it's
+    synced like any other, so a crash during import doesn't corrupt the
+    database served by the application. Returns amount of inserted rows.
+    """
+    connection = connect(path)
+    count = 0
+    try:
+        with connection:
+            rows = iter(rows)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                connection.executemany(
+                    'INSERT OR REPLACE INTO presence VALUES (?, ?, ?, ?)',
+                    batch,
+                )
+                count += len(batch)
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    return count
+
+
+def stats_from_rows(rows):
+    """
+    Returns WeekdayStats of (weekday, count, interval, start, end) rows.
+    """
+    stats = WeekdayStats()
+    for weekday, count, intervals, starts, ends in rows:
+        stats.counts[weekday] = count
+        stats.intervals[weekday] = intervals
+        stats.starts[weekday] = starts
+        stats.ends[weekday] = ends
+    return stats
+
+
+class SQLiteStore(DerivedValues, Mapping):
+    """
+    Presence entries of all users in SQLite database, mapping user_id to
+    SQLiteUser.
+
+    Every thread uses its own connection. Store describes the database
+    file as it was when opened, source tells its version.
+    """
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise IOError('No such database: {}'.format(path))
+        self.path = path
+        stat = os.stat(path)
+        self.source = DataSource(
+            path=path,
+            inode=stat.st_ino,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            offset=stat.st_size,
+            tail='',
+        )
+        self.local = threading.local()
+        self.users = {}
+        self._user_ids = None
+
+    def connection(self):
+        """
+        Returns connection of the current thread.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = connect(self.path)
+        return connection
+
+    def query(self, sql, *args):
+        """
+        Returns all rows of given query.
+        """
+        return self.connection().execute(sql, args).fetchall()
+
+    def user_ids(self):
+        """
+        Returns sorted ids of all users.
+        """
+        if self._user_ids is None:
+            self._user_ids = [
+                user_id for user_id, in self.query(
+                    'SELECT DISTINCT user_id FROM presence ORDER BY 1',
+                )
+            ]
+        return self._user_ids
+
+    def all_weekday_stats(self, first_day=None, last_day=None):
+        """
+        Returns WeekdayStats of every user by one grouped query.
+
+        Users without entries between given days have empty stats.
+        """
+        rows = dict((user_id, []) for user_id in self.user_ids())
+        for row in self.query(
+                ALL_WEEKDAY_STATS,
+                first_day if first_day is not None else 0,
+                last_day if last_day is not None else MAX_DAY,
+        ):
+            rows[row[0]].append(row[1:])
+        return dict(
+            (user_id, stats_from_rows(user_rows))
+            for user_id, user_rows in rows.iteritems()
+        )
+
+    def __getitem__(self, user_id):
+        # users keep only aggregates, never columns of their entries
+        try:
+            return self.users[user_id]
+        except KeyError:
+            pass
+        # SQLite would convert numeric strings to integers
+        if not isinstance(user_id, (int, long)) or not self.query(
+                'SELECT 1 FROM presence WHERE user_id = ? LIMIT 1', user_id,
+        ):
+            raise KeyError(user_id)
+        user = self.users[user_id] = SQLiteUser(self, user_id)
+        return user
+
+    def __iter__(self):
+        return iter(self.user_ids())
+
+    def __len__(self):
+        return len(self.user_ids())
+
+    def __repr__(self):
+        return '<SQLiteStore: {}>'.format(self.path)
+
+
+class SQLiteUser(LazyUserPresence):
+    """
+    Presence entries of a single user in SQLite database.
+
+    Weekday aggregates and sketches are computed by grouped queries and
+    only those of all entries are kept. Columns are read by a query using
+    (user_id, day) index whenever an operation needs them.
+    """
+    def columns(self, first_day=None, last_day=None):
+        days, starts, ends = array('i'), array('i'), array('i')
+        for day, start, end in self.store.query(
+                'SELECT day, start, end FROM presence WHERE user_id = ? '
+                'AND day BETWEEN ? AND ? ORDER BY day',
+                self.user_id,
+                first_day if first_day is not None else 0,
+                last_day if last_day is not None else MAX_DAY,
+        ):
+            days.append(day)
+            starts.append(start)
+            ends.append(end)
+        return days, starts, ends
+
+    def weekday_stats(self, first_day=None, last_day=None):
+        """
+        Returns WeekdayStats of entries between given day ordinals.
+
+        Both bounds are inclusive, None means unbounded.
+        """
+        if first_day is None and last_day is None:
+            return self.stats
+        return stats_from_rows(self.store.query(
+            WEEKDAY_STATS,
+            self.user_id,
+            first_day if first_day is not None else 0,
+            last_day if last_day is not None else MAX_DAY,
+        ))
+
+    def sketches(self, first_day=None, last_day=None):
+        """
+        Returns WeekdaySketches of entries between given day ordinals.
+
+        Both bounds are inclusive, None means unbounded.
+        """
+        if first_day is None and last_day is None:
+            if self._sketches is None:
+                self._sketches = self.sketches(0, MAX_DAY)
+            return self._sketches
+        starts = [[0] * BINS for _ in range(7)]
+        ends = [[0] * BINS for _ in range(7)]
+        for weekday, start, end, count in self.store.query(
+                SKETCHES,
+                self.user_id,
+                first_day if first_day is not None else 0,
+                last_day if last_day is not None else MAX_DAY,
+        ):
+            starts[weekday][start] += count
+            ends[weekday][end] += count
+        return WeekdaySketches(
+            [Histogram(counts) for counts in starts],
+            [Histogram(counts) for counts in ends],
+        )
+
+
+def company_stats(data, group_of=None):
+    """
+    Aggregates company.GroupStats of SQLiteStore by grouped queries, see
+    company.company_stats.
+    """
+    result = {}
+    numbers = {}
+    connection = data.connection()
+    with connection:
+        connection.execute(GROUPS)
+        connection.execute('DELETE FROM groups')
+        for user_id in data.user_ids():
+            group = group_of(user_id) if group_of is not None else None
+            if group not in numbers:
+                numbers[group] = len(numbers)
+                result[group] = company.GroupStats()
+            result[group].users += 1
+            connection.execute(
+                'INSERT INTO groups VALUES (?, ?)', (user_id, numbers[group]),
+            )
+    # stats of group by its number in queries
+    stats = dict((numbers[group], result[group]) for group in numbers)
+    rows = {}
+    for row in connection.execute(GROUP_WEEKDAY_STATS):
+        rows.setdefault(row[0], []).append(row[1:])
+    for number, group_rows in rows.iteritems():
+        stats[number].weekdays = stats_from_rows(group_rows)
+    for number, arrival_bin, count in connection.execute(GROUP_ARRIVALS):
+        stats[number].arrivals[arrival_bin] = count
+    for number, day, count in connection.execute(GROUP_PRESENT):
+        stats[number].present[day] = count
+    return result
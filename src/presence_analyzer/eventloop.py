@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Event loop HTTP server of the app.
+
+EventLoopServer handles all connections in a single thread with asyncore:
+requests are read and responses written without blocking, so idle
+keep-alive connections and slow clients don't hold a thread of a pool.
+Views only compute from data already in memory. DATA_CSV and
+USERS_DB_FILE are read again and warmed by a background Executor every
+ASYNC_RELOAD_INTERVAL seconds while requests don't check them, so they
+never wait for a reload.
+
+Responses are the same as from Paste: the whole WSGI app is served, with
+keep-alive of HTTP/1.1 and HTTP/1.0 clients asking for it.
+"""
+import asynchat
+import asyncore
+import logging
+import Queue
+import socket
+import sys
+import threading
+import time
+from cStringIO import StringIO
+from email.utils import formatdate
+from urllib import unquote
+
+from presence_analyzer import refresher, utils
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Largest accepted head and body of a request.
+MAX_HEAD_SIZE = 64 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+SERVER_NAME = 'presence_analyzer'
+
+# Statuses of responses which never have a body.
+BODILESS = ('1', '204', '304')
+
+
+class Executor(object):
+    """
+    Runs submitted functions one by one in a background thread.
+    """
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function, *args):
+        """
+        Schedules call of function with given arguments.
+        """
+        self.queue.put((function, args))
+
+    def run(self):
+        """
+        Calls submitted functions until shut down.
+        """
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            function, args = task
+            try:
+                function(*args)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Background call of %s failed', function)
+
+    def shutdown(self):
+        """
+        Waits for submitted functions and stops the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+class EventLoopServer(asyncore.dispatcher):
+    """
+    Serves WSGI app of Flask app from an event loop, see module docstring.
+    """
+    def __init__(self, app, host, port, reload_interval=None, backlog=1024):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.app = app
+        self.reload_interval = (
+            reload_interval or app.config.get('ASYNC_RELOAD_INTERVAL', 10)
+        )
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(backlog)
+        self.address = self.socket.getsockname()
+        self.executor = None
+        self.reloading = threading.Event()
+        self.warmed = None
+        self.running = False
+
+    def serve_forever(self):
+        """
+        Loads the data and serves requests until stopped.
+        """
+        self.running = True
+        self.reload_data()
+        self.executor = Executor()
+        next_reload = time.time() + self.reload_interval
+        try:
+            while self.running:
+                asyncore.loop(0.1, True, self.map, 1)
+                if time.time() >= next_reload:
+                    next_reload = time.time() + self.reload_interval
+                    if not self.reloading.is_set():
+                        self.reloading.set()
+                        self.executor.submit(self.reload_data)
+        finally:
+            self.executor.shutdown()
+            asyncore.close_all(self.map)
+            refresher.unwatch()
+
+    def stop(self, signum=None, frame=None):  # pylint: disable=unused-argument
+        """
+        Makes serve_forever return.
+        """
+        self.running = False
+
+    def reload_data(self):
+        """
+        Loads and warms changes of presence data and users.
+
+        Data replaces the cache of get_data only once it's warmed and both
+        files are marked as watched, see refresher, so requests in the
+        event loop never read them.
+        """
+        try:
+            data = utils.read_data()
+            if data is not self.warmed:
+                utils.warm_data(data)
+                self.warmed = data
+            utils.watch_data(data)
+            path = self.app.config['USERS_DB_FILE']
+            utils.read_users_directory(path)
+            utils.USERS['watched'] = path
+        finally:
+            self.reloading.clear()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            HTTPChannel(self, *pair)
+
+    def handle_error(self):
+        log.exception('Error of listening socket')
+
+
+class HTTPChannel(asynchat.async_chat):
+    """
+    Connection of a client, reads requests and writes their responses.
+    """
+    ac_in_buffer_size = 64 * 1024
+    ac_out_buffer_size = 64 * 1024
+
+    def __init__(self, server, connection, address):
+        asynchat.async_chat.__init__(self, connection, map=server.map)
+        self.server = server
+        self.address = address
+        self.received = []
+        self.received_size = 0
+        self.head = None
+        self.closing = False
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        if self.closing:
+            return
+        self.received.append(data)
+        self.received_size += len(data)
+        if self.head is None and self.received_size > MAX_HEAD_SIZE:
+            self.respond_error('431 Request Header Fields Too Large')
+
+    def found_terminator(self):
+        data = ''.join(self.received)
+        self.received = []
+        self.received_size = 0
+        if self.head is None:
+            head = data.lstrip('\r\n')
+            if not head:
+                return
+            length = content_length(head)
+            if length is None or length > MAX_BODY_SIZE:
+                self.respond_error('400 Bad Request')
+                return
+            if length:
+                self.head = head
+                self.set_terminator(length)
+                return
+            body = ''
+        else:
+            head, body = self.head, data
+            self.head = None
+            self.set_terminator('\r\n\r\n')
+        self.handle_request(head, body)
+
+    def handle_request(self, head, body):
+        """
+        Calls the app with given request and pushes its response.
+        """
+        lines = head.split('\r\n')
+        try:
+            method, target, protocol = lines[0].split()
+        except ValueError:
+            self.respond_error('400 Bad Request')
+            return
+        headers = parse_headers(lines[1:])
+        environ = self.environ(method, target, protocol, headers, body)
+        try:
+            status, response_headers, response_body = call_application(
+                self.server.app, environ,
+            )
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Error handling %s %s', method, target)
+            self.respond_error('500 Internal Server Error')
+            return
+
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if protocol == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+        names = set(name.lower() for name, _ in response_headers)
+        response_headers = list(response_headers)
+        if 'content-length' not in names and not status.startswith(BODILESS):
+            response_headers.append(
+                ('Content-Length', str(len(response_body))),
+            )
+        if 'date' not in names:
+            response_headers.append(('Date', formatdate(usegmt=True)))
+        if 'server' not in names:
+            response_headers.append(('Server', SERVER_NAME))
+        if not keep_alive:
+            response_headers.append(('Connection', 'close'))
+        elif protocol != 'HTTP/1.1':
+            response_headers.append(('Connection', 'keep-alive'))
+        if method == 'HEAD':
+            response_body = ''
+        self.push(format_response(
+            'HTTP/1.1' if protocol == 'HTTP/1.1' else 'HTTP/1.0',
+            status, response_headers, response_body,
+        ))
+        if not keep_alive:
+            self.close_when_done()
+
+    def environ(self, method, target, protocol, headers, body):
+        """
+        Returns WSGI environ of given request.
+        """
+        path, _, query = target.partition('?')
+        host, port = self.server.address[:2]
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': host,
+            'SERVER_PORT': str(port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': self.address[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': StringIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+        return environ
+
+    def respond_error(self, status):
+        """
+        Pushes response with given error status and closes connection.
+        """
+        self.push(format_response(
+            'HTTP/1.0', status,
+            [('Content-Type', 'text/plain'), ('Connection', 'close')],
+            status,
+        ))
+        self.close_when_done()
+        self.closing = True
+        self.set_terminator(None)
+
+    def handle_error(self):
+        log.exception('Error of connection from %s', self.address)
+        self.close()
+
+
+def content_length(head):
+    """
+    Returns Content-Length of request with given head, None if invalid.
+    """
+    for name, value in parse_headers(head.split('\r\n')[1:]):
+        if name.lower() == 'content-length':
+            try:
+                length = int(value)
+            except ValueError:
+                return None
+            return length if length >= 0 else None
+    return 0
+
+
+def parse_headers(lines):
+    """
+    Returns (name, value) pairs of given header lines.
+    """
+    headers = []
+    for line in lines:
+        if line[:1] in (' ', '\t') and headers:
+            name, value = headers.pop()
+            headers.append((name, value + ' ' + line.strip()))
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            headers.append((name.strip(), value.strip()))
+    return headers
+
+
+def call_application(app, environ):
+    """
+    Calls WSGI application, returns status, headers and the whole body.
+    """
+    response = []
+    body = []
+
+    def start_response(status, headers, exc_info=None):
+        """
+        Records status and headers of the response.
+        """
+        if exc_info is not None and response:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        response[:] = [status, headers]
+        return body.append
+
+    app_iter = app(environ, start_response)
+    try:
+        body.extend(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    return response[0], response[1], ''.join(body)
+
+
+def format_response(protocol, status, headers, body):
+    """
+    Returns response in HTTP wire format.
+    """
+    lines = ['{} {}'.format(protocol, status)]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers)
+    return '\r\n'.join(lines) + '\r\n\r\n' + body
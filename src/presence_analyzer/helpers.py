@@ -2,3 +2,39 @@
 """
 Helper functions used in templates.
 """
+import hashlib
+import os
+
+from flask import url_for
+
+from presence_analyzer.main import app
+
+# Modification time and digest of content of static files by path.
+DIGESTS = {}
+
+
+def static_digest(filename):
+    """
+    Returns short digest of content of given static file.
+
+    Digest is computed again only when modification time of the file
+    changes. Returns None when there's no such file.
+    """
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = DIGESTS.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as static_file:
+            digest = hashlib.md5(static_file.read()).hexdigest()[:12]
+        cached = DIGESTS[path] = (mtime, digest)
+    return cached[1]
+
+
+def static_url(filename):
+    """
+    Returns URL of static file, which changes along with its content.
+    """
+    return url_for('static', filename=filename, v=static_digest(filename))
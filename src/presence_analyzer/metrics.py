@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Counters and histograms of the application in Prometheus text format.
+
+Metrics are kept in memory of the process, updating one takes a few dict
+operations of the current thread and no lock, so they stay enabled in
+production.
+"""
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds of buckets of duration histograms in seconds.
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# All metrics in order of their creation, see render.
+REGISTRY = []
+# Guards lists of values of threads, see Metric.
+LOCK = threading.Lock()
+
+
+class Metric(object):
+    """
+    Base of metrics, values of every combination of labels.
+
+    Every thread updates its own values, so updates don't take any lock
+    and threads handling requests aren't serialized by metrics. Values of
+    all threads are added up when the metric is rendered. Values of
+    finished threads are merged into retired ones whenever a thread is
+    added or the metric is rendered, so replaced threads of a pool don't
+    pile up.
+    """
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.local = threading.local()
+        self.shards = []
+        self.retired = {}
+        REGISTRY.append(self)
+
+    def shard(self):
+        """
+        Returns dict of values of the current thread.
+        """
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            with LOCK:
+                self.retire()
+                self.shards.append((threading.current_thread(), values))
+            return values
+
+    def retire(self):
+        """
+        Merges values of finished threads into retired ones, LOCK must be
+        held.
+        """
+        shards = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                shards.append((thread, shard))
+            else:
+                self.merge(self.retired, shard)
+        self.shards = shards
+
+    def collect(self):
+        """
+        Returns dict of labels to values added up from all threads.
+        """
+        with LOCK:
+            self.retire()
+            shards = [shard for _, shard in self.shards]
+            values = self.merge({}, self.retired)
+        for shard in shards:
+            self.merge(values, shard)
+        return values
+
+    def merge(self, values, shard):
+        """
+        Adds values of a thread to given dict and returns it.
+        """
+        for labels, value in shard.items():
+            values[labels] = self.add(values.get(labels), value)
+        return values
+
+    def add(self, total, value):
+        """
+        Returns sum of values of two threads, total may be None.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value for every combination of labels.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increases value of given labels.
+        """
+        key = tuple(sorted(labels.items()))
+        values = self.shard()
+        values[key] = values.get(key, 0) + amount
+
+    def add(self, total, value):
+        return (total or 0) + value
+
+    def samples(self):
+        """
+        Returns (suffix, labels, value) tuples of all values.
+        """
+        return [
+            ('', labels, value)
+            for labels, value in sorted(self.collect().items())
+        ]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values for every combination of labels.
+
+    For every labels it holds amount of values in every bucket, their
+    sum and count.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=DURATION_BUCKETS):
+        Metric.__init__(self, name, description)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        """
+        Records value for given labels.
+        """
+        key = tuple(sorted(labels.items()))
+        bucket = bisect_left(self.buckets, value)
+        values = self.shard()
+        try:
+            counts, total = values[key]
+        except KeyError:
+            counts, total = [0] * (len(self.buckets) + 1), 0
+        counts[bucket] += 1
+        values[key] = (counts, total + value)
+
+    def add(self, total, value):
+        if total is None:
+            return list(value[0]), value[1]
+        counts = [a + b for a, b in zip(total[0], value[0])]
+        return counts, total[1] + value[1]
+
+    def time(self, **labels):
+        """
+        Decorator observing duration of calls of decorated function.
+        """
+        def inner(function):
+            @wraps(function)
+            def wrapped(*args, **kwargs):
+                """
+                This docstring will be overridden by @wraps decorator.
+                """
+                started = time.time()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.time() - started, **labels)
+            return wrapped
+        return inner
+
+    def samples(self):
+        """
+        Returns (suffix, labels, value) tuples of cumulative buckets, sum
+        and count of all labels.
+        """
+        result = []
+        for labels, (counts, total) in sorted(self.collect().items()):
+            cumulative = 0
+            bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                result.append(
+                    ('_bucket', labels + (('le', bound),), cumulative),
+                )
+            result.append(('_sum', labels, total))
+            result.append(('_count', labels, cumulative))
+        return result
+
+
+def render():
+    """
+    Returns all metrics in Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP {} {}'.format(metric.name, metric.description))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for suffix, labels, value in metric.samples():
+            lines.append('{}{}{} {}'.format(
+                metric.name, suffix, format_labels(labels), repr(value),
+            ))
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """
+    Formats (name, value) pairs of labels.
+    """
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'),
+        )
+        for name, value in labels
+    ))
+
+
+REQUEST_DURATION = Histogram(
+    'presence_request_duration_seconds',
+    'Time of handling API requests by endpoint.',
+)
+NOT_MODIFIED = Counter(
+    'presence_not_modified_total',
+    'API requests answered with 304 Not Modified by endpoint.',
+)
+ENCODED_CACHE = Counter(
+    'presence_encoded_cache_total',
+    'Lookups of encoded API responses by result.',
+)
+JSON_ENCODE_DURATION = Histogram(
+    'presence_json_encode_seconds',
+    'Time of encoding API responses to JSON.',
+)
+CACHE = Counter(
+    'presence_cache_total',
+    'Lookups of cached values by function and result.',
+)
+CACHE_LOCK_WAIT = Histogram(
+    'presence_cache_lock_wait_seconds',
+    'Time of waiting for cached values being computed by function.',
+)
+ROWS_PARSED = Counter(
+    'presence_rows_parsed_total',
+    'Lines of presence CSV file parsed.',
+)
+PARSE_DURATION = Histogram(
+    'presence_parse_seconds',
+    'Time of loading presence data by mode (full or append).',
+)
+AGGREGATION_DURATION = Histogram(
+    'presence_aggregation_seconds',
+    'Time of computing aggregates by function.',
+)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Presence data partitioned by month.
+
+Partitioned data is a directory with CSV file of every month and MANIFEST
+describing them: days covered by every partition and WeekdayStats of every
+user in it. PartitionedStore answers weekday aggregates of whole partitions
+from the manifest and loads a partition only when a query needs its
+entries, e.g. a date range starting within the month or percentiles.
+Loaded partitions are kept until their estimated size exceeds the memory
+budget, then the least recently used ones are evicted, so memory follows
+the working set instead of the whole history.
+"""
+import datetime
+import filecmp
+import json
+import logging
+import os
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Mapping, OrderedDict, namedtuple
+
+from presence_analyzer import company
+from presence_analyzer.store import (
+    MAX_DAY,
+    DataSource,
+    DerivedValues,
+    LazyUserPresence,
+    WeekdaySketches,
+    WeekdayStats,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+MANIFEST = 'manifest.json'
+
+# Estimated memory of a loaded entry: its columns and weekday index.
+ENTRY_SIZE = 40
+
+# Default memory budget of loaded partitions in bytes.
+BUDGET = 64 * 1024 * 1024
+
+# Partition described by manifest: its CSV file, first and last day of its
+# entries, their amount and WeekdayStats of every user.
+Partition = namedtuple(
+    'Partition', ['name', 'path', 'first_day', 'last_day', 'rows', 'stats'],
+)
+
+
+def partitions_path(csv_path):
+    """
+    Returns default directory of partitions split from given CSV file.
+    """
+    return csv_path + '.partitions'
+
+
+def manifest_path(directory):
+    """
+    Returns path of manifest of partitions in given directory.
+    """
+    return os.path.join(directory, MANIFEST)
+
+
+def partition_path(directory, name):
+    """
+    Returns path of CSV file of given partition.
+    """
+    return os.path.join(directory, name + '.csv')
+
+
+def partition_name(day):
+    """
+    Returns name of partition (YYYY-MM) holding given day ordinal.
+    """
+    return datetime.date.fromordinal(day).strftime('%Y-%m')
+
+
+def format_row(user_id, day, start, end):
+    """
+    Formats presence entry as a line of CSV file.
+    """
+    return '{},{},{:02}:{:02}:{:02},{:02}:{:02}:{:02}\n'.format(
+        user_id,
+        datetime.date.fromordinal(day).isoformat(),
+        start // 3600, start // 60 % 60, start % 60,
+        end // 3600, end // 60 % 60, end % 60,
+    )
+
+
+def write_partitions(directory, rows):
+    """
+    Writes (user_id, day, start, end) rows into CSV file of every month.
+
+    Files are written under temporary names, see replace_partitions.
+    Returns dict of partition names to paths of written files.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = {}
+    files = {}
+    try:
+        for row in rows:
+            name = partition_name(row[1])
+            try:
+                output = files[name]
+            except KeyError:
+                paths[name] = partition_path(directory, '.' + name)
+                output = files[name] = open(paths[name], 'wb')
+            output.write(format_row(*row))
+    finally:
+        for output in files.itervalues():
+            output.close()
+    return paths
+
+
+def describe(name, path, data):
+    """
+    Returns manifest entry of partition loaded into PresenceStore.
+    """
+    users = [user for user in data.itervalues() if len(user)]
+    return {
+        'name': name,
+        'file': os.path.basename(path),
+        'first_day': min(user.days[0] for user in users) if users else 0,
+        'last_day': max(user.days[-1] for user in users) if users else 0,
+        'rows': sum(len(user) for user in data.itervalues()),
+        'users': dict(
+            (str(user_id), [
+                list(user.stats.counts),
+                list(user.stats.intervals),
+                list(user.stats.starts),
+                list(user.stats.ends),
+            ])
+            for user_id, user in data.iteritems()
+        ),
+    }
+
+
+def replace_partitions(directory, paths):
+    """
+    Moves written partition files in place of previous ones.
+
+    Files which didn't change are kept, so stores keep their loaded
+    partitions.
+    """
+    for name, path in paths.iteritems():
+        target = partition_path(directory, name)
+        if os.path.exists(target) and filecmp.cmp(path, target, False):
+            os.remove(path)
+        else:
+            os.rename(path, target)
+
+
+def read_manifest(directory):
+    """
+    Returns source of manifest in given directory and its Partitions
+    sorted by date.
+    """
+    path = manifest_path(directory)
+    with open(path, 'rb') as manifest_file:
+        stat = os.fstat(manifest_file.fileno())
+        manifest = json.load(manifest_file)
+    source = DataSource(
+        path=path,
+        inode=stat.st_ino,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        offset=stat.st_size,
+        tail='',
+    )
+    partitions = [
+        Partition(
+            name=entry['name'],
+            path=os.path.join(directory, entry['file']),
+            first_day=entry['first_day'],
+            last_day=entry['last_day'],
+            rows=entry['rows'],
+            stats=dict(
+                (int(user_id), WeekdayStats(*stats))
+                for user_id, stats in entry['users'].iteritems()
+            ),
+        )
+        for entry in manifest['partitions']
+    ]
+    partitions.sort(key=lambda partition: partition.first_day)
+    return source, partitions
+
+
+def is_current(source, path):
+    """
+    Checks if source describes the file at given path as it is now.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return source[:4] == (path, stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class PartitionedStore(DerivedValues, Mapping):
+    """
+    Presence entries of all users in partitions, mapping user_id to
+    PartitionedUser.
+
+    Partitions are loaded by given load function called with path of the
+    CSV file. Loaded partitions of previous store which didn't change are
+    kept, see module docstring for the rest.
+    """
+    def __init__(self, directory, load, budget=BUDGET, previous=None):
+        self.directory = directory
+        self.source, self.partitions = read_manifest(directory)
+        self.load = load
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()
+        self.loaded_size = 0
+        self.sizes = dict(
+            (partition.name, partition.rows * ENTRY_SIZE)
+            for partition in self.partitions
+        )
+
+        partitions_of = {}
+        for partition in self.partitions:
+            for user_id in partition.stats:
+                partitions_of.setdefault(user_id, []).append(partition)
+        self.users = dict(
+            (user_id, PartitionedUser(self, user_id, user_partitions))
+            for user_id, user_partitions in partitions_of.iteritems()
+        )
+        if previous is not None:
+            for partition in self.partitions:
+                data = previous.loaded.get(partition.name)
+                if data is not None and is_current(
+                        data.source, partition.path):
+                    self.keep(partition, data)
+
+    def partition(self, partition):
+        """
+        Returns PresenceStore of given Partition, loading it if needed.
+        """
+        with self.lock:
+            data = self.loaded.pop(partition.name, None)
+            if data is not None:
+                self.loaded[partition.name] = data
+                return data
+        data = self.load(partition.path)
+        log.debug('Loaded partition %s', partition.name)
+        with self.lock:
+            return self.keep(partition, data)
+
+    def keep(self, partition, data):
+        """
+        Keeps loaded partition and evicts least recently used ones over the
+        budget. Returns kept PresenceStore of the partition.
+        """
+        if partition.name in self.loaded:
+            return self.loaded[partition.name]
+        self.loaded[partition.name] = data
+        self.loaded_size += self.sizes[partition.name]
+        while self.loaded_size > self.budget and len(self.loaded) > 1:
+            name, _ = self.loaded.popitem(last=False)
+            self.loaded_size -= self.sizes[name]
+            log.debug('Evicted partition %s', name)
+        return data
+
+    def __getitem__(self, user_id):
+        return self.users[user_id]
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+    def __repr__(self):
+        return '<PartitionedStore: {}>'.format(self.directory)
+
+
+class PartitionedUser(LazyUserPresence):
+    """
+    Presence entries of a single user in partitions.
+
+    Aggregates of partitions within queried dates come from the manifest,
+    only partitions crossed by bounds of the dates are loaded. Columns
+    concatenate entries of all partitions of the user.
+    """
+    def __init__(self, store, user_id, partitions):
+        LazyUserPresence.__init__(self, store, user_id)
+        self.partitions = partitions
+
+    def entries(self, partition):
+        """
+        Returns UserPresence of the user in given Partition.
+        """
+        return self.store.partition(partition)[self.user_id]
+
+    def overlapping(self, first_day, last_day):
+        """
+        Returns Partitions of the user with entries between given days.
+        """
+        return [
+            partition for partition in self.partitions
+            if partition.first_day <= last_day and
+            partition.last_day >= first_day
+        ]
+
+    def columns(self, first_day=None, last_day=None):
+        first_day = first_day if first_day is not None else 0
+        last_day = last_day if last_day is not None else MAX_DAY
+        days, starts, ends = array('i'), array('i'), array('i')
+        for partition in self.overlapping(first_day, last_day):
+            entries = self.entries(partition)
+            first = bisect_left(entries.days, first_day)
+            last = bisect_right(entries.days, last_day)
+            days.extend(entries.days[first:last])
+            starts.extend(entries.starts[first:last])
+            ends.extend(entries.ends[first:last])
+        return days, starts, ends
+
+    def weekday_stats(self, first_day=None, last_day=None):
+        """
+        Returns WeekdayStats of entries between given day ordinals.
+
+        Both bounds are inclusive, None means unbounded.
+        """
+        if first_day is None and last_day is None:
+            return self.stats
+        first_day = first_day if first_day is not None else 0
+        last_day = last_day if last_day is not None else MAX_DAY
+        stats = WeekdayStats()
+        for partition in self.overlapping(first_day, last_day):
+            if (first_day <= partition.first_day and
+                    partition.last_day <= last_day):
+                stats.update(partition.stats[self.user_id])
+            else:
+                stats.update(self.entries(partition).weekday_stats(
+                    first_day, last_day,
+                ))
+        return stats
+
+    def sketches(self, first_day=None, last_day=None):
+        """
+        Returns WeekdaySketches of entries between given day ordinals.
+
+        Both bounds are inclusive, None means unbounded. Sketches of all
+        entries are kept after the first query.
+        """
+        if first_day is None and last_day is None:
+            if self._sketches is None:
+                self._sketches = self.sketches(0, MAX_DAY)
+            return self._sketches
+        first_day = first_day if first_day is not None else 0
+        last_day = last_day if last_day is not None else MAX_DAY
+        sketches = WeekdaySketches()
+        for partition in self.overlapping(first_day, last_day):
+            # explicit bounds, so sketches aren't kept by the partition
+            sketches.update(self.entries(partition).sketches(
+                max(first_day, partition.first_day),
+                min(last_day, partition.last_day),
+            ))
+        return sketches
+
+
+def company_stats(data, group_of=None):
+    """
+    Aggregates company.GroupStats of PartitionedStore one partition at a
+    time, see company.company_stats.
+    """
+    result = {}
+    for partition in data.partitions:
+        for group, stats in company.company_stats(
+                data.partition(partition), group_of).iteritems():
+            if group in result:
+                result[group].update(stats)
+            else:
+                result[group] = stats
+    # users of many partitions were counted in every one of them
+    for stats in result.itervalues():
+        stats.users = 0
+    for user_id in data:
+        result[group_of(user_id) if group_of is not None else None].users += 1
+    return result
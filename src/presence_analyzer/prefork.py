@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-forking HTTP server sharing presence data between worker processes.
+
+The parent process loads presence data, writes its snapshot and binds the
+listening socket, then forks PREFORK_WORKERS workers (one per CPU by
+default) accepting connections on the shared socket. Workers don't parse
+the CSV file, they map the snapshot read-only (DATA_SHARED), so pages of
+the data are shared by all of them instead of each holding its own copy.
+
+Every PREFORK_RELOAD_INTERVAL seconds the parent checks DATA_CSV. When it
+changed, the parent loads new rows, replaces the snapshot and sends SIGHUP
+to workers, which map the new snapshot on their next request. Workers
+which exit are replaced.
+"""
+import errno
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from werkzeug.serving import make_server
+
+from presence_analyzer import utils
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class PreforkServer(object):
+    """
+    Serves Flask app from forked workers, see module docstring.
+    """
+    def __init__(self, app, host, port, workers=None, reload_interval=None):
+        self.app = app
+        self.workers = (
+            workers or app.config.get('PREFORK_WORKERS') or
+            multiprocessing.cpu_count()
+        )
+        self.reload_interval = (
+            reload_interval or app.config.get('PREFORK_RELOAD_INTERVAL', 10)
+        )
+        self.server = make_server(host, port, app)
+        self.pids = set()
+        self.data = None
+        self.running = False
+
+    @property
+    def address(self):
+        """
+        Returns (host, port) the server listens on.
+        """
+        return self.server.server_address
+
+    def serve_forever(self):
+        """
+        Loads the data, runs workers and reloads the data until stopped.
+        """
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.reload_data()
+        try:
+            while self.running:
+                self.spawn_workers()
+                time.sleep(self.reload_interval)
+                self.reap_workers()
+                if not self.running:
+                    break
+                try:
+                    changed = self.reload_data()
+                except (IOError, OSError):
+                    log.exception('Unable to reload presence data')
+                    continue
+                if changed:
+                    self.signal_workers(signal.SIGHUP)
+        finally:
+            self.signal_workers(signal.SIGTERM)
+            for pid in list(self.pids):
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+                self.pids.discard(pid)
+            self.server.server_close()
+
+    def stop(self, signum=None, frame=None):  # pylint: disable=unused-argument
+        """
+        Makes serve_forever stop workers and return.
+        """
+        self.running = False
+
+    def reload_data(self):
+        """
+        Loads changes of DATA_CSV and replaces snapshot shared by workers.
+
+        Returns True when the data changed. Workers read other backends than
+        CSV themselves.
+        """
+        if self.app.config.get('DATA_BACKEND', 'csv') != 'csv':
+            return False
+        path = self.app.config['DATA_CSV']
+        previous = self.data
+        if previous is None or previous.source.path != path:
+            previous = utils.read_snapshot(path)
+        data = utils.load_data(path, previous)
+        if data is not previous:
+            utils.write_snapshot(data)
+        changed = data is not self.data
+        self.data = data
+        if changed:
+            log.info('Presence data of %s shared with workers', path)
+        return changed
+
+    def spawn_workers(self):
+        """
+        Forks workers until there's the configured amount of them.
+        """
+        while len(self.pids) < self.workers:
+            pid = os.fork()
+            if pid:
+                self.pids.add(pid)
+                continue
+            status = 0
+            try:
+                self.run_worker()
+            except BaseException:  # pylint: disable=broad-except
+                log.exception('Worker %s failed', os.getpid())
+                status = 1
+            finally:
+                os._exit(status)  # pylint: disable=protected-access
+
+    def run_worker(self):
+        """
+        Serves requests in a forked worker.
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, expire_data)
+        signal.siginterrupt(signal.SIGHUP, False)
+        self.pids.clear()
+        self.data = None
+        utils.CACHE.clear()
+        utils.TIME.clear()
+        utils.LOCKS.clear()
+        utils.LOADED.clear()
+        self.app.config['DATA_SHARED'] = True
+        self.server.serve_forever()
+
+    def reap_workers(self):
+        """
+        Forgets workers which exited, so they are spawned again.
+        """
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as error:
+                if error.errno == errno.ECHILD:
+                    self.pids.clear()
+                    break
+                raise
+            if not pid:
+                break
+            if pid in self.pids:
+                self.pids.discard(pid)
+                if self.running:
+                    log.warning('Worker %s exited with %s', pid, status)
+
+    def signal_workers(self, signum):
+        """
+        Sends signal to all workers.
+        """
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signum)
+            except OSError as error:
+                if error.errno != errno.ESRCH:
+                    raise
+                self.pids.discard(pid)
+
+
+def expire_data(signum=None, frame=None):  # pylint: disable=unused-argument
+    """
+    Makes the next get_data call map current snapshot (SIGHUP handler).
+    """
+    utils.TIME.pop('get_data', None)
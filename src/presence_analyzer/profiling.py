@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of requests.
+
+ProfilerMiddleware runs a request under a profiler when it carries
+PROFILE_SECRET in X-Profile header or 'profile' query argument, or when
+it's picked at random with PROFILE_SAMPLE_RATE probability. Results are
+written to PROFILE_DIR (var/log/profiles by default):
+
+- PROFILER = 'cprofile' (default) writes pstats files (.prof),
+- PROFILER = 'sampling' samples stack of the request thread every
+  PROFILE_INTERVAL seconds and writes collapsed stacks (.folded), which
+  flamegraph.pl reads.
+
+Only PROFILE_RETENTION newest profiles are kept.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from urlparse import parse_qs
+
+# Extensions of profiles written by profilers.
+EXTENSIONS = {'cprofile': '.prof', 'sampling': '.folded'}
+
+
+class ProfilerMiddleware(object):
+    """
+    WSGI middleware profiling selected requests, see module docstring.
+    """
+    def __init__(self, app, config, directory):
+        self.app = app
+        self.config = config
+        self.directory = directory
+
+    def __call__(self, environ, start_response):
+        if not self.is_wanted(environ):
+            return self.app(environ, start_response)
+        return self.profile(environ, start_response)[0]
+
+    def is_wanted(self, environ):
+        """
+        Checks if request should be profiled.
+        """
+        secret = self.config.get('PROFILE_SECRET')
+        if secret:
+            given = environ.get('HTTP_X_PROFILE') or parse_qs(
+                environ.get('QUERY_STRING', ''),
+            ).get('profile', [''])[0]
+            if given and hmac.compare_digest(str(given), str(secret)):
+                return True
+        sample_rate = self.config.get('PROFILE_SAMPLE_RATE', 0)
+        return bool(sample_rate) and random.random() < sample_rate
+
+    def profile(self, environ, start_response):
+        """
+        Handles request under profiler.
+
+        Returns response body and path of written profile.
+        """
+        profiler = self.config.get('PROFILER', 'cprofile')
+        if profiler == 'sampling':
+            collector = Sampler(self.config.get('PROFILE_INTERVAL', 0.005))
+            collector.start(threading.current_thread().ident)
+        else:
+            profiler = 'cprofile'
+            collector = cProfile.Profile()
+            collector.enable()
+        try:
+            app_iter = self.app(environ, start_response)
+            try:
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        finally:
+            if profiler == 'sampling':
+                collector.stop()
+            else:
+                collector.disable()
+
+        directory = self.config.get('PROFILE_DIR', self.directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(
+            directory, profile_name(environ) + EXTENSIONS[profiler],
+        )
+        collector.dump_stats(path)
+        remove_old_profiles(
+            directory, self.config.get('PROFILE_RETENTION', 100),
+        )
+        return body, path
+
+
+class Sampler(object):
+    """
+    Samples stack of a thread from a background thread.
+
+    Stacks are counted in collapsed format: names of functions from the
+    outermost one joined with semicolons.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self, thread_id):
+        """
+        Starts sampling of given thread.
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(thread_id,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops sampling and waits for the sampling thread.
+        """
+        self.running = False
+        self.thread.join()
+
+    def run(self, thread_id):
+        """
+        Takes samples until stopped.
+        """
+        while self.running:
+            time.sleep(self.interval)
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def dump_stats(self, path):
+        """
+        Writes counted stacks to given file.
+        """
+        with open(path, 'w') as profile_file:
+            for stack, count in self.stacks.most_common():
+                profile_file.write('{} {}\n'.format(stack, count))
+
+
+def collapse(frame):
+    """
+    Returns stack of given frame in collapsed format.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(
+            code.co_name, code.co_filename, code.co_firstlineno,
+        ))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def profile_name(environ):
+    """
+    Returns unique name of profile of given request.
+    """
+    now = time.time()
+    path = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', ''))
+    return '{}.{:06d}-{}-{}-{}'.format(
+        time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+        int(now % 1 * 1000000),
+        os.getpid(),
+        environ.get('REQUEST_METHOD', 'GET'),
+        path.strip('_')[:80] or 'root',
+    )
+
+
+def remove_old_profiles(directory, retention):
+    """
+    Removes all but given amount of newest profiles.
+    """
+    names = sorted(
+        name for name in os.listdir(directory)
+        if os.path.splitext(name)[1] in EXTENSIONS.values()
+    )
+    for name in names[:max(len(names) - retention, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def install(app, directory):
+    """
+    Wraps WSGI application of Flask app with ProfilerMiddleware once.
+    """
+    if not isinstance(app.wsgi_app, ProfilerMiddleware):
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app.config, directory)
+    return app.wsgi_app
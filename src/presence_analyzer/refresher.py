@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Background refreshing of presence data and users.
+
+Refresher thread checks modification time, size and inode of the data file
+(DATA_CSV or the database of DATA_BACKEND) and USERS_DB_FILE every
+REFRESH_INTERVAL seconds. Once a changed file stays unchanged for
+REFRESH_DEBOUNCE seconds, the thread reads it, computes values derived
+from it (see utils.warm_data) and only then replaces the cached value, so
+requests neither parse files nor wait for it. Once a file is refreshed,
+requests stop checking it themselves.
+"""
+import logging
+import os
+import threading
+import time
+
+from presence_analyzer import utils
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Running Refresher of the process, see start.
+RUNNING = {}
+
+
+class Refresher(threading.Thread):
+    """
+    Thread keeping cached data of the app up to date, see module docstring.
+    """
+    def __init__(self, app, interval, debounce=0):
+        threading.Thread.__init__(self, name='presence-refresher')
+        self.daemon = True
+        self.app = app
+        self.interval = interval
+        self.debounce = debounce
+        self.stopped = threading.Event()
+        # Last seen version of every file and time it was first seen.
+        self.seen = {}
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Unable to refresh data')
+        unwatch()
+
+    def stop(self):
+        """
+        Stops the thread, requests check files themselves again.
+        """
+        self.stopped.set()
+        unwatch()
+
+    def check(self, now=None):
+        """
+        Refreshes data of files which changed and settled.
+
+        Returns names ('data' or 'users') of refreshed files.
+        """
+        now = time.time() if now is None else now
+        refreshed = []
+        users_path = self.app.config['USERS_DB_FILE']
+        for name, path, refresh in (
+                ('data', utils.data_path(), self.refresh_data),
+                ('users', users_path, self.refresh_users),
+        ):
+            version = file_version(path)
+            seen, since = self.seen.get(name, (None, None))
+            if version != seen:
+                since = now
+                self.seen[name] = (version, since)
+            if since is None or now - since < self.debounce:
+                continue
+            if version is not None:
+                refresh(path)
+                refreshed.append(name)
+            self.seen[name] = (version, None)
+        return refreshed
+
+    def refresh_data(self, path):
+        """
+        Reads presence data, warms it, replaces cached data and stops
+        requests from reading it.
+        """
+        started = time.time()
+        data = utils.read_data()
+        utils.warm_data(data)
+        # requests keep getting the previous data until it's warmed
+        utils.watch_data(data)
+        log.info('Refreshed %s in %.3f s', path, time.time() - started)
+
+    def refresh_users(self, path):
+        """
+        Reads users file and stops requests from checking it.
+        """
+        utils.read_users_directory(path)
+        utils.USERS['watched'] = path
+        log.info('Refreshed %s', path)
+
+
+def unwatch():
+    """
+    Makes requests check data and users files themselves again.
+    """
+    utils.LOADED.pop('watched', None)
+    utils.USERS.pop('watched', None)
+
+
+def file_version(path):
+    """
+    Returns (inode, mtime, size) of given file or None if it's missing.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+def start(app):
+    """
+    Starts Refresher configured by REFRESH_INTERVAL and REFRESH_DEBOUNCE
+    unless it's running or the interval isn't set.
+    """
+    refresher = RUNNING.get('refresher')
+    if refresher is not None and refresher.is_alive():
+        return refresher
+    interval = app.config.get('REFRESH_INTERVAL')
+    if not interval:
+        return None
+    refresher = RUNNING['refresher'] = Refresher(
+        app, interval, app.config.get('REFRESH_DEBOUNCE', 0),
+    )
+    refresher.start()
+    return refresher
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Post-processing of responses: compression and caching of static files.
+"""
+import gzip
+import time
+import zlib
+from cStringIO import StringIO
+
+from flask import Response, request
+
+from presence_analyzer.helpers import static_digest
+from presence_analyzer.main import app
+
+COMPRESSIBLE = (
+    'application/javascript',
+    'application/json',
+    'text/css',
+    'text/html',
+    'text/javascript',
+)
+
+# Compressed bodies by ETag and content coding, see compress_response.
+COMPRESSED = {}
+COMPRESSED_SIZE = 1000
+
+# Static files requested with digest of their content never change.
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+@app.after_request
+def cache_static(response):
+    """
+    Makes static files requested by URL from static_url cached forever.
+    """
+    if (
+            request.endpoint == 'static' and
+            response.status_code in (200, 304) and
+            request.args.get('v') is not None and
+            request.args.get('v') == static_digest(
+                request.view_args['filename'],
+            )
+    ):
+        response.headers['Cache-Control'] = (
+            'public, max-age={}, immutable'.format(STATIC_MAX_AGE)
+        )
+        response.expires = int(time.time() + STATIC_MAX_AGE)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses textual responses with gzip or deflate accepted by client.
+
+    Only bodies of at least COMPRESS_MIN_SIZE bytes are compressed.
+    Compressed bodies of responses with ETag are reused and their ETag
+    becomes weak, as the compressed body differs from the original one.
+    """
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    coding = request.accept_encodings.best_match(('gzip', 'deflate'))
+    if coding is None:
+        return response
+
+    response.direct_passthrough = False
+    body = response.get_data()
+    if not compresses(response.mimetype, len(body)):
+        return response
+    etag, _ = response.get_etag()
+    key = (etag, coding) if etag is not None else None
+    compressed = COMPRESSED.get(key)
+    if compressed is None:
+        compressed = compress(body, coding)
+        if key is not None:
+            if len(COMPRESSED) >= COMPRESSED_SIZE:
+                COMPRESSED.clear()
+            COMPRESSED[key] = compressed
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = coding
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def compresses(mimetype, size):
+    """
+    Checks if compress_response compresses successful response of given
+    mimetype and body size for the current request.
+    """
+    return (
+        mimetype in COMPRESSIBLE and
+        size >= app.config.get('COMPRESS_MIN_SIZE', 1024) and
+        request.accept_encodings.best_match(('gzip', 'deflate')) is not None
+    )
+
+
+def not_modified(response):
+    """
+    Returns 304 Not Modified answering conditional request of given
+    successful response.
+
+    It carries validators and Vary of the response as sent by
+    compress_response, weak ETag of compressed body included, but no
+    Content-Type.
+    """
+    result = Response(status=304)
+    del result.headers['Content-Type']
+    etag, _ = response.get_etag()
+    if etag is not None:
+        result.set_etag(etag, weak=compresses(
+            response.mimetype, len(response.get_data()),
+        ))
+    result.last_modified = response.last_modified
+    if response.mimetype in COMPRESSIBLE:
+        result.vary.add('Accept-Encoding')
+    return result
+
+
+def compress(body, coding):
+    """
+    Compresses body with given content coding, 'gzip' or 'deflate'.
+    """
+    if coding == 'deflate':
+        return zlib.compress(body, 6)
+    compressed = StringIO()
+    with gzip.GzipFile(
+            fileobj=compressed, mode='wb', compresslevel=6, mtime=0,
+    ) as gzip_file:
+        gzip_file.write(body)
+    return compressed.getvalue()
@@ -2,6 +2,8 @@
 """Startup utilities"""
 # pylint:skip-file
 
+import locale
+import logging
 import os
 import sys
 import paste.script.command
@@ -27,16 +29,27 @@ del _buildout_path
 
 
 # bin/paster serve parts/etc/deploy.ini
-def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
+def make_app(global_conf={}, config=DEPLOY_CFG, debug=False, refresh=True):
     from presence_analyzer import app
     app.config.from_pyfile(abspath(config))
     app.debug = debug
+    # Users listing is sorted according to locale, which is process-wide
+    # state, so it's set once here instead of while serving requests.
+    try:
+        locale.setlocale(locale.LC_COLLATE, '')
+    except locale.Error:
+        logging.getLogger(__name__).warning(
+            'Unsupported locale, users will be sorted by byte values',
+        )
+    from presence_analyzer import profiling, refresher
+    profiling.install(app, abspath('var', 'log', 'profiles'))
+    if refresh:
+        refresher.start(app)
     return app
 
 
-# bin/flask-ctl xml
-def make_xml(debug=False):
-    """Gets users' names as xml file from DB"""
+def _configure(debug=False):
+    """Configures the app for a command line action."""
     from presence_analyzer import app
     if debug is False:
         config = DEPLOY_CFG
@@ -44,10 +57,104 @@ def make_xml(debug=False):
         config = DEBUG_CFG
     app.config.from_pyfile(abspath(config))
     app.debug = debug
-    presence_analyzer.utils.update_user_names()
+    return app
+
+
+# bin/flask-ctl xml
+def make_xml(debug=False):
+    """Gets users' names as xml file from DB"""
+    _configure(debug)
+    if presence_analyzer.utils.update_user_names():
+        print 'Performed'
+    else:
+        print 'Not modified'
+
+
+# bin/flask-ctl snapshot
+def make_snapshot(debug=False):
+    """Writes binary snapshot of parsed presence data next to DATA_CSV"""
+    app = _configure(debug)
+    data = presence_analyzer.utils.load_data(app.config['DATA_CSV'])
+    presence_analyzer.utils.write_snapshot(data)
     print 'Performed'
 
 
+# bin/flask-ctl import
+def make_import(path='', database='', batch_size=10000, debug=False):
+    """Imports presence CSV file (DATA_CSV) into SQLite database"""
+    app = _configure(debug)
+    path = path or app.config['DATA_CSV']
+    database = database or presence_analyzer.utils.sqlite_path()
+    count = presence_analyzer.utils.import_csv(path, database, batch_size)
+    print 'Imported {} rows into {}'.format(count, database)
+
+
+# bin/flask-ctl split
+def make_split(path='', directory='', debug=False):
+    """Splits presence CSV file (DATA_CSV) into partitions by month"""
+    app = _configure(debug)
+    path = path or app.config['DATA_CSV']
+    directory = directory or presence_analyzer.utils.partitions_directory()
+    names = presence_analyzer.utils.split_csv(path, directory)
+    print 'Wrote {} partitions into {}'.format(len(names), directory)
+
+
+# bin/flask-ctl profile
+def make_profile(path='/api/v1/weekday_stats?user_id=all', sampling=False,
+                 debug=False):
+    """Profiles one request of given path, profile is saved in var/log"""
+    from presence_analyzer import profiling
+    from werkzeug.test import EnvironBuilder
+    app = _configure(debug)
+    if sampling:
+        app.config['PROFILER'] = 'sampling'
+    middleware = profiling.install(app, abspath('var', 'log', 'profiles'))
+    status = []
+    _, profile = middleware.profile(
+        EnvironBuilder(path=path).get_environ(),
+        lambda status_line, headers, exc_info=None: status.append(status_line),
+    )
+    print status[0], path
+    print profile
+    if not sampling:
+        import pstats
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+
+
+# bin/flask-ctl bench
+def make_bench(output=abspath('var', 'log', 'bench.json'), compare='',
+               users=100, years=3, dirty=0.01, debug=False):
+    """Runs benchmark suite, writes results as JSON and compares them
+
+    Results are compared with results of a previous run given by
+    '--compare' option.
+    """
+    from presence_analyzer.benchmarks import suite
+    _configure(debug)
+    results = suite.write_results(output, users, years, dirty)
+    if compare:
+        lines = suite.compare(suite.read_results(compare), results)
+    else:
+        lines = [
+            '{:<58} {:>12}'.format(name, suite.format_time(seconds))
+            for name, seconds in sorted(results['results'].iteritems())
+        ]
+    for line in lines:
+        print line
+    print 'Results written to', output
+
+
+# bin/flask-ctl serve async
+def make_async(host, port, config=DEPLOY_CFG, debug=False):
+    """Make event loop server of the app listening on 'host' and 'port'.
+
+    See presence_analyzer.eventloop.
+    """
+    from presence_analyzer.eventloop import EventLoopServer
+    app = make_app(config=config, debug=debug, refresh=False)
+    return EventLoopServer(app, host, port)
+
+
 # bin/paster serve parts/etc/debug.ini
 def make_debug(global_conf={}, **conf):
     from werkzeug.debug import DebuggedApplication
@@ -71,6 +178,10 @@ def _serve(action, debug=False, dry_run=False):
         config = DEBUG_INI
     else:
         config = DEPLOY_INI
+    if action == 'prefork':
+        return _prefork(config, debug, dry_run)
+    if action == 'async':
+        return _async(config, debug, dry_run)
     argv = ['bin/paster', 'serve', config]
     if action in ('start', 'restart'):
         argv += [action, '--daemon']
@@ -93,12 +204,66 @@ def _serve(action, debug=False, dry_run=False):
     paste.script.command.run()
 
 
+def _server_address(config):
+    """Read host and port from [server:main] section of paster 'config'."""
+    from ConfigParser import RawConfigParser
+    parser = RawConfigParser()
+    parser.read(abspath(config))
+    return (
+        parser.get('server:main', 'host'),
+        parser.getint('server:main', 'port'),
+    )
+
+
+def _configure_logging():
+    """Log to stderr as paster does with deploy.ini."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s [%(name)s] %(message)s',
+    )
+
+
+def _prefork(config, debug=False, dry_run=False):
+    """Serve the app from pre-forked workers sharing the data."""
+    from presence_analyzer.prefork import PreforkServer
+    host, port = _server_address(config)
+    print 'prefork', 'http://{}:{}'.format(host, port)
+    if dry_run:
+        return
+    _configure_logging()
+    app = make_app(
+        config=DEBUG_CFG if debug else DEPLOY_CFG, debug=debug, refresh=False,
+    )
+    PreforkServer(app, host, port).serve_forever()
+
+
+def _async(config, debug=False, dry_run=False):
+    """Serve the app from an event loop."""
+    import signal
+    host, port = _server_address(config)
+    print 'async', 'http://{}:{}'.format(host, port)
+    if dry_run:
+        return
+    _configure_logging()
+    server = make_async(
+        host, port, config=DEBUG_CFG if debug else DEPLOY_CFG, debug=debug,
+    )
+    signal.signal(signal.SIGTERM, server.stop)
+    signal.signal(signal.SIGINT, server.stop)
+    server.serve_forever()
+
+
 # bin/flask-ctl ...
 def run():
     action_shell = werkzeug.script.make_shell(make_shell, make_shell.__doc__)
     action_xml = make_xml
+    action_snapshot = make_snapshot
+    action_import = make_import
+    action_split = make_split
+    action_profile = make_profile
+    action_bench = make_bench
 
-    # bin/flask-ctl serve [fg|start|stop|restart|status]
+    # bin/flask-ctl serve [fg|start|stop|restart|status|prefork|async]
     def action_serve(action=('a', 'start'), dry_run=False):
         """Serve the application.
 
@@ -106,7 +271,9 @@ def run():
         configuration file for the server and application.
 
         Options:
-         - 'action' is one of [fg|start|stop|restart|status]
+         - 'action' is one of [fg|start|stop|restart|status|prefork|async],
+           'prefork' serves in the foreground from a process per CPU,
+           'async' serves in the foreground from an event loop
          - '--dry-run' print the paster command and exit
         """
         _serve(action, debug=False, dry_run=dry_run)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Mergeable histograms of times of day.
+
+Times are counted in fixed-width bins over seconds since midnight, so
+histograms of parts of data add up to the histogram of the whole and
+quantiles are read in O(bins) with error below BIN_WIDTH.
+"""
+from array import array
+
+# Width of histogram bins in seconds.
+BIN_WIDTH = 5 * 60
+BINS = 24 * 3600 // BIN_WIDTH
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram(object):
+    """
+    Amounts of times of day falling into every bin.
+
+    Only bins between the first and the last non-empty one are kept, in
+    an array of C ints starting at bin number first. Times of a user
+    cover a few hours, so it takes a fraction of a list of all bins.
+    """
+    __slots__ = ('first', 'bins', 'total')
+
+    def __init__(self, counts=None):
+        self.first = 0
+        self.bins = array('i')
+        self.total = 0
+        if counts is not None:
+            used = [i for i, count in enumerate(counts) if count]
+            if used:
+                self.first = used[0]
+                self.bins = array('i', counts[used[0]:used[-1] + 1])
+                self.total = sum(self.bins)
+
+    @property
+    def counts(self):
+        """
+        Amounts of times in all BINS bins.
+        """
+        counts = array('i', [0]) * BINS
+        counts[self.first:self.first + len(self.bins)] = self.bins
+        return counts
+
+    def cover(self, first, last):
+        """
+        Extends kept bins to bins between given ones (inclusive).
+        """
+        if not self.bins:
+            self.first = first
+            self.bins = array('i', [0]) * (last - first + 1)
+            return
+        if first < self.first:
+            self.bins = array('i', [0]) * (self.first - first) + self.bins
+            self.first = first
+        missing = last + 1 - self.first - len(self.bins)
+        if missing > 0:
+            self.bins.extend(array('i', [0]) * missing)
+
+    def add(self, value):
+        """
+        Adds given amount of seconds since midnight.
+        """
+        position = value // BIN_WIDTH - self.first
+        if not 0 <= position < len(self.bins):
+            self.cover(value // BIN_WIDTH, value // BIN_WIDTH)
+            position = value // BIN_WIDTH - self.first
+        self.bins[position] += 1
+        self.total += 1
+
+    def update(self, other):
+        """
+        Adds counts of other Histogram and returns self.
+        """
+        if other.bins:
+            self.cover(other.first, other.first + len(other.bins) - 1)
+            bins, offset = self.bins, other.first - self.first
+            for i, count in enumerate(other.bins):
+                bins[offset + i] += count
+        self.total += other.total
+        return self
+
+    def copy(self):
+        """
+        Returns copy of histogram.
+        """
+        histogram = type(self)()
+        histogram.first = self.first
+        histogram.bins = array('i', self.bins)
+        histogram.total = self.total
+        return histogram
+
+    def quantile(self, fraction):
+        """
+        Estimates value below which given fraction of values lies.
+
+        Values are assumed to be spread evenly within bins. Returns None
+        for an empty histogram.
+        """
+        if not self.total:
+            return None
+        rank = fraction * self.total
+        seen = 0
+        for i, count in enumerate(self.bins, self.first):
+            if count and seen + count >= rank:
+                return int(BIN_WIDTH * (i + float(rank - seen) / count))
+            seen += count
+        return BINS * BIN_WIDTH
+
+    def __eq__(self, other):
+        return isinstance(other, Histogram) and self.counts == other.counts
+
+    def __ne__(self, other):
+        return not self == other
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Binary snapshots of parsed presence data.
+
+Snapshot starts with magic bytes and length of JSON header describing the
+source CSV file and users, followed by raw columns of every user. Header
+is padded with spaces so that columns are aligned to ALIGNMENT bytes.
+"""
+import hashlib
+import json
+import mmap
+import struct
+from array import array
+
+from presence_analyzer.store import (
+    DataSource,
+    MappedColumn,
+    PresenceStore,
+    UserPresence,
+    WeekdayStats,
+)
+
+MAGIC = 'PASNAP01'
+PREFIX = struct.Struct('<8sI')
+
+# Amount of bytes from the beginning of CSV file included in its digest.
+HEAD_SIZE = 64 * 1024
+
+# Alignment of columns in snapshot file, so they can be used in place.
+ALIGNMENT = 8
+
+
+def snapshot_path(csv_path):
+    """
+    Returns path of snapshot of given CSV file.
+    """
+    return csv_path + '.snapshot'
+
+
+def csv_digest(csv_path, size):
+    """
+    Calculates digest of the beginning of CSV file and its size.
+    """
+    with open(csv_path, 'rb') as csvfile:
+        head = csvfile.read(min(size, HEAD_SIZE))
+    return hashlib.sha1('{}:{}'.format(size, head)).hexdigest()
+
+
+def dump(store, snapshot_file):
+    """
+    Writes snapshot of PresenceStore loaded from CSV file.
+    """
+    source = store.source
+    users = sorted(store.iteritems())
+    header = json.dumps({
+        'itemsize': array('i').itemsize,
+        'source': {
+            'path': source.path,
+            'inode': source.inode,
+            'size': source.size,
+            'mtime': source.mtime,
+            'offset': source.offset,
+            'tail': source.tail.encode('base64'),
+            'digest': csv_digest(source.path, source.offset),
+        },
+        'users': [
+            [
+                user_id,
+                len(user),
+                user.stats.counts,
+                user.stats.intervals,
+                user.stats.starts,
+                user.stats.ends,
+            ]
+            for user_id, user in users
+        ],
+    })
+    header += ' ' * (-(PREFIX.size + len(header)) % ALIGNMENT)
+    snapshot_file.write(PREFIX.pack(MAGIC, len(header)))
+    snapshot_file.write(header)
+    for _, user in users:
+        user.days.tofile(snapshot_file)
+        user.starts.tofile(snapshot_file)
+        user.ends.tofile(snapshot_file)
+
+
+def load(path, shared=False):
+    """
+    Reads PresenceStore from snapshot file.
+
+    Returns None when snapshot doesn't match current content of the CSV
+    file it was made of. Shared store keeps the file mapped and its users
+    read columns from the mapping instead of private copies, see
+    MappedColumn.
+    """
+    with open(path, 'rb') as snapshot_file:
+        mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    keep_mapped = False
+    try:
+        if len(mapped) < PREFIX.size:
+            raise ValueError('Not a presence data snapshot: {}'.format(path))
+        magic, header_size = PREFIX.unpack_from(mapped)
+        if magic != MAGIC:
+            raise ValueError('Not a presence data snapshot: {}'.format(path))
+        position = PREFIX.size + header_size
+        header = json.loads(mapped[PREFIX.size:position])
+        if header['itemsize'] != array('i').itemsize:
+            raise ValueError('Snapshot of other platform: {}'.format(path))
+
+        source = header['source']
+        if csv_digest(source['path'], source['offset']) != source['digest']:
+            return None
+
+        store = PresenceStore()
+        for user_id, count, counts, intervals, starts, ends in header['users']:
+            columns = []
+            for _ in range(3):
+                end = position + count * header['itemsize']
+                if end > len(mapped):
+                    raise ValueError('Truncated snapshot: {}'.format(path))
+                if shared:
+                    column = MappedColumn(
+                        buffer(mapped, position, end - position),
+                    )
+                else:
+                    column = array('i')
+                    column.fromstring(mapped[position:end])
+                columns.append(column)
+                position = end
+            stats = WeekdayStats(counts, intervals, starts, ends)
+            store[user_id] = UserPresence(*columns, stats=stats)
+        keep_mapped = shared
+    finally:
+        if not keep_mapped:
+            mapped.close()
+
+    store.source = DataSource(
+        path=source['path'],
+        inode=source['inode'],
+        size=source['size'],
+        mtime=source['mtime'],
+        offset=source['offset'],
+        tail=source['tail'].decode('base64'),
+    )
+    return store
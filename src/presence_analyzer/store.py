@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+"""
+Compact, array-backed storage of presence data.
+"""
+import datetime
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Mapping, namedtuple
+from itertools import izip
+
+from presence_analyzer.sketches import Histogram
+
+# File the data was read from: its identity, offset of the end of the last
+# complete line and bytes just before it.
+DataSource = namedtuple(
+    'DataSource', ['path', 'inode', 'size', 'mtime', 'offset', 'tail'],
+)
+
+MAX_DAY = datetime.date.max.toordinal()
+
+
+def day_weekday(day):
+    """
+    Returns weekday (Monday is 0) of given day ordinal.
+    """
+    return (day + 6) % 7
+
+
+def seconds_to_time(seconds):
+    """
+    Converts amount of seconds since midnight to datetime.time object.
+    """
+    return datetime.time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def as_column(values):
+    """
+    Returns given values as array of ints, arrays and mapped columns are
+    returned as they are.
+    """
+    if isinstance(values, (array, MappedColumn)):
+        return values
+    return array('i', values)
+
+
+def is_ordered(days):
+    """
+    Checks if days are strictly increasing.
+    """
+    return all(days[i] < days[i + 1] for i in xrange(len(days) - 1))
+
+
+class MappedColumn(object):
+    """
+    Read-only column of ints kept in a buffer, e.g. a part of mmap-ed file.
+
+    Pages of a mapped file are shared by all processes which map it, so
+    columns read from a snapshot this way don't take private memory of
+    every prefork worker. It supports what UserPresence needs from array
+    columns, slices and concatenations are returned as arrays.
+    """
+    item = struct.Struct('=i')
+
+    def __init__(self, data):
+        self.buffer = data
+
+    def to_array(self, first=0, last=None):
+        """
+        Returns copy of items between given positions as array.
+        """
+        size = self.item.size
+        column = array('i')
+        column.fromstring(self.buffer[
+            first * size:len(self.buffer) if last is None else last * size
+        ])
+        return column
+
+    def tofile(self, output):
+        """
+        Writes items to given file as array.tofile does.
+        """
+        output.write(self.buffer)
+
+    def __getitem__(self, index):
+        length = len(self)
+        if isinstance(index, slice):
+            first, last, step = index.indices(length)
+            if step != 1:
+                return self.to_array()[index]
+            return self.to_array(first, max(first, last))
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('column index out of range')
+        return self.item.unpack_from(self.buffer, index * self.item.size)[0]
+
+    def __iter__(self):
+        return iter(self.to_array())
+
+    def __len__(self):
+        return len(self.buffer) // self.item.size
+
+    def __add__(self, other):
+        return self.to_array() + as_column(other)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class WeekdayStats(object):
+    """
+    Aggregates of presence entries grouped by weekday.
+
+    For every weekday it holds amount of entries and sums of intervals,
+    starts and ends (in seconds since midnight) of presence.
+    """
+    def __init__(self, counts=None, intervals=None, starts=None, ends=None):
+        self.counts = counts or [0] * 7
+        self.intervals = intervals or [0] * 7
+        self.starts = starts or [0] * 7
+        self.ends = ends or [0] * 7
+
+    def add(self, days, starts, ends):
+        """
+        Adds given entries to aggregates and returns self.
+        """
+        counts, intervals = self.counts, self.intervals
+        starts_sums, ends_sums = self.starts, self.ends
+        for day, start, end in izip(days, starts, ends):
+            weekday = day_weekday(day)
+            counts[weekday] += 1
+            intervals[weekday] += end - start
+            starts_sums[weekday] += start
+            ends_sums[weekday] += end
+        return self
+
+    def update(self, other):
+        """
+        Adds aggregates of other WeekdayStats and returns self.
+        """
+        for name in ('counts', 'intervals', 'starts', 'ends'):
+            sums, other_sums = getattr(self, name), getattr(other, name)
+            for weekday in range(7):
+                sums[weekday] += other_sums[weekday]
+        return self
+
+    def copy(self):
+        """
+        Returns copy of aggregates.
+        """
+        return type(self)(
+            list(self.counts),
+            list(self.intervals),
+            list(self.starts),
+            list(self.ends),
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, WeekdayStats) and vars(self) == vars(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class WeekdaySketches(object):
+    """
+    Histograms of starts and ends of presence entries for every weekday.
+    """
+    def __init__(self, starts=None, ends=None):
+        self.starts = starts or [Histogram() for _ in range(7)]
+        self.ends = ends or [Histogram() for _ in range(7)]
+
+    def add(self, days, starts, ends):
+        """
+        Adds given entries to histograms and returns self.
+        """
+        for day, start, end in izip(days, starts, ends):
+            weekday = day_weekday(day)
+            self.starts[weekday].add(start)
+            self.ends[weekday].add(end)
+        return self
+
+    def update(self, other):
+        """
+        Adds histograms of other WeekdaySketches and returns self.
+        """
+        for weekday in range(7):
+            self.starts[weekday].update(other.starts[weekday])
+            self.ends[weekday].update(other.ends[weekday])
+        return self
+
+    def copy(self):
+        """
+        Returns copy of histograms.
+        """
+        return type(self)(
+            [histogram.copy() for histogram in self.starts],
+            [histogram.copy() for histogram in self.ends],
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, WeekdaySketches) and vars(self) == vars(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class WeekdayIndex(object):
+    """
+    Entries of every weekday sorted by date with prefix sums of their
+    intervals, starts and ends.
+
+    Answers aggregates of any date range with a couple of bisections.
+    """
+    def __init__(self, days, starts, ends):
+        self.days = [array('i') for _ in range(7)]
+        self.intervals = [array('l', [0]) for _ in range(7)]
+        self.starts = [array('l', [0]) for _ in range(7)]
+        self.ends = [array('l', [0]) for _ in range(7)]
+        for day, start, end in izip(days, starts, ends):
+            weekday = day_weekday(day)
+            self.days[weekday].append(day)
+            intervals = self.intervals[weekday]
+            intervals.append(intervals[-1] + end - start)
+            starts_sums = self.starts[weekday]
+            starts_sums.append(starts_sums[-1] + start)
+            ends_sums = self.ends[weekday]
+            ends_sums.append(ends_sums[-1] + end)
+
+    def stats(self, first_day, last_day):
+        """
+        Returns WeekdayStats of entries between given days (inclusive).
+        """
+        stats = WeekdayStats()
+        for weekday, days in enumerate(self.days):
+            first = bisect_left(days, first_day)
+            last = max(bisect_right(days, last_day), first)
+            stats.counts[weekday] = last - first
+            for name in ('intervals', 'starts', 'ends'):
+                sums = getattr(self, name)[weekday]
+                getattr(stats, name)[weekday] = sums[last] - sums[first]
+        return stats
+
+
+class UserPresence(Mapping):
+    """
+    Presence entries of a single user.
+
+    Entries are kept in three parallel columns sorted by date: day ordinal,
+    start and end (both in seconds since midnight). Instance behaves like
+    a read-only dict of datetime.date to {'start': ..., 'end': ...} with
+    datetime.time values, so it can be used instead of the nested dicts
+    returned by get_data before.
+    """
+    def __init__(self, days=(), starts=(), ends=(), stats=None,
+                 sketches=None):
+        self.days = as_column(days)
+        self.starts = as_column(starts)
+        self.ends = as_column(ends)
+        if stats is None:
+            stats = WeekdayStats().add(self.days, self.starts, self.ends)
+        self.stats = stats
+        self._index = None
+        self._sketches = sketches
+
+    @classmethod
+    def from_columns(cls, days, starts, ends):
+        """
+        Creates entries from unordered columns.
+
+        When the same day occurs more than once the last entry wins.
+        """
+        if is_ordered(days):
+            return cls(days, starts, ends)
+
+        positions = {}
+        for position, day in enumerate(days):
+            positions[day] = position
+        order = [positions[day] for day in sorted(positions)]
+        return cls(
+            (days[i] for i in order),
+            (starts[i] for i in order),
+            (ends[i] for i in order),
+        )
+
+    def merge(self, days, starts, ends):
+        """
+        Returns new instance with given entries added.
+
+        Entries of days already present are replaced.
+        """
+        if is_ordered(days) and (not days or not self.days or
+                                 days[0] > self.days[-1]):
+            sketches = self._sketches
+            if sketches is not None:
+                sketches = sketches.copy().add(days, starts, ends)
+            return type(self)(
+                self.days + as_column(days),
+                self.starts + as_column(starts),
+                self.ends + as_column(ends),
+                self.stats.copy().add(days, starts, ends),
+                sketches,
+            )
+        return self.from_columns(
+            self.days + as_column(days),
+            self.starts + as_column(starts),
+            self.ends + as_column(ends),
+        )
+
+    def weekday_stats(self, first_day=None, last_day=None):
+        """
+        Returns WeekdayStats of entries between given day ordinals.
+
+        Both bounds are inclusive, None means unbounded. Index of date
+        ranges is built on the first query for a range.
+        """
+        if first_day is None and last_day is None:
+            return self.stats
+        if self._index is None:
+            self._index = WeekdayIndex(self.days, self.starts, self.ends)
+        return self._index.stats(
+            first_day if first_day is not None else 0,
+            last_day if last_day is not None else MAX_DAY,
+        )
+
+    def sketches(self, first_day=None, last_day=None):
+        """
+        Returns WeekdaySketches of entries between given day ordinals.
+
+        Both bounds are inclusive, None means unbounded. Sketches of all
+        entries are built on the first query and carried over by merge.
+        """
+        if first_day is None and last_day is None:
+            if self._sketches is None:
+                self._sketches = WeekdaySketches().add(
+                    self.days, self.starts, self.ends,
+                )
+            return self._sketches
+        first = bisect_left(
+            self.days, first_day if first_day is not None else 0,
+        )
+        last = bisect_right(
+            self.days, last_day if last_day is not None else MAX_DAY,
+        )
+        return WeekdaySketches().add(
+            self.days[first:last],
+            self.starts[first:last],
+            self.ends[first:last],
+        )
+
+    def rows(self):
+        """
+        Returns list of (day ordinal, start, end) tuples sorted by date.
+        """
+        return zip(self.days, self.starts, self.ends)
+
+    def _position(self, date):
+        """
+        Returns position of given date in columns or raises KeyError.
+        """
+        try:
+            day = date.toordinal()
+        except AttributeError:
+            raise KeyError(date)
+        position = bisect_left(self.days, day)
+        if position == len(self.days) or self.days[position] != day:
+            raise KeyError(date)
+        return position
+
+    def __getitem__(self, date):
+        position = self._position(date)
+        return {
+            'start': seconds_to_time(self.starts[position]),
+            'end': seconds_to_time(self.ends[position]),
+        }
+
+    def __contains__(self, date):
+        try:
+            self._position(date)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        fromordinal = datetime.date.fromordinal
+        return (fromordinal(day) for day in self.days)
+
+    def __len__(self):
+        return len(self.days)
+
+    def __repr__(self):
+        return '<UserPresence: {} entries>'.format(len(self))
+
+
+class LazyUserPresence(UserPresence):
+    """
+    Presence entries of a single user read from a store on demand.
+
+    Only aggregates and sketches of all entries are kept, columns are
+    read whenever an operation needs them. Subclasses implement columns,
+    weekday_stats and sketches.
+    """
+    # pylint: disable=super-init-not-called
+    def __init__(self, store, user_id):
+        self.store = store
+        self.user_id = user_id
+        self._stats = None
+        self._sketches = None
+
+    def columns(self, first_day=None, last_day=None):
+        """
+        Returns days, starts and ends of entries between given day ordinals
+        sorted by date.
+
+        Both bounds are inclusive, None means unbounded.
+        """
+        raise NotImplementedError
+
+    @property
+    def days(self):
+        """
+        Day ordinals of entries.
+        """
+        return self.columns()[0]
+
+    @property
+    def starts(self):
+        """
+        Starts of entries in seconds since midnight.
+        """
+        return self.columns()[1]
+
+    @property
+    def ends(self):
+        """
+        Ends of entries in seconds since midnight.
+        """
+        return self.columns()[2]
+
+    @property
+    def stats(self):
+        """
+        WeekdayStats of all entries.
+        """
+        if self._stats is None:
+            self._stats = self.weekday_stats(0, MAX_DAY)
+        return self._stats
+
+    def merge(self, days, starts, ends):
+        raise TypeError('{} is changed only by its store'.format(self))
+
+    def rows(self):
+        """
+        Returns list of (day ordinal, start, end) tuples sorted by date.
+        """
+        return zip(*self.columns())
+
+    def __getitem__(self, date):
+        try:
+            day = date.toordinal()
+        except AttributeError:
+            raise KeyError(date)
+        days, starts, ends = self.columns(day, day)
+        if not days:
+            raise KeyError(date)
+        return {
+            'start': seconds_to_time(starts[0]),
+            'end': seconds_to_time(ends[0]),
+        }
+
+    def __contains__(self, date):
+        try:
+            self[date]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return sum(self.stats.counts)
+
+    def __repr__(self):
+        return '<{}: {}>'.format(type(self).__name__, self.user_id)
+
+
+class DerivedValues(object):
+    """
+    Mixin of stores keeping values computed from the whole store.
+    """
+    _derived = None
+
+    def derive(self, key, compute):
+        """
+        Returns value computed from the store, computing it only once.
+        """
+        if self._derived is None:
+            self._derived = {}
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = compute()
+            return value
+
+
+class PresenceStore(DerivedValues, dict):
+    """
+    Presence entries of all users, mapping user_id to UserPresence.
+
+    Stores are treated as immutable, merge returns a new store sharing
+    entries of users which were not changed. Values computed from the
+    whole store can be kept along with it, see derive.
+    """
+    source = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Creates store from iterable of (user_id, day, start, end) tuples.
+        """
+        store = cls()
+        for user_id, columns in group_columns(rows).iteritems():
+            store[user_id] = UserPresence.from_columns(*columns)
+        return store
+
+    def merge(self, rows):
+        """
+        Returns new store with given (user_id, day, start, end) rows added.
+        """
+        store = type(self)(self)
+        for user_id, columns in group_columns(rows).iteritems():
+            if user_id in self:
+                store[user_id] = self[user_id].merge(*columns)
+            else:
+                store[user_id] = UserPresence.from_columns(*columns)
+        return store
+
+
+def group_columns(rows):
+    """
+    Groups (user_id, day, start, end) rows into columns of every user.
+    """
+    columns = {}
+    for user_id, day, start, end in rows:
+        try:
+            days, starts, ends = columns[user_id]
+        except KeyError:
+            days, starts, ends = columns[user_id] = (
+                array('i'), array('i'), array('i'),
+            )
+        days.append(day)
+        starts.append(start)
+        ends.append(end)
+    return columns
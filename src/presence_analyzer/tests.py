@@ -2,12 +2,45 @@
 """
 Presence analyzer unit tests.
 """
-import os.path
-import json
+import array
+import BaseHTTPServer
 import datetime
+import gzip
+import httplib
+import json
+import os.path
+import pstats
+import re
+import shutil
+import signal
+import tempfile
+import threading
+import time
 import unittest
+import urllib2
+import zlib
+from cStringIO import StringIO
 
-from presence_analyzer import main, utils
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from presence_analyzer import (
+    company,
+    database,
+    eventloop,
+    helpers,
+    main,
+    metrics,
+    partitions,
+    prefork,
+    profiling,
+    refresher,
+    sketches,
+    snapshot,
+    store,
+    utils,
+    vectorized,
+)
 
 
 TEST_DATA_CSV = os.path.join(
@@ -19,6 +52,18 @@ TEST_USERS_XML = os.path.join(
 TEST_CACHE_CSV = os.path.join(
     os.path.dirname(__file__), '..', '..', 'runtime', 'data', 'test_cache.csv'
 )
+SAMPLE_DATA_CSV = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'runtime', 'data', 'sample_data.csv'
+)
+
+
+def forget_data():
+    """
+    Forgets cached and loaded presence data.
+    """
+    utils.TIME = {}
+    utils.CACHE = {}
+    utils.LOADED = {}
 
 
 # pylint: disable=maybe-no-member, too-many-public-methods
@@ -44,7 +89,7 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         """
         Get rid of unused objects after each test.
         """
-        pass
+        forget_data()
 
     def test_mainpage(self):
         """
@@ -124,6 +169,326 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
             ]
         )
 
+    def test_date_range(self):
+        """
+        Test limiting statistics to dates between 'from' and 'to'.
+        """
+        self.assertEqual(
+            self.check_status_and_content_type(
+                '/api/v1/presence_weekday/10?from=2013-09-11',
+            )[1:4],
+            [[u'Mon', 0], [u'Tue', 0], [u'Wed', 24465]],
+        )
+        self.assertEqual(
+            self.check_status_and_content_type(
+                '/api/v1/mean_time_weekday/10?from=2013-09-11&to=2013-09-11',
+            )[1:4],
+            [[u'Tue', 0], [u'Wed', 24465.0], [u'Thu', 0]],
+        )
+        self.assertEqual(
+            self.check_status_and_content_type(
+                '/api/v1/presence_start_end/11?to=2013-09-11',
+            )[3:5],
+            [[u'Thu', [34088, 57087]], [u'Fri', [0, 0]]],
+        )
+        for path in (
+                '/api/v1/presence_weekday/10?from=2013-09-31',
+                '/api/v1/mean_time_weekday/10?to=13-09-11',
+                '/api/v1/presence_start_end/10?from=',
+        ):
+            self.assertEqual(self.client.get(path).status_code, 400)
+
+    def test_weekday_stats(self):
+        """
+        Test statistics of many users in one request.
+        """
+        data = self.check_status_and_content_type(
+            '/api/v1/weekday_stats?user_id=10,11&user_id=12&from=2013-09-10',
+        )
+        self.assertItemsEqual(data.keys(), [u'10', u'11'])
+        for user_id in (10, 11):
+            for name in (
+                    'mean_time_weekday',
+                    'presence_weekday',
+                    'presence_start_end',
+            ):
+                self.assertEqual(
+                    data[str(user_id)][name],
+                    self.check_status_and_content_type(
+                        '/api/v1/{}/{}?from=2013-09-10'.format(name, user_id),
+                    ),
+                )
+        self.assertEqual(
+            self.check_status_and_content_type(
+                '/api/v1/weekday_stats?user_id=all&from=2013-09-10',
+            ),
+            data,
+        )
+        for path in (
+                '/api/v1/weekday_stats',
+                '/api/v1/weekday_stats?user_id=10,x',
+        ):
+            self.assertEqual(self.client.get(path).status_code, 400)
+
+    def test_presence_percentiles_view(self):
+        """
+        Test histograms and percentiles of starts and ends by weekday.
+        """
+        data = self.check_status_and_content_type(
+            '/api/v1/presence_percentiles/11',
+        )
+        self.assertEqual(len(data), 7)
+        weekday, thursday = data[3]
+        self.assertEqual(weekday, u'Thu')
+        self.assertEqual(
+            thursday[u'start'][u'histogram'], [[33900, 1], [36900, 1]],
+        )
+        self.assertEqual(thursday[u'start'][u'p50'], 34200)
+        self.assertEqual(thursday[u'end'][u'p90'], 60240)
+        self.assertEqual(
+            data[5],
+            [u'Sat', {
+                u'start': {
+                    u'p50': None, u'p90': None, u'p99': None,
+                    u'histogram': [],
+                },
+                u'end': {
+                    u'p50': None, u'p90': None, u'p99': None,
+                    u'histogram': [],
+                },
+            }],
+        )
+        limited = self.check_status_and_content_type(
+            '/api/v1/presence_percentiles/11?from=2013-09-06',
+        )
+        self.assertEqual(
+            limited[3][1][u'start'][u'histogram'], [[36900, 1]],
+        )
+        resp = self.client.get('/api/v1/presence_percentiles/2')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_company_mean_time_weekday(self):
+        """
+        Test mean presence time of all users grouped by weekday.
+        """
+        self.assertEqual(
+            self.check_status_and_content_type(
+                '/api/v1/company/mean_time_weekday',
+            ),
+            [
+                [u'Mon', 24123.0],
+                [u'Tue', 23305.5],
+                [u'Wed', 24893.0],
+                [u'Thu', 23224.333333333332],
+                [u'Fri', 6426.0],
+                [u'Sat', 0],
+                [u'Sun', 0],
+            ],
+        )
+        grouped = self.check_status_and_content_type(
+            '/api/v1/company/mean_time_weekday?group_by=id',
+        )
+        self.assertItemsEqual(grouped.keys(), [u'10', u'11'])
+        self.assertEqual(
+            grouped[u'10'],
+            self.check_status_and_content_type('/api/v1/mean_time_weekday/10'),
+        )
+        # unknown attributes aren't computed and cached
+        for group_by in ('team', 'x0', 'x1'):
+            resp = self.client.get(
+                '/api/v1/company/mean_time_weekday?group_by=' + group_by,
+            )
+            self.assertEqual(resp.status_code, 400)
+        # pylint: disable=protected-access
+        groups = [
+            key[1] for key in utils.get_data()._derived
+            if key[0] == 'company_stats'
+        ]
+        self.assertIn('id', groups)
+        self.assertNotIn('team', groups)
+        self.assertNotIn('x0', groups)
+
+    def test_company_arrivals(self):
+        """
+        Test distribution of arrival times of all users.
+        """
+        data = self.check_status_and_content_type('/api/v1/company/arrivals')
+        self.assertEqual(len(data), 96)
+        self.assertEqual(data[0], [u'00:00', 0])
+        self.assertEqual(data[36:40], [
+            [u'09:00', 2], [u'09:15', 3], [u'09:30', 1], [u'09:45', 0],
+        ])
+        self.assertEqual(sum(count for _, count in data), 9)
+        grouped = self.check_status_and_content_type(
+            '/api/v1/company/arrivals?group_by=name',
+        )
+        self.assertEqual(grouped[u'Maciej Z.'][36:40], [
+            [u'09:00', 0], [u'09:15', 1], [u'09:30', 1], [u'09:45', 0],
+        ])
+
+    def test_company_present_per_day(self):
+        """
+        Test number of users present on every day.
+        """
+        self.assertEqual(
+            self.check_status_and_content_type(
+                '/api/v1/company/present_per_day',
+            ),
+            [
+                [u'2013-09-05', 1],
+                [u'2013-09-09', 1],
+                [u'2013-09-10', 2],
+                [u'2013-09-11', 2],
+                [u'2013-09-12', 2],
+                [u'2013-09-13', 1],
+            ],
+        )
+
+    def test_conditional_requests(self):
+        """
+        Test ETag and Last-Modified of API responses.
+        """
+        for path in (
+                '/api/v1/users',
+                '/api/v1/mean_time_weekday/10',
+                '/api/v1/weekday_stats?user_id=10',
+                '/api/v1/company/arrivals',
+        ):
+            resp = self.client.get(path)
+            etag = resp.headers['ETag']
+            last_modified = resp.headers['Last-Modified']
+            resp = self.client.get(path, headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, '')
+            self.assertEqual(resp.headers['ETag'], etag)
+            resp = self.client.get(path, headers={
+                'If-Modified-Since': last_modified,
+            })
+            self.assertEqual(resp.status_code, 304)
+            resp = self.client.get(path, headers={'If-None-Match': '"x"'})
+            self.assertEqual(resp.status_code, 200)
+
+        future = 'Tue, 01 Jan 2030 00:00:00 GMT'
+        for path, status in (
+                ('/api/v1/mean_time_weekday/99999', 404),
+                ('/api/v1/mean_time_weekday/10?from=garbage', 400),
+                ('/api/v1/weekday_stats?user_id=x', 400),
+        ):
+            resp = self.client.get(path, headers={
+                'If-Modified-Since': future,
+            })
+            self.assertEqual(resp.status_code, status, path)
+
+        first = self.client.get('/api/v1/mean_time_weekday/10')
+        other = self.client.get('/api/v1/mean_time_weekday/11')
+        ranged = self.client.get('/api/v1/mean_time_weekday/10?to=2013-09-10')
+        self.assertEqual(
+            len(set(
+                resp.headers['ETag'] for resp in (first, other, ranged)
+            )),
+            3,
+        )
+
+    def test_compression(self):
+        """
+        Test compressing responses with content coding accepted by client.
+        """
+        self.addCleanup(main.app.config.pop, 'COMPRESS_MIN_SIZE', None)
+        main.app.config['COMPRESS_MIN_SIZE'] = 100
+        path = '/api/v1/weekday_stats?user_id=all'
+        plain = self.client.get(path)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.headers['Vary'], 'Accept-Encoding')
+        etag = plain.headers['ETag']
+
+        resp = self.client.get(path, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['ETag'], 'W/' + etag)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=StringIO(resp.data)).read(), plain.data,
+        )
+        resp = self.client.get(
+            path, headers={'Accept-Encoding': 'gzip;q=0.5, deflate'},
+        )
+        self.assertEqual(resp.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(resp.data), plain.data)
+        resp = self.client.get(path, headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': 'W/' + etag,
+        })
+        self.assertEqual(resp.status_code, 304)
+        # validators of the compressed response
+        self.assertEqual(resp.headers['ETag'], 'W/' + etag)
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        # test client's response class adds default Content-Type
+        _, status, headers = Client(main.app).get(path, headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': 'W/' + etag,
+        })
+        self.assertEqual(status, '304 NOT MODIFIED')
+        self.assertNotIn('Content-Type', headers)
+        resp = self.client.get(path, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        main.app.config['COMPRESS_MIN_SIZE'] = len(plain.data) + 1
+        resp = self.client.get(path, headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, plain.data)
+
+    def test_static_urls(self):
+        """
+        Test static files referenced by pages are cached forever.
+        """
+        resp = self.client.get('/presence_weekday')
+        urls = re.findall(r'(?:href|src)="(/static/[^"]+)"', resp.data)
+        digest = helpers.static_digest('js/utils.js')
+        self.assertIn('/static/js/utils.js?v=' + digest, urls)
+        self.assertEqual(len(urls), 5)
+        for url in urls:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+        for url in ('/static/js/utils.js', '/static/js/utils.js?v=0'):
+            resp = self.client.get(url)
+            self.assertNotIn('immutable', resp.headers['Cache-Control'])
+        self.assertIsNone(helpers.static_digest('js/missing.js'))
+
+    def test_metrics_view(self):
+        """
+        Test metrics in Prometheus text format.
+        """
+        def sample(text, line):
+            """
+            Returns value of sample of given name and labels.
+            """
+            for sample_line in text.splitlines():
+                if sample_line.startswith(line + ' '):
+                    return float(sample_line.split()[-1])
+            return 0
+
+        count = (
+            'presence_request_duration_seconds_count'
+            '{endpoint="presence_weekday_view"}'
+        )
+        before = self.client.get('/metrics').data
+        self.client.get('/api/v1/presence_weekday/10')
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/plain')
+        self.assertIn(
+            '# TYPE presence_request_duration_seconds histogram', resp.data,
+        )
+        self.assertIn('# TYPE presence_cache_total counter', resp.data)
+        self.assertEqual(
+            sample(resp.data, count), sample(before, count) + 1,
+        )
+        self.assertGreater(
+            sample(
+                resp.data,
+                'presence_cache_total{function="get_data",result="hit"}',
+            ),
+            0,
+        )
+
     def test_main_view(self):
         """
         Test main view
@@ -158,7 +523,7 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         """
         Get rid of unused objects after each test.
         """
-        pass
+        forget_data()
 
     def test_get_data(self):
         """
@@ -175,6 +540,78 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             datetime.time(9, 39, 5)
         )
 
+    def test_get_data_appended(self):
+        """
+        Test reading only rows appended to CSV file since last load.
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        self.addCleanup(main.app.config.update, {'DATA_CSV': TEST_DATA_CSV})
+        self.addCleanup(setattr, utils, 'CACHE', {})
+        self.addCleanup(setattr, utils, 'TIME', {})
+        main.app.config.update({'DATA_CSV': path})
+        utils.TIME = {}
+        os.write(handle, '10,2013-09-10,09:39:05,17:59:52\n11,2013-09-10,09')
+        os.close(handle)
+
+        data = utils.get_data()
+        self.assertItemsEqual(data.keys(), [10])
+        self.assertEqual(data.source.offset, 32)
+        utils.TIME = {}
+        self.assertIs(utils.get_data(), data)
+
+        with open(path, 'a') as csvfile:
+            csvfile.write(':19:50,13:55:54\n12,2013-09-10,09:00:00,17:00:00\n')
+        utils.TIME = {}
+        appended = utils.get_data()
+        self.assertItemsEqual(appended.keys(), [10, 11, 12])
+        self.assertIs(appended[10], data[10])
+        self.assertEqual(appended[11].rows(), [(735121, 33590, 50154)])
+        self.assertNotIn(11, data)
+
+        with open(path, 'w') as csvfile:
+            csvfile.write('13,2013-09-10,09:00:00,17:00:00\n')
+        utils.TIME = {}
+        self.assertItemsEqual(utils.get_data().keys(), [13])
+
+    def test_read_rows(self):
+        """
+        Test parsing of CSV rows including irregular and invalid ones.
+        """
+        day = datetime.date(2013, 9, 10).toordinal()
+        lines = [
+            'user_id,date,start,end\n',
+            '10,2013-09-10,09:39:05,17:59:52\r\n',
+            '10,2013-09-31,09:39:05,17:59:52\n',
+            '11,2013-09-10,9:05:01,17:59:52\n',
+            '"12",2013-09-10,09:39:05,17:59:52\n',
+            '13,2013-09-10,09:39:05,24:00:00\n',
+            'abc,2013-09-10,09:39:05,17:59:52\n',
+            '\n',
+        ]
+        self.assertEqual(
+            list(utils.read_rows(lines)),
+            [
+                (10, day, 34745, 64792),
+                (11, day, 32701, 64792),
+                (12, day, 34745, 64792),
+            ],
+        )
+
+    def test_parse_day_and_time(self):
+        """
+        Test fixed-width parsing of CSV fields.
+        """
+        self.assertEqual(
+            utils.parse_day('2013-09-10'),
+            datetime.date(2013, 9, 10).toordinal(),
+        )
+        self.assertEqual(utils.parse_time('22:33:44'), 81224)
+        for value in ('2013-9-10', '2013-02-30', '2013/09/10', '+013-09-10'):
+            self.assertRaises(ValueError, utils.parse_day, value)
+        for value in ('9:05:01', '09:60:00', '09-05-01', '09:05:0x'):
+            self.assertRaises(ValueError, utils.parse_time, value)
+
     def test_get_users_names(self):
         """
         Test parsing of xml file
@@ -190,6 +627,64 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             'Maciej Z.'
         )
 
+    def test_get_users_directory(self):
+        """
+        Test reusing parsed XML file until it's modified.
+        """
+        handle, path = tempfile.mkstemp(suffix='.xml')
+        self.addCleanup(os.remove, path)
+        with open(TEST_USERS_XML) as xml_file:
+            os.write(handle, xml_file.read())
+        os.close(handle)
+        main.app.config.update({'USERS_DB_FILE': path})
+
+        directory = utils.get_users_directory()
+        self.assertIs(utils.get_users_directory(), directory)
+        self.assertIs(utils.get_users_names(), directory.names)
+        self.assertEqual(
+            [user['user_id'] for user in directory.listing], [11, 10],
+        )
+        self.assertEqual(json.loads(directory.listing_json), [
+            {u'name': u'Maciej D.', u'user_id': 11},
+            {u'name': u'Maciej Z.', u'user_id': 10},
+        ])
+
+        with open(path, 'w') as xml_file:
+            xml_file.write(
+                '<intranet><users><user id="12">'
+                '<avatar>/api/images/users/12</avatar><name>Anna B.</name>'
+                '</user></users></intranet>'
+            )
+        os.utime(path, (0, 0))
+        reloaded = utils.get_users_directory()
+        self.assertIsNot(reloaded, directory)
+        self.assertEqual(reloaded.names, {12: {'name': 'Anna B.'}})
+
+    def test_parse_users(self):
+        """
+        Test streaming parsing of users from the first users section.
+        """
+        handle, path = tempfile.mkstemp(suffix='.xml')
+        self.addCleanup(os.remove, path)
+        os.write(handle, (
+            '<intranet><server><users><user>'
+            '<avatar>/api/images/users/1</avatar><name>Server</name>'
+            '</user></users></server><users>'
+            '<user><avatar>/api/images/users/12</avatar><name>Anna B.</name>'
+            '</user><user><avatar>/13</avatar><name>\xc5\x81ukasz K.</name>'
+            '</user><user><avatar>/12</avatar><name>Duplicate</name>'
+            '</user></users><users><user><avatar>/14</avatar><name>Other'
+            '</name></user></users></intranet>'
+        ))
+        os.close(handle)
+        self.assertEqual(
+            utils.load_users_directory(path, None).names,
+            {
+                12: {'name': 'Anna B.'},
+                13: {'name': '\xc5\x81ukasz K.'},
+            },
+        )
+
     def test_group_by_weekday(self):
         """
         Test group presence entries by weekday
@@ -200,6 +695,63 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertEqual(result[3][0], 23705)
         self.assertIsInstance(result, list)
 
+    def test_weekday_stats(self):
+        """
+        Test precomputed weekday aggregates against grouped entries.
+        """
+        data = utils.load_data(SAMPLE_DATA_CSV)
+        for user in data.itervalues():
+            stats = utils.weekday_stats(user)
+            weekdays = utils.group_by_weekday(user)
+            starts_ends = utils.starts_ends_mean_of_presence(user)
+            self.assertEqual(stats.counts, [len(i) for i in weekdays])
+            self.assertEqual(stats.intervals, [sum(i) for i in weekdays])
+            self.assertEqual(
+                stats.starts,
+                [sum(starts_ends[i]['starts']) for i in range(7)],
+            )
+            self.assertEqual(
+                stats.ends,
+                [sum(starts_ends[i]['ends']) for i in range(7)],
+            )
+            self.assertEqual(utils.weekday_stats(dict(user)), stats)
+
+    def test_weekday_stats_range(self):
+        """
+        Test aggregates of date ranges against filtered entries.
+        """
+        data = utils.load_data(SAMPLE_DATA_CSV)
+        user = data[10]
+        first, last = user.days[0], user.days[-1]
+        ranges = [
+            (None, None), (first, None), (None, last), (first - 10, first),
+            (first + 100, first + 190), (last, last + 10), (last + 1, None),
+            (None, first - 1), (first + 50, first + 40),
+        ]
+        for first_day, last_day in ranges:
+            entries = dict(
+                (date, entry) for date, entry in user.iteritems()
+                if (first_day is None or date.toordinal() >= first_day) and
+                (last_day is None or date.toordinal() <= last_day)
+            )
+            self.assertEqual(
+                utils.weekday_stats(user, first_day, last_day),
+                utils.weekday_stats(entries),
+            )
+            self.assertEqual(
+                utils.weekday_stats(dict(user), first_day, last_day),
+                utils.weekday_stats(entries),
+            )
+
+    def test_sum_mean(self):
+        """
+        Test calculating arithmetic mean from sum and amount of items.
+        """
+        items = [5.234, -2.34, 1.113, 3.2412, -0.1853, 0.54, 0.797]
+        self.assertEqual(utils.sum_mean(sum(items), 7), utils.mean(items))
+        self.assertEqual(utils.sum_mean(9, 3), 3)
+        self.assertEqual(utils.sum_mean(0, 0), 0)
+
     def test_seconds_since_midnight(self):
         """
         Test of calculating amount of seconds since midnight
@@ -258,7 +810,7 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
                 0: {'starts': [33134], 'ends': [57257]},
                 1: {'starts': [33590], 'ends': [50154]},
                 2: {'starts': [33206], 'ends': [58527]},
-                3: {'starts': [37116, 34088], 'ends': [60085, 57087]},
+                3: {'starts': [34088, 37116], 'ends': [57087, 60085]},
                 4: {'starts': [47816], 'ends': [54242]},
                 5: {'starts': [], 'ends': []},
                 6: {'starts': [], 'ends': []},
@@ -266,6 +818,127 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         )
         self.assertIsInstance(result, dict)
 
+    def test_encode_json(self):
+        """
+        Test serializing to JSON with available encoders.
+        """
+        value = {10: [('Mon', 1.5, None)], 'user': u'\u0141'}
+        self.addCleanup(main.app.config.pop, 'JSON_ENCODER', None)
+        for encoder in ('json', 'auto'):
+            main.app.config['JSON_ENCODER'] = encoder
+            self.assertEqual(
+                json.loads(utils.encode_json(value)),
+                {u'10': [[u'Mon', 1.5, None]], u'user': u'\u0141'},
+            )
+        main.app.config['JSON_ENCODER'] = 'json'
+        self.assertEqual(utils.encode_json(1 / 3.0), json.dumps(1 / 3.0))
+
+    def test_jsonify_version(self):
+        """
+        Test reusing encoded results until version of data changes.
+        """
+        calls = []
+        version = [utils.DataVersion(1, 0)]
+
+        @utils.jsonify(version=lambda: version[0])
+        def view(user_id):
+            calls.append(user_id)
+            return {'user_id': user_id, 'calls': len(calls)}
+
+        def get(path, user_id):
+            with main.app.test_request_context(path):
+                return json.loads(view(user_id).data)
+
+        utils.ENCODED.clear()
+        self.assertEqual(get('/?a=1', 10), {'user_id': 10, 'calls': 1})
+        self.assertEqual(get('/?a=1', 10), {'user_id': 10, 'calls': 1})
+        self.assertEqual(get('/?a=2', 10), {'user_id': 10, 'calls': 2})
+        version[0] = utils.DataVersion(2, 0)
+        self.assertEqual(get('/?a=1', 10), {'user_id': 10, 'calls': 3})
+        self.assertEqual(get('/?a=1', 10), {'user_id': 10, 'calls': 3})
+        self.assertEqual(len(utils.ENCODED), 2)
+
+        with main.app.test_request_context('/?a=1'):
+            etag = view(10).headers['ETag']
+        utils.ENCODED.clear()
+        with main.app.test_request_context(
+                '/?a=1', headers={'If-None-Match': etag},
+        ):
+            self.assertEqual(view(10).status_code, 304)
+        # without encoded body the view is called to validate the request
+        self.assertEqual(len(calls), 4)
+
+    def test_metrics(self):
+        """
+        Test counting and rendering metrics.
+        """
+        counter = metrics.Counter('test_total', 'Test counter.')
+        self.addCleanup(metrics.REGISTRY.remove, counter)
+        histogram = metrics.Histogram(
+            'test_seconds', 'Test histogram.', (0.1, 1),
+        )
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        counter.inc()
+        counter.inc(2, result='a"b')
+        histogram.observe(0.05, name='x')
+        histogram.observe(0.5, name='x')
+        histogram.observe(5, name='x')
+        text = metrics.render()
+        self.assertIn(
+            '# HELP test_total Test counter.\n'
+            '# TYPE test_total counter\n'
+            'test_total 1\n'
+            'test_total{result="a\\"b"} 2\n',
+            text,
+        )
+        self.assertIn(
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{name="x",le="0.1"} 1\n'
+            'test_seconds_bucket{name="x",le="1"} 2\n'
+            'test_seconds_bucket{name="x",le="+Inf"} 3\n'
+            'test_seconds_sum{name="x"} 5.55\n'
+            'test_seconds_count{name="x"} 3\n',
+            text,
+        )
+
+        @histogram.time()
+        def function():
+            return 1
+
+        self.assertEqual(function(), 1)
+        self.assertEqual(histogram.collect()[()][0][0], 1)
+
+        threads = [
+            threading.Thread(target=lambda: (
+                counter.inc(), histogram.observe(0.05, name='x'),
+            ))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.collect()[()], 5)
+        # values of finished threads were merged
+        self.assertEqual(len(counter.shards), 1)
+        self.assertEqual(histogram.collect()[(('name', 'x'),)][0][0], 5)
+        self.assertIn('test_total 5\n', metrics.render())
+
+    def test_metrics_retire_threads(self):
+        """
+        Test values of finished threads are merged without rendering.
+        """
+        counter = metrics.Counter('test_total', 'Test counter.')
+        self.addCleanup(metrics.REGISTRY.remove, counter)
+        counter.inc()
+        for _ in range(20):
+            thread = threading.Thread(target=counter.inc)
+            thread.start()
+            thread.join()
+            # the main thread and the last one
+            self.assertEqual(len(counter.shards), 2)
+        self.assertEqual(counter.collect()[()], 21)
+
     def test_cache(self):
         """
         Test caching of CSV file
@@ -274,13 +947,1286 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         main.app.config.update({'DATA_CSV': TEST_CACHE_CSV})
         result_cached = utils.get_data()
         self.assertEqual(result_cached, result)
-        utils.TIME = {}
-        utils.CACHE = {}
+        forget_data()
         new_result = utils.get_data()
         self.assertNotEqual(new_result, result)
         main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        forget_data()
+
+
+class PresenceAnalyzerStoreTestCase(unittest.TestCase):
+    """
+    Presence store tests.
+    """
+
+    def test_user_presence_lookup(self):
+        """
+        Test dict-like access to entries of a single user.
+        """
+        day = datetime.date(2013, 9, 10)
+        user = store.UserPresence([day.toordinal()], [34745], [64792])
+        self.assertEqual(len(user), 1)
+        self.assertIn(day, user)
+        self.assertNotIn(datetime.date(2013, 9, 11), user)
+        self.assertNotIn('2013-09-10', user)
+        self.assertEqual(list(user), [day])
+        self.assertEqual(
+            user[day],
+            {
+                'start': datetime.time(9, 39, 5),
+                'end': datetime.time(17, 59, 52),
+            },
+        )
+        with self.assertRaises(KeyError):
+            user.__getitem__(datetime.date(2013, 9, 11))
+
+    def test_store_from_rows(self):
+        """
+        Test building of store from unordered rows with duplicated days.
+        """
+        data = store.PresenceStore.from_rows([
+            (10, 735000, 100, 200),
+            (11, 735001, 300, 400),
+            (10, 734999, 500, 600),
+            (10, 735000, 700, 800),
+        ])
+        self.assertIsInstance(data, dict)
+        self.assertItemsEqual(data.keys(), [10, 11])
+        self.assertEqual(
+            data[10].rows(),
+            [(734999, 500, 600), (735000, 700, 800)],
+        )
+        self.assertEqual(data[11].rows(), [(735001, 300, 400)])
+        self.assertEqual(
+            data[10],
+            {
+                datetime.date.fromordinal(734999): {
+                    'start': datetime.time(0, 8, 20),
+                    'end': datetime.time(0, 10),
+                },
+                datetime.date.fromordinal(735000): {
+                    'start': datetime.time(0, 11, 40),
+                    'end': datetime.time(0, 13, 20),
+                },
+            },
+        )
+
+    def test_store_derive(self):
+        """
+        Test values derived from store are computed once per store.
+        """
+        data = store.PresenceStore.from_rows([(10, 735000, 100, 200)])
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(data.derive('key', compute), 1)
+        self.assertEqual(data.derive('key', compute), 1)
+        self.assertEqual(data.derive('other', compute), 2)
+        merged = data.merge([(10, 735001, 100, 200)])
+        self.assertEqual(merged.derive('key', compute), 3)
+
+    def test_store_merge(self):
+        """
+        Test merging rows into store updates weekday aggregates.
+        """
+        rows = [
+            (10, 735000, 100, 200),
+            (11, 735001, 300, 400),
+            (10, 735002, 500, 600),
+            (10, 735003, 700, 900),
+            (10, 735001, 100, 800),
+        ]
+        for split in range(len(rows) + 1):
+            data = store.PresenceStore.from_rows(rows[:split])
+            merged = data.merge(rows[split:])
+            expected = store.PresenceStore.from_rows(rows)
+            self.assertEqual(merged, expected)
+            for user_id in expected:
+                self.assertEqual(
+                    merged[user_id].stats, expected[user_id].stats,
+                )
+        self.assertEqual(expected[10].stats.counts, [1, 1, 1, 0, 0, 0, 1])
+        self.assertEqual(
+            expected[10].stats.intervals, [700, 100, 200, 0, 0, 0, 100],
+        )
+
+    def test_sketches_merge(self):
+        """
+        Test sketches carried over by merge match sketches of all entries.
+        """
+        rows = [
+            (10, 735000, 30000, 60000),
+            (10, 735007, 33000, 61000),
+            (10, 735008, 34000, 62000),
+        ]
+        data = store.PresenceStore.from_rows(rows[:1])
+        data[10].sketches()
+        merged = data.merge(rows[1:])
+        expected = store.PresenceStore.from_rows(rows)[10].sketches()
+        self.assertEqual(merged[10].sketches(), expected)
+        self.assertEqual(expected.starts[6].total, 2)
+        self.assertEqual(
+            merged[10].sketches(735001, None),
+            store.UserPresence([735007, 735008], [33000, 34000],
+                               [61000, 62000]).sketches(),
+        )
+
+    def test_histogram_quantile(self):
+        """
+        Test estimating quantiles from histogram.
+        """
+        histogram = sketches.Histogram()
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in range(0, 100 * sketches.BIN_WIDTH, sketches.BIN_WIDTH):
+            histogram.add(value + 1)
+        self.assertEqual(histogram.total, 100)
+        self.assertEqual(histogram.quantile(0.5), 50 * sketches.BIN_WIDTH)
+        self.assertEqual(histogram.quantile(0.9), 90 * sketches.BIN_WIDTH)
+        self.assertEqual(histogram.quantile(0), 0)
+        self.assertEqual(histogram.quantile(1), 100 * sketches.BIN_WIDTH)
+        other = histogram.copy()
+        other.add(0)
+        self.assertEqual(histogram.update(other).total, 201)
+        self.assertEqual(histogram.counts[0], 3)
+
+    def test_histogram_bins(self):
+        """
+        Test keeping only used range of histogram bins.
+        """
+        histogram = sketches.Histogram()
+        histogram.add(10 * sketches.BIN_WIDTH)
+        histogram.add(12 * sketches.BIN_WIDTH + 1)
+        self.assertEqual(
+            (histogram.first, list(histogram.bins)), (10, [1, 0, 1]),
+        )
+        self.assertEqual(len(histogram.counts), sketches.BINS)
+        other = histogram.copy()
+        other.add(5 * sketches.BIN_WIDTH)
+        self.assertEqual(histogram.total, 2)
+        self.assertEqual((other.first, len(other.bins)), (5, 8))
+        histogram.update(sketches.Histogram()).update(other)
+        self.assertEqual((histogram.first, len(histogram.bins)), (5, 8))
+        self.assertEqual(histogram.counts[10], 2)
+        self.assertEqual(sketches.Histogram(histogram.counts), histogram)
+        self.assertEqual(
+            sketches.Histogram([0] * sketches.BINS), sketches.Histogram(),
+        )
+
+    def test_mapped_column(self):
+        """
+        Test column of ints read from a buffer.
+        """
+        values = array.array('i', [3, 5, 8, 13])
+        column = store.MappedColumn(buffer(values.tostring()))
+        self.assertEqual(len(column), 4)
+        self.assertEqual(list(column), [3, 5, 8, 13])
+        self.assertEqual((column[0], column[-1]), (3, 13))
+        self.assertRaises(IndexError, lambda: column[4])
+        self.assertEqual(column[1:3], array.array('i', [5, 8]))
+        self.assertEqual(column[::2], array.array('i', [3, 8]))
+        self.assertEqual(column + [21], array.array('i', [3, 5, 8, 13, 21]))
+        self.assertEqual(column, values)
+        self.assertIs(store.as_column(column), column)
+
+        user = store.UserPresence(column, column, column)
+        copied = store.UserPresence(values, values, values)
+        self.assertEqual(user.stats, copied.stats)
+        self.assertEqual(
+            user.weekday_stats(5, 13), copied.weekday_stats(5, 13),
+        )
+        merged = user.merge([21], [1], [2])
+        self.assertEqual(merged.days, array.array('i', [3, 5, 8, 13, 21]))
+
+    def test_day_weekday(self):
+        """
+        Test calculating weekday of day ordinal.
+        """
+        day = datetime.date(2013, 9, 10)
+        self.assertEqual(store.day_weekday(day.toordinal()), day.weekday())
+        self.assertEqual(store.day_weekday(day.toordinal() + 5), 6)
+
+
+class PresenceAnalyzerCacheTestCase(unittest.TestCase):
+    """
+    Cache decorator tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+        @utils.cache(600)
+        def cached(*args, **kwargs):
+            """
+            Records calls and waits until released.
+            """
+            self.calls.append((args, kwargs))
+            self.release.wait(5)
+            return len(self.calls)
+        self.cached = cached
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.release.set()
+        forget_data()
+
+    def test_cache_per_arguments(self):
+        """
+        Test caching results separately for every set of arguments.
+        """
+        self.assertEqual(self.cached(), 1)
+        self.assertEqual(self.cached(1), 2)
+        self.assertEqual(self.cached(1, key='a'), 3)
+        self.assertEqual(self.cached(), 1)
+        self.assertEqual(self.cached(1), 2)
+        self.assertEqual(self.cached(1, key='a'), 3)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_cache_stale_while_revalidate(self):
+        """
+        Test serving expired value while other thread computes new one.
+        """
+        self.assertEqual(self.cached(), 1)
         utils.TIME = {}
-        utils.CACHE = {}
+        self.release.clear()
+        refresh = threading.Thread(target=self.cached)
+        refresh.start()
+        while len(self.calls) < 2:
+            time.sleep(0.001)
+        self.assertEqual(self.cached(), 1)
+        self.release.set()
+        refresh.join()
+        self.assertEqual(self.cached(), 2)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_cache_single_computation(self):
+        """
+        Test computing missing value once for concurrent calls.
+        """
+        self.release.clear()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.cached()))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        while not self.calls:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1] * 10)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_cache_refresh(self):
+        """
+        Test computing fresh value in advance.
+        """
+        self.assertEqual(self.cached(1), 1)
+        self.assertEqual(self.cached.refresh(1), 2)
+        self.assertEqual(self.cached(1), 2)
+        self.assertEqual(self.cached(), 3)
+        self.assertEqual(len(self.calls), 3)
+
+
+class UsersSourceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves users XML file with ETag of its content.
+    """
+    body = ''
+    status = 200
+    requests = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Responds with the file or 304 when it wasn't modified.
+        """
+        etag = '"{}"'.format(hash(self.body))
+        self.requests.append(dict(self.headers))
+        if self.status != 200:
+            self.send_response(self.status)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        Keeps test output clean.
+        """
+        pass
+
+
+class PresenceAnalyzerUpdateUsersTestCase(unittest.TestCase):
+    """
+    Updating users file tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'users.xml')
+        with open(TEST_USERS_XML) as xml_file:
+            UsersSourceHandler.body = xml_file.read()
+        UsersSourceHandler.status = 200
+        UsersSourceHandler.requests = []
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), UsersSourceHandler,
+        )
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.01,),
+        ).start()
+        main.app.config.update({
+            'USERS_DB_FILE': self.path,
+            'USERS_SOURCE': 'http://127.0.0.1:{}/users.xml'.format(
+                self.server.server_port,
+            ),
+        })
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+        main.app.config.update({'USERS_DB_FILE': TEST_USERS_XML})
+
+    def test_update_user_names(self):
+        """
+        Test downloading file only when it was modified.
+        """
+        self.assertTrue(utils.update_user_names())
+        self.assertEqual(
+            utils.get_users_names(),
+            {10: {'name': 'Maciej Z.'}, 11: {'name': 'Maciej D.'}},
+        )
+        self.assertFalse(utils.update_user_names())
+        self.assertEqual(
+            UsersSourceHandler.requests[1]['if-none-match'],
+            '"{}"'.format(hash(UsersSourceHandler.body)),
+        )
+
+        UsersSourceHandler.body = UsersSourceHandler.body.replace(
+            'Maciej Z.', 'Maciej X.',
+        )
+        self.assertTrue(utils.update_user_names())
+        self.assertEqual(utils.get_users_names()[10], {'name': 'Maciej X.'})
+        self.assertItemsEqual(
+            os.listdir(self.directory), ['users.xml', 'users.xml.validators'],
+        )
+
+    def test_update_user_names_error(self):
+        """
+        Test keeping the file when download fails.
+        """
+        self.assertTrue(utils.update_user_names())
+        UsersSourceHandler.status = 500
+        os.remove(self.path + '.validators')
+        self.assertRaises(urllib2.HTTPError, utils.update_user_names)
+        with open(self.path) as xml_file:
+            self.assertEqual(xml_file.read(), UsersSourceHandler.body)
+        self.assertNotIn('if-none-match', UsersSourceHandler.requests[1])
+        self.assertEqual(os.listdir(self.directory), ['users.xml'])
+
+
+class PresenceAnalyzerSnapshotTestCase(unittest.TestCase):
+    """
+    Presence data snapshot tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.csv')
+        shutil.copy(SAMPLE_DATA_CSV, self.path)
+        main.app.config.update({'DATA_CSV': self.path, 'DATA_SNAPSHOT': True})
+        forget_data()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.directory)
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV, 'DATA_SNAPSHOT': False,
+        })
+        forget_data()
+
+    def test_dump_and_load(self):
+        """
+        Test reading data back from snapshot.
+        """
+        data = utils.load_data(self.path)
+        utils.write_snapshot(data)
+        loaded = snapshot.load(snapshot.snapshot_path(self.path))
+        self.assertEqual(loaded, data)
+        self.assertEqual(loaded.source, data.source)
+        for user_id, user in data.iteritems():
+            self.assertEqual(loaded[user_id].stats, user.stats)
+            self.assertEqual(loaded[user_id].days, user.days)
+
+    def test_get_data_snapshot(self):
+        """
+        Test starting from snapshot and writing it after full reads.
+        """
+        data = utils.get_data()
+        snapshot_path = snapshot.snapshot_path(self.path)
+        self.assertEqual(utils.read_snapshot(self.path), data)
+
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('99,2013-09-10,09:00:00,17:00:00\n')
+        forget_data()
+        appended = utils.get_data()
+        self.assertEqual(appended[99].rows(), [(735121, 32400, 61200)])
+        self.assertEqual(appended, utils.load_data(self.path))
+        # appended rows are parsed again, snapshot isn't rewritten
+        self.assertNotIn(99, utils.read_snapshot(self.path))
+        forget_data()
+        self.assertEqual(utils.get_data(), appended)
+
+        with open(self.path, 'r+') as csvfile:
+            csvfile.write('98')
+        self.assertIsNone(utils.read_snapshot(self.path))
+        with open(snapshot_path, 'w') as snapshot_file:
+            snapshot_file.write('corrupted')
+        self.assertIsNone(utils.read_snapshot(self.path))
+        forget_data()
+        self.assertIn(98, utils.get_data())
+
+    def test_load_shared(self):
+        """
+        Test reading data from snapshot without copying columns.
+        """
+        data = utils.load_data(self.path)
+        utils.write_snapshot(data)
+        with open(snapshot.snapshot_path(self.path), 'rb') as snapshot_file:
+            _, header_size = snapshot.PREFIX.unpack(
+                snapshot_file.read(snapshot.PREFIX.size),
+            )
+        self.assertEqual(
+            (snapshot.PREFIX.size + header_size) % snapshot.ALIGNMENT, 0,
+        )
+        shared = snapshot.load(snapshot.snapshot_path(self.path), shared=True)
+        self.assertEqual(shared, data)
+        for user_id, user in shared.iteritems():
+            self.assertIsInstance(user.days, store.MappedColumn)
+            self.assertEqual(list(user.ends), list(data[user_id].ends))
+        self.assertEqual(
+            utils.all_weekday_stats(shared),
+            utils.all_weekday_stats(data),
+        )
+
+    def test_get_shared_data(self):
+        """
+        Test reading data only from snapshot replaced by other process.
+        """
+        main.app.config.update({'DATA_SHARED': True})
+        self.addCleanup(main.app.config.update, {'DATA_SHARED': False})
+        data = utils.get_data()
+        self.assertFalse(os.path.exists(snapshot.snapshot_path(self.path)))
+        self.assertEqual(data, utils.load_data(self.path))
+
+        utils.write_snapshot(data)
+        utils.TIME = {}
+        shared = utils.get_data()
+        self.assertEqual(shared, data)
+        self.assertIsInstance(shared[10].days, store.MappedColumn)
+        utils.TIME = {}
+        self.assertIs(utils.get_data(), shared)
+
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('99,2013-09-10,09:00:00,17:00:00\n')
+        utils.write_snapshot(utils.load_data(self.path, shared))
+        prefork.expire_data()
+        self.assertIn(99, utils.get_data())
+
+
+@unittest.skipUnless(vectorized.available(), 'NumPy is not installed')
+class PresenceAnalyzerVectorizedTestCase(unittest.TestCase):
+    """
+    Parity tests of NumPy backend and pure Python functions.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.data = utils.load_data(SAMPLE_DATA_CSV)
+
+    def test_weekday_stats(self):
+        """
+        Test aggregates of all users.
+        """
+        first, last = 734300, 734500
+        for first_day, last_day in (
+                (None, None), (first, None), (None, last), (first, last),
+                (last, first),
+        ):
+            self.assertEqual(
+                vectorized.weekday_stats(self.data, first_day, last_day),
+                dict(
+                    (user_id, utils.weekday_stats(user, first_day, last_day))
+                    for user_id, user in self.data.iteritems()
+                ),
+            )
+        self.assertEqual(
+            vectorized.weekday_stats(store.PresenceStore()), {},
+        )
+
+    def test_all_weekday_stats(self):
+        """
+        Test choosing backend of aggregates of all users.
+        """
+        self.addCleanup(main.app.config.pop, 'ANALYTICS_BACKEND', None)
+        vectorized_stats = utils.all_weekday_stats(self.data, 734300)
+        main.app.config['ANALYTICS_BACKEND'] = 'python'
+        self.assertEqual(
+            utils.all_weekday_stats(self.data, 734300), vectorized_stats,
+        )
+
+
+class PresenceAnalyzerProfilingTestCase(unittest.TestCase):
+    """
+    Request profiling tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV, 'USERS_DB_FILE': TEST_USERS_XML,
+        })
+        self.directory = tempfile.mkdtemp()
+        self.config = {'PROFILE_SECRET': 'secret'}
+        self.middleware = profiling.ProfilerMiddleware(
+            main.app.wsgi_app, self.config, self.directory,
+        )
+        self.client = Client(self.middleware, BaseResponse)
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.directory)
+
+    def test_profile_requested(self):
+        """
+        Test profiling requests carrying the secret.
+        """
+        path = '/api/v1/presence_weekday/10'
+        resp = self.client.get(path)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.client.get(path, headers={'X-Profile': 'wrong'})
+        self.client.get(path + '?profile=wrong')
+        self.assertEqual(os.listdir(self.directory), [])
+
+        profiled = self.client.get(path, headers={'X-Profile': 'secret'})
+        self.assertEqual(profiled.data, resp.data)
+        self.client.get(path + '?profile=secret')
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(
+            names[0].endswith('-GET-api_v1_presence_weekday_10.prof'),
+        )
+        stats = pstats.Stats(os.path.join(self.directory, names[0]))
+        self.assertTrue(any(
+            function == 'full_dispatch_request'
+            for _, _, function in stats.stats
+        ))
+
+    def test_sampling_and_retention(self):
+        """
+        Test sampling profiler and removing old profiles.
+        """
+        self.config.update({
+            'PROFILER': 'sampling',
+            'PROFILE_INTERVAL': 0.001,
+            'PROFILE_RETENTION': 2,
+            'PROFILE_SAMPLE_RATE': 1,
+        })
+        for _ in range(3):
+            self.client.get('/api/v1/weekday_stats?user_id=all')
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith('.folded') for name in names))
+
+        sampler = profiling.Sampler(0.001)
+        sampler.start(threading.current_thread().ident)
+        finish = time.time() + 0.05
+        while time.time() < finish:
+            pass
+        sampler.stop()
+        path = os.path.join(self.directory, 'test.folded')
+        sampler.dump_stats(path)
+        with open(path) as profile_file:
+            lines = profile_file.read().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertIn('test_sampling_and_retention', stack)
+        self.assertGreater(int(count), 0)
+
+    def test_install(self):
+        """
+        Test wrapping Flask app only once.
+        """
+        self.addCleanup(delattr, main.app, 'wsgi_app')
+        middleware = profiling.install(main.app, self.directory)
+        self.assertIs(profiling.install(main.app, self.directory), middleware)
+        self.assertIs(main.app.wsgi_app, middleware)
+        self.assertNotIsInstance(
+            middleware.app, profiling.ProfilerMiddleware,
+        )
+
+
+class PresenceAnalyzerPreforkTestCase(unittest.TestCase):
+    """
+    Pre-forking server tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.csv')
+        shutil.copy(TEST_DATA_CSV, self.path)
+        main.app.config.update({
+            'DATA_CSV': self.path, 'USERS_DB_FILE': TEST_USERS_XML,
+        })
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.directory)
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        forget_data()
+
+    def fetch(self, url, timeout=5):
+        """
+        Requests url until it's found or timeout passes.
+        """
+        finish = time.time() + timeout
+        while True:
+            try:
+                return urllib2.urlopen(url, timeout=timeout).read()
+            except urllib2.HTTPError as error:
+                if error.code != 404 or time.time() > finish:
+                    raise
+            time.sleep(0.05)
+
+    def test_serve_and_reload(self):
+        """
+        Test serving shared data from workers and reloading it.
+        """
+        server = prefork.PreforkServer(
+            main.app, '127.0.0.1', 0, workers=2, reload_interval=0.05,
+        )
+        url = 'http://127.0.0.1:{}/api/v1/presence_weekday/'.format(
+            server.address[1],
+        )
+        pid = os.fork()
+        if not pid:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+        server.server.server_close()
+        self.addCleanup(os.waitpid, pid, 0)
+        self.addCleanup(os.kill, pid, signal.SIGTERM)
+
+        expected = main.app.test_client().get('/api/v1/presence_weekday/10')
+        self.assertEqual(
+            json.loads(self.fetch(url + '10')), json.loads(expected.data),
+        )
+        self.assertTrue(
+            os.path.exists(snapshot.snapshot_path(self.path)),
+        )
+
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('\n99,2013-09-10,09:00:00,17:00:00\n')
+        for _ in range(4):
+            self.assertEqual(
+                json.loads(self.fetch(url + '99'))[2], ['Tue', 28800],
+            )
+
+
+class PresenceAnalyzerEventLoopTestCase(unittest.TestCase):
+    """
+    Event loop server tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV, 'USERS_DB_FILE': TEST_USERS_XML,
+        })
+        self.server = eventloop.EventLoopServer(
+            main.app, '127.0.0.1', 0, reload_interval=0.05,
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.server.stop()
+        self.thread.join()
+        self.assertNotIn('watched', utils.USERS)
+        forget_data()
+
+    def connect(self):
+        """
+        Returns connection to the server.
+        """
+        return httplib.HTTPConnection(
+            '127.0.0.1', self.server.address[1], timeout=5,
+        )
+
+    def test_same_responses(self):
+        """
+        Test serving the same responses as Flask test client.
+        """
+        client = main.app.test_client()
+        connection = self.connect()
+        paths = (
+            '/api/v1/presence_weekday/1',
+            '/api/v1/users',
+            '/api/v1/mean_time_weekday/11?from=2013-09-11',
+            '/api/v1/presence_weekday/10',
+        )
+        for path in paths:
+            expected = client.get(path)
+            connection.request('GET', path)
+            resp = connection.getresponse()
+            self.assertEqual(resp.read(), expected.data)
+            self.assertEqual(resp.status, expected.status_code)
+            self.assertEqual(
+                resp.getheader('Content-Type'), expected.content_type,
+            )
+            self.assertEqual(
+                resp.getheader('ETag'), expected.headers.get('ETag'),
+            )
+
+        connection.request(
+            'GET', '/api/v1/presence_weekday/10',
+            headers={'If-None-Match': expected.headers['ETag']},
+        )
+        resp = connection.getresponse()
+        self.assertEqual(resp.status, 304)
+        self.assertEqual(resp.read(), '')
+
+    def test_connections(self):
+        """
+        Test keep-alive, closing connections and invalid requests.
+        """
+        connection = self.connect()
+        connection.request('GET', '/api/v1/users')
+        connection.getresponse().read()
+        connection.request('HEAD', '/api/v1/users')
+        resp = connection.getresponse()
+        self.assertEqual(resp.read(), '')
+        self.assertGreater(int(resp.getheader('Content-Length')), 0)
+        self.assertFalse(resp.will_close)
+        connection.request(
+            'GET', '/api/v1/users', headers={'Connection': 'close'},
+        )
+        self.assertTrue(connection.getresponse().will_close)
+
+        connection = self.connect()
+        connection.connect()
+        connection.sock.sendall('GET /api/v1/users HTTP/1.0\r\n\r\n')
+        resp = httplib.HTTPResponse(connection.sock)
+        resp.begin()
+        self.assertEqual(resp.status, 200)
+        self.assertTrue(resp.will_close)
+
+        connection = self.connect()
+        connection.connect()
+        connection.sock.sendall('nonsense\r\n\r\n')
+        resp = httplib.HTTPResponse(connection.sock)
+        resp.begin()
+        self.assertEqual(resp.status, 400)
+
+    def test_reload_in_background(self):
+        """
+        Test reloading data before its cache expires.
+        """
+        utils.get_data()
+        expires = utils.TIME['get_data']
+        finish = time.time() + 5
+        while utils.TIME['get_data'] == expires and time.time() < finish:
+            time.sleep(0.01)
+        self.assertGreater(utils.TIME['get_data'], expires)
+        self.assertEqual(utils.LOADED['watched'], TEST_DATA_CSV)
+        self.assertEqual(utils.USERS['watched'], TEST_USERS_XML)
+        # pylint: disable=protected-access
+        self.assertIn(('company_stats', None), utils.get_data()._derived)
+
+
+class PresenceAnalyzerRefresherTestCase(unittest.TestCase):
+    """
+    Background refresher tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.csv')
+        shutil.copy(TEST_DATA_CSV, self.path)
+        main.app.config.update({
+            'DATA_CSV': self.path, 'USERS_DB_FILE': TEST_USERS_XML,
+        })
+        forget_data()
+        self.refresher = refresher.Refresher(main.app, 60, debounce=2)
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.refresher.stop()
+        shutil.rmtree(self.directory)
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        forget_data()
+
+    def test_check(self):
+        """
+        Test refreshing files after they settle.
+        """
+        self.assertEqual(self.refresher.check(100), [])
+        self.assertNotIn('get_data', utils.CACHE)
+        self.assertEqual(self.refresher.check(102), ['data', 'users'])
+        data = utils.CACHE['get_data']
+        self.assertEqual(sorted(data), [10, 11])
+        # pylint: disable=protected-access
+        self.assertIsNone(data[10]._sketches)
+        self.assertIn(('company_stats', None), data._derived)
+        self.assertEqual(utils.USERS['watched'], TEST_USERS_XML)
+        self.assertIs(
+            utils.get_users_directory(), utils.USERS['directory'],
+        )
+        self.assertEqual(self.refresher.check(110), [])
+
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('\n99,2013-09-10,09:00:00,17:00:00\n')
+        self.assertEqual(self.refresher.check(111), [])
+        self.assertIs(utils.get_data(), data)
+        # expired data isn't read by requests while the refresher watches
+        self.assertEqual(utils.LOADED['watched'], self.path)
+        utils.TIME = {}
+        self.assertIs(utils.get_data(), data)
+        self.assertEqual(self.refresher.check(112.5), [])
+        self.assertEqual(self.refresher.check(113), ['data'])
+        self.assertIn(99, utils.get_data())
+        self.assertIsNot(utils.get_data(), data)
+
+        os.remove(self.path)
+        self.assertEqual(self.refresher.check(120), [])
+        self.assertEqual(self.refresher.check(130), [])
+        self.refresher.stop()
+        self.assertNotIn('watched', utils.LOADED)
+        self.assertNotIn('watched', utils.USERS)
+
+    def test_refresh_data(self):
+        """
+        Test requests get the previous data while the new one is warmed.
+        """
+        self.refresher.check(100)
+        self.refresher.check(102)
+        data = utils.get_data()
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('\n99,2013-09-10,09:00:00,17:00:00\n')
+        seen = []
+        warm_data = utils.warm_data
+
+        def warm(new_data):
+            """
+            Gets data like an expired request while warming.
+            """
+            utils.TIME = {}
+            seen.append(utils.get_data())
+            warm_data(new_data)
+
+        utils.warm_data = warm
+        self.addCleanup(setattr, utils, 'warm_data', warm_data)
+        self.refresher.refresh_data(self.path)
+        self.assertEqual(len(seen), 1)
+        self.assertIs(seen[0], data)
+        self.assertIn(99, utils.get_data())
+
+    def test_start(self):
+        """
+        Test starting refresher thread from configuration.
+        """
+        self.assertIsNone(refresher.start(main.app))
+        main.app.config.update({'REFRESH_INTERVAL': 0.01})
+        self.addCleanup(main.app.config.pop, 'REFRESH_INTERVAL')
+        running = refresher.start(main.app)
+        self.addCleanup(running.join)
+        self.addCleanup(running.stop)
+        self.assertIs(refresher.start(main.app), running)
+        finish = time.time() + 5
+        while 'get_data' not in utils.CACHE and time.time() < finish:
+            time.sleep(0.01)
+        self.assertIn(10, utils.get_data())
+
+
+class PresenceAnalyzerDatabaseTestCase(unittest.TestCase):
+    """
+    SQLite backend tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.sqlite')
+        self.count = utils.import_csv(TEST_DATA_CSV, self.path, batch_size=7)
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV, 'USERS_DB_FILE': TEST_USERS_XML,
+        })
+        self.client = main.app.test_client()
+        forget_data()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('DATA_BACKEND', None)
+        main.app.config.pop('DATA_SQLITE', None)
+        shutil.rmtree(self.directory)
+        forget_data()
+
+    def test_import(self):
+        """
+        Test batched import and replacing entries of imported days.
+        """
+        data = utils.load_data(TEST_DATA_CSV)
+        self.assertEqual(self.count, sum(len(user) for user in data.values()))
+        store = database.SQLiteStore(self.path)
+        self.assertEqual(sorted(store), sorted(data))
+        self.assertEqual(len(store), len(data))
+        self.assertIn(10, store)
+        self.assertNotIn(99, store)
+        self.assertNotIn('10', store)
+        with self.assertRaises(KeyError):
+            store[99]  # pylint: disable=pointless-statement
+        for user_id, user in data.iteritems():
+            self.assertEqual(list(store[user_id].days), list(user.days))
+            self.assertEqual(list(store[user_id].starts), list(user.starts))
+            self.assertEqual(list(store[user_id].ends), list(user.ends))
+
+        day = data[10].days[0]
+        self.assertEqual(
+            database.import_rows(self.path, [(10, day, 0, 60), (99, 1, 2, 3)]),
+            2,
+        )
+        store = database.SQLiteStore(self.path)
+        self.assertEqual(store[10].columns()[1][0], 0)
+        self.assertEqual(len(store[10].days), len(data[10].days))
+        self.assertIn(99, store)
+        with self.assertRaises(TypeError):
+            store[10].merge(array.array('i'), [], [])
+
+    def test_stats(self):
+        """
+        Test weekday stats computed by grouped queries.
+        """
+        data = utils.load_data(TEST_DATA_CSV)
+        store = database.SQLiteStore(self.path)
+        first = datetime.date(2013, 9, 10).toordinal()
+        last = datetime.date(2013, 9, 12).toordinal()
+        for bounds in ((None, None), (first, None), (None, last),
+                       (first, last)):
+            expected = utils.all_weekday_stats(data, *bounds)
+            stats = utils.all_weekday_stats(store, *bounds)
+            self.assertEqual(sorted(stats), sorted(expected))
+            for user_id, user_stats in expected.iteritems():
+                for name in ('counts', 'intervals', 'starts', 'ends'):
+                    self.assertEqual(
+                        list(getattr(stats[user_id], name)),
+                        list(getattr(user_stats, name)),
+                    )
+                self.assertEqual(
+                    list(store[user_id].weekday_stats(*bounds).counts),
+                    list(user_stats.counts),
+                )
+                self.assertEqual(
+                    store[user_id].sketches(*bounds),
+                    data[user_id].sketches(*bounds),
+                )
+
+        group_of = {10: 'a'}.get
+        expected = company.company_stats(data, group_of)
+        stats = database.company_stats(store, group_of)
+        self.assertEqual(sorted(stats), sorted(expected))
+        for group, group_stats in expected.iteritems():
+            self.assertEqual(stats[group].users, group_stats.users)
+            self.assertEqual(stats[group].weekdays, group_stats.weekdays)
+            self.assertEqual(stats[group].arrivals, group_stats.arrivals)
+            self.assertEqual(stats[group].present, group_stats.present)
+
+    def test_views(self):
+        """
+        Test views serving SQLite backend as they serve CSV file.
+        """
+        paths = [
+            '/api/v1/users',
+            '/api/v1/mean_time_weekday/10',
+            '/api/v1/presence_weekday/11',
+            '/api/v1/presence_start_end/10?from=2013-09-10',
+            '/api/v1/presence_percentiles/11',
+            '/api/v1/weekday_stats?user_id=all',
+            '/api/v1/weekday_stats?user_id=all&from=2013-09-13',
+            '/api/v1/presence_percentiles/10?from=2013-09-11',
+            '/api/v1/company/mean_time_weekday',
+            '/api/v1/company/arrivals',
+            '/api/v1/company/arrivals?group_by=name',
+            '/api/v1/company/present_per_day?group_by=id',
+        ]
+        expected = [self.client.get(path) for path in paths]
+        forget_data()
+        main.app.config.update({
+            'DATA_BACKEND': 'sqlite', 'DATA_SQLITE': self.path,
+        })
+        self.assertIsInstance(utils.get_data(), database.SQLiteStore)
+        self.assertEqual(utils.data_path(), self.path)
+        for path, response in zip(paths, expected):
+            resp = self.client.get(path)
+            self.assertEqual(resp.status_code, response.status_code, path)
+            self.assertEqual(
+                json.loads(resp.data), json.loads(response.data), path,
+            )
+        self.assertEqual(
+            self.client.get('/api/v1/mean_time_weekday/99').status_code, 404,
+        )
+        # users keep aggregates, not columns of the whole history
+        for user in utils.get_data().users.itervalues():
+            self.assertEqual(
+                sorted(vars(user)),
+                ['_sketches', '_stats', 'store', 'user_id'],
+            )
+
+        store = utils.read_data()
+        self.assertIs(utils.read_data(), store)
+        database.import_rows(self.path, [(99, 1, 2, 3)])
+        self.assertIsNot(utils.read_data(), store)
+
+        main.app.config.update({'DATA_BACKEND': 'oracle'})
+        with self.assertRaises(ValueError):
+            utils.read_data()
+
+
+class PresenceAnalyzerPartitionsTestCase(unittest.TestCase):
+    """
+    Partitioned data tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.csv')
+        shutil.copy(TEST_DATA_CSV, self.path)
+        with open(self.path, 'a') as csvfile:
+            csvfile.write(
+                '\n10,2011-06-01,08:38:43,17:19:02\n'
+                '10,2011-06-02,08:31:51,16:13:47\n'
+                '12,2013-10-01,08:00:00,16:00:00\n'
+                '10,2013-09-10,09:00:00,17:00:00\n'
+            )
+        self.partitions = os.path.join(self.directory, 'partitions')
+        self.names = utils.split_csv(self.path, self.partitions)
+        self.data = utils.load_data(self.path)
+        main.app.config.update({
+            'DATA_CSV': self.path, 'USERS_DB_FILE': TEST_USERS_XML,
+        })
+        self.client = main.app.test_client()
+        forget_data()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('DATA_BACKEND', None)
+        main.app.config.pop('DATA_PARTITIONS', None)
+        main.app.config.pop('DATA_PARTITIONS_BUDGET', None)
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        shutil.rmtree(self.directory)
+        forget_data()
+
+    def test_split(self):
+        """
+        Test splitting CSV file by month.
+        """
+        self.assertEqual(self.names, ['2011-06', '2013-09', '2013-10'])
+        self.assertEqual(
+            sorted(os.listdir(self.partitions)),
+            ['2011-06.csv', '2013-09.csv', '2013-10.csv', 'manifest.json'],
+        )
+        path = partitions.partition_path(self.partitions, '2011-06')
+        with open(path) as partition_file:
+            self.assertEqual(partition_file.read(), (
+                '10,2011-06-01,08:38:43,17:19:02\n'
+                '10,2011-06-02,08:31:51,16:13:47\n'
+            ))
+        _, manifest = partitions.read_manifest(self.partitions)
+        self.assertEqual([partition.rows for partition in manifest], [2, 9, 1])
+        self.assertEqual(
+            manifest[1].first_day, datetime.date(2013, 9, 5).toordinal(),
+        )
+        self.assertEqual(manifest[1].stats[10], self.data[10].weekday_stats(
+            datetime.date(2013, 9, 1).toordinal(),
+        ))
+
+        inodes = [os.stat(partition.path).st_ino for partition in manifest]
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('12,2013-10-02,08:00:00,16:00:00\n')
+        utils.split_csv(self.path, self.partitions)
+        self.assertEqual(
+            [os.stat(partition.path).st_ino for partition in manifest][:2],
+            inodes[:2],
+        )
+        _, manifest = partitions.read_manifest(self.partitions)
+        self.assertEqual(manifest[2].rows, 2)
+
+    def test_store(self):
+        """
+        Test answering queries by loading only needed partitions.
+        """
+        store = partitions.PartitionedStore(self.partitions, utils.load_data)
+        self.assertEqual(sorted(store), [10, 11, 12])
+        self.assertIn(12, store)
+        self.assertNotIn('12', store)
+        for user_id, user in self.data.iteritems():
+            self.assertEqual(store[user_id].stats, user.stats)
+            self.assertEqual(len(store[user_id]), len(user))
+        self.assertEqual(store.loaded.keys(), [])
+
+        first = datetime.date(2013, 9, 11).toordinal()
+        last = datetime.date(2013, 9, 30).toordinal()
+        for bounds in ((first, None), (None, last), (first, last)):
+            self.assertEqual(
+                store[10].weekday_stats(*bounds),
+                self.data[10].weekday_stats(*bounds),
+            )
+            self.assertEqual(
+                store[11].sketches(*bounds), self.data[11].sketches(*bounds),
+            )
+        self.assertEqual(store.loaded.keys(), ['2013-09'])
+
+        self.assertEqual(store[10].sketches(), self.data[10].sketches())
+        self.assertEqual(store[10].rows(), self.data[10].rows())
+        day = datetime.date(2011, 6, 2)
+        self.assertEqual(store[10][day], self.data[10][day])
+        self.assertIn(day, store[10])
+        self.assertNotIn(datetime.date(2011, 6, 3), store[10])
+        with self.assertRaises(TypeError):
+            store[10].merge([], [], [])
+
+        expected = company.company_stats(self.data)[None]
+        stats = partitions.company_stats(store)[None]
+        self.assertEqual(stats.users, expected.users)
+        self.assertEqual(stats.weekdays, expected.weekdays)
+        self.assertEqual(stats.arrivals, expected.arrivals)
+        self.assertEqual(stats.present, expected.present)
+
+    def test_budget(self):
+        """
+        Test evicting least recently used partitions over the budget.
+        """
+        store = partitions.PartitionedStore(
+            self.partitions, utils.load_data,
+            budget=10 * partitions.ENTRY_SIZE,
+        )
+        manifest = dict(
+            (partition.name, partition) for partition in store.partitions
+        )
+        store.partition(manifest['2011-06'])
+        store.partition(manifest['2013-10'])
+        self.assertEqual(store.loaded.keys(), ['2011-06', '2013-10'])
+        data = store.partition(manifest['2011-06'])
+        self.assertIs(store.partition(manifest['2011-06']), data)
+        self.assertEqual(store.loaded.keys(), ['2013-10', '2011-06'])
+        store.partition(manifest['2013-09'])
+        self.assertEqual(store.loaded.keys(), ['2013-09'])
+        self.assertEqual(store.loaded_size, 9 * partitions.ENTRY_SIZE)
+
+        store = partitions.PartitionedStore(
+            self.partitions, utils.load_data, previous=store,
+        )
+        self.assertEqual(store.loaded.keys(), ['2013-09'])
+
+    def test_views(self):
+        """
+        Test views serving partitions as they serve CSV file.
+        """
+        paths = [
+            '/api/v1/mean_time_weekday/10',
+            '/api/v1/presence_weekday/10?from=2013-09-11',
+            '/api/v1/presence_start_end/11?to=2013-09-10',
+            '/api/v1/presence_percentiles/10',
+            '/api/v1/weekday_stats?user_id=all&from=2011-06-02',
+            '/api/v1/company/mean_time_weekday',
+            '/api/v1/company/present_per_day',
+        ]
+        expected = [self.client.get(path) for path in paths]
+        forget_data()
+        main.app.config.update({
+            'DATA_BACKEND': 'partitions',
+            'DATA_PARTITIONS': self.partitions,
+            'DATA_PARTITIONS_BUDGET': 0,
+        })
+        self.assertIsInstance(utils.get_data(), partitions.PartitionedStore)
+        self.assertEqual(
+            utils.data_path(),
+            os.path.join(self.partitions, partitions.MANIFEST),
+        )
+        for path, response in zip(paths, expected):
+            resp = self.client.get(path)
+            self.assertEqual(resp.status_code, response.status_code, path)
+            self.assertEqual(
+                json.loads(resp.data), json.loads(response.data), path,
+            )
+        self.assertLessEqual(len(utils.get_data().loaded), 1)
+
+        store = utils.read_data()
+        self.assertIs(utils.read_data(), store)
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('13,2013-10-02,08:00:00,16:00:00\n')
+        utils.split_csv(self.path, self.partitions)
+        self.assertIsNot(utils.read_data(), store)
+        self.assertIn(13, utils.read_data())
 
 
 def suite():
@@ -290,6 +2236,29 @@ def suite():
     base_suite = unittest.TestSuite()
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerViewsTestCase))
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerUtilsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerStoreTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerCacheTestCase))
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerUpdateUsersTestCase)
+    )
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerSnapshotTestCase))
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerVectorizedTestCase)
+    )
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerProfilingTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerPreforkTestCase))
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerEventLoopTestCase)
+    )
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerRefresherTestCase)
+    )
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerDatabaseTestCase)
+    )
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerPartitionsTestCase)
+    )
     return base_suite
 
 
@@ -3,72 +3,275 @@
 Helper functions used in views.
 """
 
+import calendar
 import csv
-import xml.etree.ElementTree as etree
-import urllib
+import hashlib
+import json
+import locale
 import os
+import tempfile
+import urllib2
 import logging
 import threading
 import time
 
 from json import dumps
+from collections import namedtuple
+from shutil import copyfileobj
 from functools import wraps
 from datetime import datetime
 
-from flask import Response
+from flask import Response, abort, request
+from werkzeug.http import is_resource_modified
+
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+try:
+    import ujson
+except ImportError:
+    ujson = None  # pylint: disable=invalid-name
 
 from presence_analyzer.main import app
+from presence_analyzer import (
+    company,
+    database,
+    metrics,
+    partitions,
+    responses,
+    sketches,
+    snapshot,
+    vectorized,
+)
+from presence_analyzer.store import (
+    DataSource,
+    PresenceStore,
+    UserPresence,
+    WeekdayStats,
+    day_weekday,
+)
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
-LOCK = threading.Lock()
 CACHE = {}
 TIME = {}
+LOCKS = {}
+LOADED = {}
+
+# Amount of bytes from the end of already read part of CSV file, which
+# are compared to tell appended file from a replaced one.
+TAIL_SIZE = 256
+
+# Parsed USERS_DB_FILE with users listing sorted by name and serialized
+# to JSON and names of attributes of users, see get_users_directory.
+USERS = {}
+USERS_LOCK = threading.Lock()
+UsersDirectory = namedtuple(
+    'UsersDirectory',
+    ['version', 'names', 'listing', 'listing_json', 'users', 'attributes'],
+)
+
+# Encoded JSON bodies of views, see jsonify.
+ENCODED = {}
+ENCODED_SIZE = 10000
 
+# Version of data a response depends on: hashable tag, which changes
+# whenever the data does, and its modification time.
+DataVersion = namedtuple('DataVersion', ['tag', 'modified'])
 
-def jsonify(function):
+
+def jsonify(function=None, version=None):
     """
     Creates a response with the JSON representation of wrapped function result.
+
+    When version is given, it's called to get DataVersion of the data the
+    result depends on. Response then carries ETag of the version and
+    request arguments and Last-Modified of the data. Encoded body is kept
+    for every endpoint and request arguments and reused until the version
+    changes. Conditional requests get 304 Not Modified only instead of a
+    successful response: without the encoded body the function is called
+    first, so missing resources and invalid arguments get their errors.
     """
+    if function is None:
+        return lambda function: jsonify(function, version)
+
     @wraps(function)
+    @metrics.REQUEST_DURATION.time(endpoint=function.__name__)
     def inner(*args, **kwargs):
         """
         This docstring will be overridden by @wraps decorator.
         """
-        return Response(
-            dumps(function(*args, **kwargs)),
-            mimetype='application/json'
-        )
+        if version is None:
+            result = function(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            return json_response(encode_json(result))
+
+        key = encoded_key()
+        current = version()
+        etag = hashlib.sha1(repr((key, current.tag))).hexdigest()
+        modified = datetime.utcfromtimestamp(int(current.modified))
+        cached = ENCODED.get(key)
+        if cached is not None and cached[0] == current:
+            metrics.ENCODED_CACHE.inc(result='hit')
+            response = json_response(cached[1])
+        else:
+            metrics.ENCODED_CACHE.inc(result='miss')
+            response = function(*args, **kwargs)
+            if not isinstance(response, Response):
+                body = encode_json(response)
+                if len(ENCODED) >= ENCODED_SIZE:
+                    ENCODED.clear()
+                ENCODED[key] = (current, body)
+                response = json_response(body)
+        response.set_etag(etag)
+        response.last_modified = modified
+        if response.status_code == 200 and not is_resource_modified(
+                request.environ, etag, last_modified=modified,
+        ):
+            metrics.NOT_MODIFIED.inc(endpoint=function.__name__)
+            response = responses.not_modified(response)
+        return response
     return inner
 
 
-def lock(function):
-    @wraps(function)
-    def inner():
-        with LOCK:
-            result = function()
-            return result
-    return inner
+def encoded_key():
+    """
+    Returns key of encoded body of the current request.
+    """
+    return (
+        request.endpoint,
+        tuple(sorted((request.view_args or {}).items())),
+        tuple(sorted(request.args.items(multi=True))),
+    )
+
+
+@metrics.JSON_ENCODE_DURATION.time()
+def encode_json(value):
+    """
+    Serializes value to JSON.
 
+    ujson is used when installed unless JSON_ENCODER is set to 'json'.
+    It's several times faster than the standard library encoder, but
+    rounds floats to 15 decimal places.
+    """
+    if ujson is not None and app.config.get('JSON_ENCODER') != 'json':
+        return ujson.dumps(value, double_precision=15)
+    return dumps(value)
+
+
+def json_response(body):
+    """
+    Creates a response with already serialized JSON body.
+    """
+    return Response(body, mimetype='application/json')
+
+
+def data_version():
+    """
+    Returns DataVersion of loaded presence data.
+    """
+    source = get_data().source
+    return DataVersion(source, source.mtime)
 
-def cache(expiration_time, method_name):
 
+def users_version():
+    """
+    Returns DataVersion of users file.
+    """
+    version = get_users_directory().version
+    return DataVersion(version, version[1])
+
+
+def users_data_version():
+    """
+    Returns DataVersion of loaded presence data and users file.
+    """
+    data, users = data_version(), users_version()
+    return DataVersion(
+        (data.tag, users.tag), max(data.modified, users.modified),
+    )
+
+
+def cache(expiration_time, method_name=None):
+    """
+    Caches results of decorated function for given amount of seconds.
+
+    Results are cached separately for every combination of arguments.
+    Reading a fresh value doesn't take any lock. When the value expires,
+    exactly one thread computes it again while other threads keep getting
+    the stale value; threads wait only when there's no value at all yet.
+    Calling refresh attribute of decorated function computes the value in
+    advance, e.g. from a background thread.
+    """
     def inner(method):
+        name = method_name or method.__name__
+
         @wraps(method)
-        def wrapped():
-            time_now = time.time()
+        def wrapped(*args, **kwargs):
+            """
+            This docstring will be overridden by @wraps decorator.
+            """
+            key = cache_key(name, args, kwargs)
+            if TIME.get(key, 0) > time.time() and key in CACHE:
+                metrics.CACHE.inc(function=name, result='hit')
+                return CACHE[key]
 
-            if TIME.get(method_name, time_now) > time_now:
-                return CACHE.get(method_name)
+            key_lock = LOCKS.setdefault(key, threading.Lock())
+            if key in CACHE:
+                if not key_lock.acquire(False):
+                    # other thread is already computing the value
+                    metrics.CACHE.inc(function=name, result='stale')
+                    return CACHE[key]
+            else:
+                started = time.time()
+                key_lock.acquire()
+                metrics.CACHE_LOCK_WAIT.observe(
+                    time.time() - started, function=name,
+                )
+
+            try:
+                if TIME.get(key, 0) > time.time() and key in CACHE:
+                    metrics.CACHE.inc(function=name, result='hit')
+                    return CACHE[key]
+                metrics.CACHE.inc(
+                    function=name,
+                    result='reload' if key in CACHE else 'miss',
+                )
+                result = method(*args, **kwargs)
+                CACHE[key] = result
+                TIME[key] = time.time() + expiration_time
+                return result
+            finally:
+                key_lock.release()
 
-            result = method()
-            CACHE[method_name] = result
-            TIME[method_name] = time_now + expiration_time
+        def refresh(*args, **kwargs):
+            """
+            Computes the value again and caches it, even if it's fresh.
+            """
+            key = cache_key(name, args, kwargs)
+            with LOCKS.setdefault(key, threading.Lock()):
+                metrics.CACHE.inc(function=name, result='refresh')
+                result = method(*args, **kwargs)
+                CACHE[key] = result
+                TIME[key] = time.time() + expiration_time
             return result
+
+        wrapped.refresh = refresh
         return wrapped
     return inner
 
 
-@lock
+def cache_key(name, args, kwargs):
+    """
+    Returns key of cached result of function called with given arguments.
+    """
+    if not args and not kwargs:
+        return name
+    return (name, args, tuple(sorted(kwargs.items())))
+
+
 @cache(600, 'get_data')
 def get_data():
     """
@@ -76,7 +279,7 @@ def get_data():
 
     It creates structure like this:
     data = {
-        'user_id': {
+        'user_id': UserPresence({
             datetime.date(2013, 10, 1): {
                 'start': datetime.time(9, 0, 0),
                 'end': datetime.time(17, 30, 0),
@@ -85,41 +288,523 @@ def get_data():
                 'start': datetime.time(8, 30, 0),
                 'end': datetime.time(16, 45, 0),
             },
-        }
+        })
     }
+
+    See presence_analyzer.store for details of the storage.
+
+    When the file was only appended to since it was last read, just the
+    new rows are parsed and merged into previously loaded data. With
+    DATA_SNAPSHOT enabled, data loaded by the process for the first time
+    is read from a binary snapshot and rows appended since the snapshot
+    was written are parsed. The snapshot is written whenever the whole
+    file is parsed, not on every append, which would cost the size of
+    the whole history. With DATA_SHARED enabled (prefork workers), data
+    is only read from the snapshot, see get_shared_data.
+
+    With DATA_BACKEND set to 'sqlite', entries are queried from database
+    imported from the CSV file instead, see read_sqlite_data. With
+    'partitions', months of the CSV file are loaded when queries need
+    them, see read_partitioned_data.
+
+    While the background refresher watches the data file, expired data
+    isn't read again here, the refresher reads it, so requests never wait.
+    """
+    data = LOADED.get('get_data')
+    if data is not None and LOADED.get('watched') == data_path():
+        return data
+    data = LOADED['get_data'] = read_data()
+    return data
+
+
+def watch_data(data):
+    """
+    Replaces loaded presence data with given, already warmed data and
+    stops requests from reading the data file, see refresher.
+    """
+    LOADED['get_data'] = data
+    LOADED['watched'] = data_path()
+    get_data.refresh()
+
+
+def read_data():
+    """
+    Reads current presence data of DATA_BACKEND without caching, see
+    get_data.
+
+    Data is only returned, requests keep getting loaded data until it's
+    replaced by get_data or watch_data.
+    """
+    backend = app.config.get('DATA_BACKEND', 'csv')
+    try:
+        read = DATA_BACKENDS[backend]
+    except KeyError:
+        raise ValueError('Unknown DATA_BACKEND: {}'.format(backend))
+    return read()
+
+
+def data_path():
+    """
+    Returns path of the file presence data is read from.
+    """
+    backend = app.config.get('DATA_BACKEND', 'csv')
+    if backend == 'sqlite':
+        return sqlite_path()
+    if backend == 'partitions':
+        return partitions.manifest_path(partitions_directory())
+    return app.config['DATA_CSV']
+
+
+def sqlite_path():
+    """
+    Returns path of SQLite database of presence data.
+
+    It's DATA_SQLITE, by default database next to DATA_CSV.
+    """
+    return (
+        app.config.get('DATA_SQLITE') or
+        database.database_path(app.config['DATA_CSV'])
+    )
+
+
+def read_sqlite_data():
+    """
+    Returns SQLiteStore of presence data, see flask-ctl import.
+
+    Store is opened again only when the database file changed.
+    """
+    path = sqlite_path()
+    previous = LOADED.get('get_data')
+    if isinstance(previous, database.SQLiteStore):
+        stat = os.stat(path)
+        if previous.source[:4] == (
+                path, stat.st_ino, stat.st_size, stat.st_mtime,
+        ):
+            return previous
+    return database.SQLiteStore(path)
+
+
+def import_csv(csv_path, db_path, batch_size=database.BATCH_SIZE):
+    """
+    Imports presence CSV file into SQLite database.
+
+    Returns amount of imported rows.
+    """
+    with open(csv_path, 'r') as csvfile:
+        return database.import_rows(db_path, read_rows(csvfile), batch_size)
+
+
+def partitions_directory():
+    """
+    Returns directory of partitions of presence data.
+
+    It's DATA_PARTITIONS, by default directory next to DATA_CSV.
+    """
+    return (
+        app.config.get('DATA_PARTITIONS') or
+        partitions.partitions_path(app.config['DATA_CSV'])
+    )
+
+
+def read_partitioned_data():
+    """
+    Returns PartitionedStore of presence data, see flask-ctl split.
+
+    Store is created again only when the manifest changed, keeping loaded
+    partitions which didn't change. Loaded partitions are limited by
+    DATA_PARTITIONS_BUDGET bytes.
+    """
+    directory = partitions_directory()
+    previous = LOADED.get('get_data')
+    if not isinstance(previous, partitions.PartitionedStore):
+        previous = None
+    elif partitions.is_current(
+            previous.source, partitions.manifest_path(directory)):
+        return previous
+    return partitions.PartitionedStore(
+        directory,
+        load_data,
+        app.config.get('DATA_PARTITIONS_BUDGET', partitions.BUDGET),
+        previous,
+    )
+
+
+def split_csv(csv_path, directory):
+    """
+    Splits presence CSV file into partitions by month and writes their
+    manifest.
+
+    Returns names of partitions.
+    """
+    with open(csv_path, 'r') as csvfile:
+        paths = partitions.write_partitions(directory, read_rows(csvfile))
+    entries = [
+        partitions.describe(name, partitions.partition_path(directory, name),
+                            load_data(path))
+        for name, path in sorted(paths.iteritems())
+    ]
+    partitions.replace_partitions(directory, paths)
+    replace_file(
+        partitions.manifest_path(directory),
+        lambda manifest: json.dump({'partitions': entries}, manifest),
+    )
+    return [entry['name'] for entry in entries]
+
+
+def read_csv_data():
+    """
+    Reads current presence data of DATA_CSV, see get_data.
+    """
+    path = app.config['DATA_CSV']
+    if app.config.get('DATA_SHARED', False):
+        return get_shared_data(path)
+    previous = LOADED.get('get_data')
+    if previous is not None and previous.source.path != path:
+        previous = None
+    use_snapshot = app.config.get('DATA_SNAPSHOT', False)
+    if previous is None and use_snapshot:
+        previous = read_snapshot(path)
+
+    data, mode = load_csv(path, previous)
+    if use_snapshot and mode == 'full':
+        try:
+            write_snapshot(data)
+        except (IOError, OSError):
+            log.warning('Unable to write snapshot of %s', path, exc_info=True)
+    return data
+
+
+# Functions reading presence data of every DATA_BACKEND.
+DATA_BACKENDS = {
+    'csv': read_csv_data,
+    'sqlite': read_sqlite_data,
+    'partitions': read_partitioned_data,
+}
+
+
+def get_shared_data(path):
+    """
+    Returns presence data mapped from snapshot written by another process.
+
+    Snapshot is mapped again only when it was replaced. Without a valid
+    snapshot, the data is loaded from the CSV file as usual, but no
+    snapshot is written, that's up to the process which shares the data.
+    """
+    try:
+        stat = os.stat(snapshot.snapshot_path(path))
+        version = (stat.st_ino, stat.st_mtime, stat.st_size)
+    except OSError:
+        version = None
+    shared_version, shared = LOADED.get('shared', (None, None))
+    if (version is not None and shared_version == version and
+            shared.source.path == path):
+        return shared
+
+    data = read_snapshot(path, shared=True) if version is not None else None
+    if data is None:
+        previous = LOADED.get('get_data')
+        if previous is not None and previous.source.path != path:
+            previous = None
+        return load_data(path, previous)
+    LOADED['shared'] = (version, data)
+    return data
+
+
+def read_snapshot(csv_path, shared=False):
+    """
+    Reads snapshot of presence data loaded from given CSV file.
+
+    Returns None when there's no valid snapshot.
+    """
+    path = snapshot.snapshot_path(csv_path)
+    try:
+        return snapshot.load(path, shared)
+    except (IOError, OSError, ValueError, KeyError):
+        log.debug('Unable to read snapshot %s', path, exc_info=True)
+        return None
+
+
+def write_snapshot(data):
+    """
+    Writes snapshot of presence data next to the CSV file it was read from.
+    """
+    replace_file(
+        snapshot.snapshot_path(data.source.path),
+        lambda snapshot_file: snapshot.dump(data, snapshot_file),
+    )
+
+
+def load_data(path, previous=None):
+    """
+    Loads presence data from CSV file, reusing previously loaded data.
+    """
+    return load_csv(path, previous)[0]
+
+
+def load_csv(path, previous=None):
+    """
+    Loads presence data from CSV file like load_data.
+
+    Returns the data and how the file was read: 'full', 'append' or None
+    when previous data is up to date.
+    """
+    with open(path, 'r') as csvfile:
+        stat = os.fstat(csvfile.fileno())
+        source = getattr(previous, 'source', None)
+        started = time.time()
+        if is_appended(csvfile, stat, source):
+            if (stat.st_size, stat.st_mtime) == (source.size, source.mtime):
+                return previous, None
+            mode = 'append'
+            lines = CSVTail(csvfile, source.offset)
+            data = previous.merge(read_rows(lines))
+            log.debug(
+                'Read %d new bytes of %s', lines.offset - source.offset, path,
+            )
+        else:
+            mode = 'full'
+            lines = CSVTail(csvfile, 0)
+            data = PresenceStore.from_rows(read_rows(lines))
+            log.debug('Read %d bytes of %s', lines.offset, path)
+        metrics.PARSE_DURATION.observe(time.time() - started, mode=mode)
+        metrics.ROWS_PARSED.inc(lines.count)
+
+        csvfile.seek(max(lines.offset - TAIL_SIZE, 0))
+        data.source = DataSource(
+            path=path,
+            inode=stat.st_ino,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            offset=lines.offset,
+            tail=csvfile.read(min(lines.offset, TAIL_SIZE)),
+        )
+    return data, mode
+
+
+def is_appended(csvfile, stat, source):
+    """
+    Checks if opened file is the one described by source with rows added.
+    """
+    if source is None or source.path != csvfile.name:
+        return False
+    if source.inode != stat.st_ino or source.offset > stat.st_size:
+        return False
+    csvfile.seek(source.offset - len(source.tail))
+    return csvfile.read(len(source.tail)) == source.tail
+
+
+class CSVTail(object):
+    """
+    Iterates over lines of file starting from given byte offset.
+
+    Offset of the end of the last complete line is kept, so the last line
+    without newline, which may still be written to, is read once again
+    on next refresh. Amount of read lines is counted too.
+    """
+    def __init__(self, csvfile, offset):
+        self.csvfile = csvfile
+        self.offset = offset
+        self.count = 0
+
+    def __iter__(self):
+        self.csvfile.seek(self.offset)
+        for line in self.csvfile:
+            if line.endswith('\n'):
+                self.offset += len(line)
+            self.count += 1
+            yield line
+
+
+def read_rows(csvfile):
     """
-    data = {}
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
-        presence_reader = csv.reader(csvfile, delimiter=',')
-        for i, row in enumerate(presence_reader):
+    Parses presence CSV file into (user_id, day, start, end) tuples.
+
+    Day is a date ordinal, start and end are seconds since midnight.
+
+    Rows in 'id,YYYY-MM-DD,HH:MM:SS,HH:MM:SS' layout are parsed by slicing
+    fixed-width fields, already parsed field values are reused. Other rows
+    go through the strict parse_row, invalid rows are logged and skipped.
+    """
+    days = FieldCache(parse_day)
+    times = FieldCache(parse_time)
+    for i, line in enumerate(csvfile):
+        row = line.rstrip('\r\n').split(',')
+        if len(row) != 4 or '"' in line:
+            row = next(csv.reader([line], delimiter=','), [])
             if len(row) != 4:
                 # ignore header and footer lines
                 continue
 
-            try:
-                user_id = int(row[0])
-                date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                start = datetime.strptime(row[2], '%H:%M:%S').time()
-                end = datetime.strptime(row[3], '%H:%M:%S').time()
-            except (ValueError, TypeError):
-                log.debug('Problem with line %d: ', i, exc_info=True)
+        try:
+            yield int(row[0]), days[row[1]], times[row[2]], times[row[3]]
+            continue
+        except ValueError:
+            pass
 
-            data.setdefault(user_id, {})[date] = {'start': start, 'end': end}
+        try:
+            yield parse_row(row)
+        except (ValueError, TypeError):
+            log.debug('Problem with line %d: ', i, exc_info=True)
+
+
+def parse_row(row):
+    """
+    Strictly parses CSV row into (user_id, day, start, end) tuple.
+    """
+    user_id = int(row[0])
+    date = datetime.strptime(row[1], '%Y-%m-%d').date()
+    start = datetime.strptime(row[2], '%H:%M:%S').time()
+    end = datetime.strptime(row[3], '%H:%M:%S').time()
+    return (
+        user_id,
+        date.toordinal(),
+        seconds_since_midnight(start),
+        seconds_since_midnight(end),
+    )
+
+
+def parse_day(value):
+    """
+    Parses 'YYYY-MM-DD' date into day ordinal.
+    """
+    digits = value[:4] + value[5:7] + value[8:]
+    if len(value) != 10 or value[4::3] != '--' or not digits.isdigit():
+        raise ValueError('Malformed date: {!r}'.format(value))
+    year, month, day = int(value[:4]), int(value[5:7]), int(value[8:])
+    return datetime(year, month, day).toordinal()
+
+
+def parse_time(value):
+    """
+    Parses 'HH:MM:SS' time into seconds since midnight.
+    """
+    digits = value[:2] + value[3:5] + value[6:]
+    if len(value) != 8 or value[2::3] != '::' or not digits.isdigit():
+        raise ValueError('Malformed time: {!r}'.format(value))
+    hour, minute, second = int(value[:2]), int(value[3:5]), int(value[6:])
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError('Time out of range: {!r}'.format(value))
+    return hour * 3600 + minute * 60 + second
 
-    return data
+
+class FieldCache(dict):
+    """
+    Memoizes results of parsing CSV fields.
+
+    Values which can't be parsed raise ValueError and aren't stored.
+    """
+    def __init__(self, parse):
+        super(FieldCache, self).__init__()
+        self.parse = parse
+
+    def __missing__(self, value):
+        result = self[value] = self.parse(value)
+        return result
 
 
 def get_users_names():
     """
     Extracts users data from XML file
     """
+    return get_users_directory().names
+
+
+def get_users_directory():
+    """
+    Returns UsersDirectory of USERS_DB_FILE.
+
+    The file is parsed again only when its modification time or size
+    changes. While the background refresher watches the file, it's not
+    checked at all, the refresher parses it.
+    """
+    path = app.config['USERS_DB_FILE']
+    directory = USERS.get('directory')
+    if (directory is not None and directory.version[0] == path and
+            USERS.get('watched') == path):
+        return directory
+    return read_users_directory(path)
+
+
+def read_users_directory(path):
+    """
+    Returns UsersDirectory of given file, parsing it only when it changed.
+    """
+    stat = os.stat(path)
+    version = (path, stat.st_mtime, stat.st_size)
+    directory = USERS.get('directory')
+    if directory is not None and directory.version == version:
+        return directory
+
+    with USERS_LOCK:
+        directory = USERS.get('directory')
+        if directory is None or directory.version != version:
+            directory = USERS['directory'] = load_users_directory(
+                path, version,
+            )
+    return directory
+
+
+def load_users_directory(path, version):
+    """
+    Parses XML file into UsersDirectory.
+    """
+    users = parse_users(path)
+    names = dict(
+        (user_id, {'name': user['name']})
+        for user_id, user in users.iteritems()
+    )
+    listing = sorted(
+        (
+            {'user_id': user_id, 'name': user['name']}
+            for user_id, user in names.iteritems()
+        ),
+        key=lambda user: locale.strxfrm(user['name']),
+    )
+    attributes = frozenset(
+        attribute for user in users.itervalues() for attribute in user
+    )
+    return UsersDirectory(
+        version, names, listing, dumps(listing), users, attributes,
+    )
+
+
+def parse_users(path):
+    """
+    Extracts attributes of users from XML file.
+
+    Attributes of user element and texts of its children are returned as
+    UTF-8 encoded strings. File is parsed incrementally and already read
+    users are dropped from the tree, so memory use doesn't grow with the
+    size of the file.
+    """
     users_data = {}
-    tree = etree.parse(app.config['USERS_DB_FILE'])
-    users = tree.find('users')
-    for user in users:
-        name = user.find('name').text
-        user_id = int(os.path.split(user.find('avatar').text)[1])
-        users_data.setdefault(user_id, {'name': name.encode("utf-8")})
+    depth = 0
+    section = None
+    # like tree.find('users'), only the first users section is read
+    users_read = False
+    for event, element in etree.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                section = element
+            continue
+
+        depth -= 1
+        if depth == 2 and section.tag == 'users' and not users_read:
+            name = element.find('name').text
+            user_id = int(os.path.split(element.find('avatar').text)[1])
+            attributes = dict(
+                (key, value.encode('utf-8'))
+                for key, value in element.attrib.iteritems()
+            )
+            for child in element:
+                attributes[child.tag] = (child.text or '').encode('utf-8')
+            attributes['name'] = name.encode("utf-8")
+            users_data.setdefault(user_id, attributes)
+            section.remove(element)
+        elif depth == 1:
+            users_read = users_read or section.tag == 'users'
+            element.clear()
 
     return users_data
 
@@ -127,9 +812,338 @@ def get_users_names():
 def update_user_names():
     """
     Updates file with user names
+
+    Response is streamed to a temporary file which replaces USERS_DB_FILE
+    once complete, so readers never see a partially written file. ETag and
+    Last-Modified of the last response are kept next to the file and sent
+    back, so unchanged file isn't downloaded again.
+
+    Returns True when the file was updated.
     """
-    with open(app.config['USERS_DB_FILE'], "w") as xml_file:
-        xml_file.write(urllib.urlopen(app.config['USERS_SOURCE']).read())
+    path = app.config['USERS_DB_FILE']
+    validators_path = path + '.validators'
+    source_request = urllib2.Request(app.config['USERS_SOURCE'])
+    if os.path.exists(path) and os.path.exists(validators_path):
+        with open(validators_path) as validators_file:
+            validators = json.load(validators_file)
+        if validators.get('etag'):
+            source_request.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            source_request.add_header(
+                'If-Modified-Since', validators['last_modified'],
+            )
+
+    try:
+        response = urllib2.urlopen(
+            source_request, timeout=app.config.get('USERS_SOURCE_TIMEOUT', 60),
+        )
+    except urllib2.HTTPError as error:
+        if error.code != 304:
+            raise
+        log.debug('%s not modified', app.config['USERS_SOURCE'])
+        return False
+
+    try:
+        replace_file(path, lambda xml_file: copyfileobj(response, xml_file))
+    finally:
+        response.close()
+    replace_file(validators_path, lambda validators_file: json.dump(
+        {
+            'etag': response.info().getheader('ETag'),
+            'last_modified': response.info().getheader('Last-Modified'),
+        },
+        validators_file,
+    ))
+    USERS.pop('directory', None)
+    return True
+
+
+def replace_file(path, write):
+    """
+    Atomically replaces file with content written by given function.
+    """
+    handle, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix='.{}.'.format(os.path.basename(path)),
+    )
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            write(temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0777)
+        except OSError:
+            os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def weekday_rows(items):
+    """
+    Iterates over (weekday, start, end) tuples of presence entries.
+
+    Start and end are given in seconds since midnight.
+    """
+    if isinstance(items, UserPresence):
+        for day, start, end in items.rows():
+            yield day_weekday(day), start, end
+        return
+
+    for date in items:
+        yield (
+            date.weekday(),
+            seconds_since_midnight(items[date]['start']),
+            seconds_since_midnight(items[date]['end']),
+        )
+
+
+@metrics.AGGREGATION_DURATION.time(function='weekday_stats')
+def weekday_stats(items, first_day=None, last_day=None):
+    """
+    Returns WeekdayStats of presence entries between given day ordinals.
+
+    Both bounds are inclusive, None means unbounded. Aggregates of
+    UserPresence are computed while loading the data.
+    """
+    if isinstance(items, UserPresence):
+        return items.weekday_stats(first_day, last_day)
+
+    days, starts, ends = [], [], []
+    for date in items:
+        day = date.toordinal()
+        if first_day is not None and day < first_day:
+            continue
+        if last_day is not None and day > last_day:
+            continue
+        days.append(day)
+        starts.append(seconds_since_midnight(items[date]['start']))
+        ends.append(seconds_since_midnight(items[date]['end']))
+    return WeekdayStats().add(days, starts, ends)
+
+
+@metrics.AGGREGATION_DURATION.time(function='all_weekday_stats')
+def all_weekday_stats(data, first_day=None, last_day=None):
+    """
+    Returns WeekdayStats of every user, see weekday_stats.
+
+    Stats are computed by vectorized NumPy backend when NumPy is installed
+    and ANALYTICS_BACKEND isn't set to 'python'. Stats of SQLiteStore are
+    computed by a grouped query.
+    """
+    if isinstance(data, database.SQLiteStore):
+        return data.all_weekday_stats(first_day, last_day)
+    use_numpy = app.config.get('ANALYTICS_BACKEND', 'numpy') == 'numpy'
+    if use_numpy and vectorized.available() and isinstance(
+            data, PresenceStore):
+        return vectorized.weekday_stats(data, first_day, last_day)
+    return dict(
+        (user_id, weekday_stats(items, first_day, last_day))
+        for user_id, items in data.iteritems()
+    )
+
+
+def warm_data(data):
+    """
+    Computes values derived from presence data which requests reuse.
+
+    Sketches are left to the first request for percentiles, they take
+    more memory than the entries. Nothing is computed for SQLiteStore,
+    which is queried on demand.
+    """
+    if isinstance(data, database.SQLiteStore):
+        return
+    all_weekday_stats(data)
+    get_company_stats(data=data)
+
+
+def get_company_stats(group_by=None, data=None):
+    """
+    Returns company.GroupStats of every group of users.
+
+    Users are grouped by value of given attribute from USERS_DB_FILE,
+    users without it are in '' group. Without group_by all users are in
+    group None. Stats are computed once per loaded data and users file.
+    Attribute which no user has raises ValueError, so arbitrary names
+    don't fill the data with cached stats.
+    """
+    if data is None:
+        data = get_data()
+    compute = company.company_stats
+    if isinstance(data, partitions.PartitionedStore):
+        compute = partitions.company_stats
+    elif isinstance(data, database.SQLiteStore):
+        compute = database.company_stats
+    if group_by is None:
+        return data.derive(('company_stats', None), lambda: compute(data))
+
+    directory = get_users_directory()
+    if group_by not in directory.attributes:
+        raise ValueError('Unknown attribute of users: {}'.format(group_by))
+
+    def group_of(user_id):
+        """
+        Returns group of given user.
+        """
+        return directory.users.get(user_id, {}).get(group_by, '')
+
+    return data.derive(
+        ('company_stats', group_by, directory.version),
+        lambda: compute(data, group_of),
+    )
+
+
+def company_result(format_stats):
+    """
+    Formats company stats for the current request.
+
+    Without 'group_by' request argument, format_stats is called with
+    GroupStats of all users. Otherwise dict of groups to formatted stats
+    is returned. Unknown attribute aborts the request with 400.
+    """
+    group_by = request.args.get('group_by')
+    try:
+        stats = get_company_stats(group_by)
+    except ValueError:
+        log.debug('Unknown group_by attribute: %r', group_by)
+        abort(400)
+    if group_by is None:
+        return format_stats(stats.get(None) or company.GroupStats())
+    return dict(
+        (group, format_stats(group_stats))
+        for group, group_stats in stats.iteritems()
+    )
+
+
+def arrivals_distribution(stats):
+    """
+    Returns amount of arrivals in every bin of company.GroupStats.
+    """
+    return [
+        (
+            '{:02}:{:02}'.format(*divmod(i * company.ARRIVAL_BIN // 60, 60)),
+            count,
+        )
+        for i, count in enumerate(stats.arrivals)
+    ]
+
+
+def present_per_day(stats):
+    """
+    Returns number of users present on every day of company.GroupStats.
+    """
+    return [
+        (datetime.fromordinal(day).date().isoformat(), stats.present[day])
+        for day in sorted(stats.present)
+    ]
+
+
+def date_range():
+    """
+    Returns day ordinals given by 'from' and 'to' request arguments.
+
+    Missing bounds are None, malformed dates abort the request with 400.
+    """
+    bounds = []
+    for name in ('from', 'to'):
+        value = request.args.get(name)
+        try:
+            bounds.append(parse_day(value) if value is not None else None)
+        except ValueError:
+            log.debug('Malformed %r date: %r', name, value)
+            abort(400)
+    return tuple(bounds)
+
+
+def requested_users():
+    """
+    Returns ids of users given by 'user_id' request arguments.
+
+    Every argument may hold comma separated ids, None is returned when
+    'all' users are requested. Missing or malformed ids abort the request
+    with 400.
+    """
+    values = ','.join(request.args.getlist('user_id')).split(',')
+    if 'all' in values:
+        return None
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        log.debug('Malformed user ids: %r', values)
+        abort(400)
+
+
+def mean_time_by_weekday(stats):
+    """
+    Returns mean presence time of every weekday from WeekdayStats.
+    """
+    return [
+        (calendar.day_abbr[weekday], sum_mean(total, count))
+        for weekday, (total, count) in enumerate(
+            zip(stats.intervals, stats.counts)
+        )
+    ]
+
+
+def total_time_by_weekday(stats):
+    """
+    Returns total presence time of every weekday from WeekdayStats.
+    """
+    result = [
+        (calendar.day_abbr[weekday], total)
+        for weekday, total in enumerate(stats.intervals)
+    ]
+
+    result.insert(0, ('Weekday', 'Presence (s)'))
+    return result
+
+
+def start_end_by_weekday(stats):
+    """
+    Returns mean start and end of presence of every weekday.
+    """
+    result = []
+    for k, count in enumerate(stats.counts):
+        result.append([
+            calendar.day_abbr[k],
+            [
+                int(sum_mean(stats.starts[k], count)),
+                int(sum_mean(stats.ends[k], count)),
+            ]
+        ])
+    return result
+
+
+def percentiles_by_weekday(weekday_sketches):
+    """
+    Returns histograms and percentiles of starts and ends of every weekday.
+
+    Histograms list start (in seconds since midnight) and amount of entries
+    of non-empty bins, percentiles are None for weekdays without entries.
+    """
+    result = []
+    for weekday in range(7):
+        summary = {}
+        for name, histograms in (
+                ('start', weekday_sketches.starts),
+                ('end', weekday_sketches.ends),
+        ):
+            histogram = histograms[weekday]
+            summary[name] = dict(
+                (
+                    'p{:g}'.format(fraction * 100),
+                    histogram.quantile(fraction),
+                )
+                for fraction in sketches.QUANTILES
+            )
+            summary[name]['histogram'] = [
+                (i * sketches.BIN_WIDTH, count)
+                for i, count in enumerate(histogram.counts) if count
+            ]
+        result.append([calendar.day_abbr[weekday], summary])
+    return result
 
 
 def group_by_weekday(items):
@@ -137,10 +1151,8 @@ def group_by_weekday(items):
     Groups presence entries by weekday.
     """
     result = [[], [], [], [], [], [], []]  # one list for every day in week
-    for date in items:
-        start = items[date]['start']
-        end = items[date]['end']
-        result[date.weekday()].append(interval(start, end))
+    for weekday, start, end in weekday_rows(items):
+        result[weekday].append(end - start)
     return result
 
 
@@ -165,17 +1177,22 @@ def mean(items):
     return float(sum(items)) / len(items) if len(items) > 0 else 0
 
 
+def sum_mean(total, count):
+    """
+    Calculates arithmetic mean from sum and amount of items.
+
+    Gives the same result as mean for a list of given sum and length.
+    """
+    return float(total) / count if count > 0 else 0
+
+
 def starts_ends_mean_of_presence(items):
     """
     Calculates arithmetic mean of starts and ends of presence by weekday.
     """
     result = {i: {'starts': [], 'ends': []} for i in range(7)}
 
-    for entry in items:
-        result[entry.weekday()]['starts'].append(
-            seconds_since_midnight(items[entry]['start'])
-        )
-        result[entry.weekday()]['ends'].append(
-            seconds_since_midnight(items[entry]['end'])
-        )
+    for weekday, start, end in weekday_rows(items):
+        result[weekday]['starts'].append(start)
+        result[weekday]['ends'].append(end)
     return result
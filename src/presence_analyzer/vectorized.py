@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized aggregations of presence data using NumPy.
+
+NumPy is optional, available() tells if this module can be used.
+"""
+from presence_analyzer.store import MappedColumn, WeekdayStats
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # pylint: disable=invalid-name
+
+
+def available():
+    """
+    Checks if NumPy is installed.
+    """
+    return numpy is not None
+
+
+class PresenceArrays(object):
+    """
+    Presence entries of all users of PresenceStore in flat NumPy arrays.
+
+    Entry i belongs to user user_ids[users[i]], its groups[i] identifies
+    the user and the weekday. Columns of every user are read from the store
+    without copying and then concatenated.
+    """
+    def __init__(self, store):
+        self.user_ids = sorted(store)
+        entries = [store[user_id] for user_id in self.user_ids]
+        self.users = numpy.repeat(
+            numpy.arange(len(entries)), [len(user) for user in entries],
+        )
+        self.days = column(user.days for user in entries)
+        self.starts = column(user.starts for user in entries)
+        self.ends = column(user.ends for user in entries)
+        self.groups = self.users * 7 + (self.days + 6) % 7
+
+
+def as_numpy(values):
+    """
+    Returns NumPy array sharing memory of array('i') or MappedColumn.
+    """
+    if isinstance(values, MappedColumn):
+        values = values.buffer
+    return numpy.frombuffer(values, dtype=numpy.intc)
+
+
+def column(arrays):
+    """
+    Concatenates array('i') columns into one NumPy array.
+    """
+    parts = [as_numpy(values) for values in arrays]
+    if not parts:
+        return numpy.zeros(0, dtype=numpy.intc)
+    return numpy.concatenate(parts)
+
+
+def presence_arrays(store):
+    """
+    Returns PresenceArrays of store, computing them once per store.
+    """
+    return store.derive('presence_arrays', lambda: PresenceArrays(store))
+
+
+def weekday_stats(store, first_day=None, last_day=None):
+    """
+    Returns WeekdayStats of every user of store.
+
+    Only entries between given day ordinals are taken into account, both
+    bounds are inclusive and None means unbounded.
+    """
+    arrays = presence_arrays(store)
+    groups = arrays.groups
+    starts, ends = arrays.starts, arrays.ends
+    if first_day is not None or last_day is not None:
+        selected = numpy.ones(len(groups), dtype=bool)
+        if first_day is not None:
+            selected &= arrays.days >= first_day
+        if last_day is not None:
+            selected &= arrays.days <= last_day
+        groups = groups[selected]
+        starts, ends = starts[selected], ends[selected]
+
+    size = len(arrays.user_ids) * 7
+    sums = [numpy.bincount(groups, minlength=size)]
+    for weights in (ends - starts, starts, ends):
+        # float sums of ints stay exact below 2 ** 53
+        sums.append(
+            numpy.bincount(groups, weights=weights, minlength=size)
+            .astype(numpy.int64)
+        )
+    counts, intervals, starts_sums, ends_sums = [
+        values.reshape(-1, 7).tolist() for values in sums
+    ]
+    return dict(
+        (
+            user_id,
+            WeekdayStats(
+                counts[i], intervals[i], starts_sums[i], ends_sums[i],
+            ),
+        )
+        for i, user_id in enumerate(arrays.user_ids)
+    )
@@ -3,21 +3,33 @@
 Defines views.
 """
 
-import calendar
 import logging
-import locale
-from flask import redirect, abort, url_for
+from flask import Response, redirect, abort, url_for
 from flask.ext.mako import render_template, MakoTemplates
 from mako.exceptions import TopLevelLookupException
 
+from presence_analyzer import metrics
+from presence_analyzer.helpers import static_url
 from presence_analyzer.main import app
 from presence_analyzer.utils import (
+    all_weekday_stats,
+    arrivals_distribution,
+    company_result,
+    data_version,
+    date_range,
     jsonify,
     get_data,
-    get_users_names,
-    mean,
-    group_by_weekday,
-    starts_ends_mean_of_presence,
+    get_users_directory,
+    json_response,
+    mean_time_by_weekday,
+    percentiles_by_weekday,
+    present_per_day,
+    requested_users,
+    start_end_by_weekday,
+    total_time_by_weekday,
+    users_data_version,
+    users_version,
+    weekday_stats,
 )
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -25,6 +37,14 @@ log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 mako = MakoTemplates(app)
 
 
+@app.context_processor
+def template_helpers():
+    """
+    Makes helper functions available in templates.
+    """
+    return {'static_url': static_url}
+
+
 @app.route('/')
 def mainpage():
     """
@@ -38,86 +58,158 @@ def mainpage():
 
 
 @app.route('/api/v1/users', methods=['GET'])
-@jsonify
+@jsonify(version=users_version)
 def users_view():
     """
     Users listing for dropdown.
     """
-    names = get_users_names()
-    data = [
-        {'user_id': i, 'name': names[i]['name']}
-        for i in names.keys()
-    ]
-    locale.setlocale(locale.LC_COLLATE, "")
-    sorted_data = sorted(data, key=lambda tup: tup['name'], cmp=locale.strcoll)
-    return sorted_data
+    return json_response(get_users_directory().listing_json)
 
 
 @app.route('/api/v1/mean_time_weekday/<int:user_id>', methods=['GET'])
-@jsonify
+@jsonify(version=data_version)
 def mean_time_weekday_view(user_id):
     """
     Returns mean presence time of given user grouped by weekday.
+
+    Optional 'from' and 'to' arguments (YYYY-MM-DD) limit the dates.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
-    result = [
-        (calendar.day_abbr[weekday], mean(intervals))
-        for weekday, intervals in enumerate(weekdays)
-    ]
-
-    return result
+    return mean_time_by_weekday(weekday_stats(data[user_id], *date_range()))
 
 
 @app.route('/api/v1/presence_weekday/<int:user_id>', methods=['GET'])
-@jsonify
+@jsonify(version=data_version)
 def presence_weekday_view(user_id):
     """
     Returns total presence time of given user grouped by weekday.
+
+    Optional 'from' and 'to' arguments (YYYY-MM-DD) limit the dates.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
-    result = [
-        (calendar.day_abbr[weekday], sum(intervals))
-        for weekday, intervals in enumerate(weekdays)
-    ]
-
-    result.insert(0, ('Weekday', 'Presence (s)'))
-    return result
+    return total_time_by_weekday(weekday_stats(data[user_id], *date_range()))
 
 
 @app.route('/api/v1/presence_start_end/<int:user_id>', methods=['GET'])
-@jsonify
+@jsonify(version=data_version)
 def presence_start_end_view(user_id):
     """
     Returns start and end time of given user grouped by weekday.
+
+    Optional 'from' and 'to' arguments (YYYY-MM-DD) limit the dates.
+    """
+    data = get_data()
+    if user_id not in data:
+        log.debug('User %s not found!', user_id)
+        abort(404)
+
+    return start_end_by_weekday(weekday_stats(data[user_id], *date_range()))
+
+
+@app.route('/api/v1/presence_percentiles/<int:user_id>', methods=['GET'])
+@jsonify(version=data_version)
+def presence_percentiles_view(user_id):
+    """
+    Returns histograms and percentiles of starts and ends of given user
+    grouped by weekday.
+
+    Optional 'from' and 'to' arguments (YYYY-MM-DD) limit the dates.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    raw_result = starts_ends_mean_of_presence(data[user_id])
-    result = []
-    for k in raw_result:
-        result.append([
-            calendar.day_abbr[k],
-            [
-                int(mean(raw_result[k]['starts'])),
-                int(mean(raw_result[k]['ends'])),
-            ]
-        ])
+    return percentiles_by_weekday(data[user_id].sketches(*date_range()))
+
+
+@app.route('/api/v1/weekday_stats', methods=['GET'])
+@jsonify(version=data_version)
+def weekday_stats_view():
+    """
+    Returns weekday statistics of many users at once.
+
+    Users are given by 'user_id' arguments, each may hold comma separated
+    ids or 'all'. Result maps ids of found users to results of
+    mean_time_weekday, presence_weekday and presence_start_end.
+    Optional 'from' and 'to' arguments (YYYY-MM-DD) limit the dates.
+    """
+    data = get_data()
+    first_day, last_day = date_range()
+    user_ids = requested_users()
+    if user_ids is None:
+        users_stats = all_weekday_stats(data, first_day, last_day)
+    else:
+        users_stats = {}
+        for user_id in user_ids:
+            if user_id not in data:
+                log.debug('User %s not found!', user_id)
+                continue
+            users_stats[user_id] = weekday_stats(
+                data[user_id], first_day, last_day,
+            )
+
+    result = {}
+    for user_id, stats in users_stats.iteritems():
+        result[user_id] = {
+            'mean_time_weekday': mean_time_by_weekday(stats),
+            'presence_weekday': total_time_by_weekday(stats),
+            'presence_start_end': start_end_by_weekday(stats),
+        }
     return result
 
 
+@app.route('/api/v1/company/mean_time_weekday', methods=['GET'])
+@jsonify(version=users_data_version)
+def company_mean_time_weekday_view():
+    """
+    Returns mean presence time of all users grouped by weekday.
+
+    Optional 'group_by' argument names attribute of users to group them by.
+    """
+    return company_result(lambda stats: mean_time_by_weekday(stats.weekdays))
+
+
+@app.route('/api/v1/company/arrivals', methods=['GET'])
+@jsonify(version=users_data_version)
+def company_arrivals_view():
+    """
+    Returns distribution of arrival times of all users.
+
+    Optional 'group_by' argument names attribute of users to group them by.
+    """
+    return company_result(arrivals_distribution)
+
+
+@app.route('/api/v1/company/present_per_day', methods=['GET'])
+@jsonify(version=users_data_version)
+def company_present_per_day_view():
+    """
+    Returns number of users present on every day.
+
+    Optional 'group_by' argument names attribute of users to group them by.
+    """
+    return company_result(present_per_day)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    """
+    Returns metrics of the process in Prometheus text format.
+    """
+    return Response(
+        metrics.render(), mimetype='text/plain; version=0.0.4',
+    )
+
+
 @app.route('/<template_name>', methods=['GET'])
 def main_view(template_name=None):
     """